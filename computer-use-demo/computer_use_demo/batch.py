@@ -0,0 +1,296 @@
+"""
+First-turn evaluation of a whole task file through the Message Batches API.
+
+Each task's first request is built exactly as sampling_loop builds it, the requests
+are submitted as one batch, and every response is written as an ordinary run log. No
+tool is ever run, so no desktop is needed; WIDTH and HEIGHT only describe the screen
+advertised to the model. Run it with `python -m computer_use_demo.batch <tasks.json>`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from anthropic import Anthropic
+from anthropic.types.beta import BetaMessageParam
+from anthropic.types.beta.messages import BetaMessageBatch
+
+from .loop import (
+    PROVIDER_TO_DEFAULT_MODEL_NAME,
+    TOOL_NAMES,
+    APIProvider,
+    _inject_prompt_caching,
+    _response_to_params,
+    make_client,
+    tool_params,
+)
+from .metrics import MetricsRollup, TurnMetrics
+from .prompt import (
+    COMPUTER_USE_BETA_FLAG,
+    PROMPT_CACHING_BETA_FLAG,
+    PromptPrefix,
+    build_prefix,
+)
+from .transcript import BLOB_DIR_NAME, BlobStore, build_log, dump_log
+
+DEFAULT_POLL_INTERVAL = 30.0
+DEFAULT_LOG_DIR = Path(__file__).parent / "log"
+BATCH_PROVIDERS = (APIProvider.ANTHROPIC, APIProvider.REPLAY)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class BatchTask:
+    """
+    A dataset entry; reset_tools asks for fresh tool sessions, see ToolCollection.
+    Its names are checked when tasks are loaded; the batch path runs no tools.
+    """
+
+    identifier: str
+    task: str
+    reset_tools: bool | list[str] = False
+
+
+@dataclass(kw_only=True)
+class BatchOutcome:
+    """Where a batch's logs went, and the tasks whose request did not succeed."""
+
+    batch_id: str
+    log_paths: list[Path] = field(default_factory=list)
+    failures: dict[str, str] = field(default_factory=dict)
+    metrics: MetricsRollup = field(default_factory=MetricsRollup)
+
+
+def load_tasks(path: str | os.PathLike[str]) -> list[BatchTask]:
+    """
+    Load a dataset file: a list of objects with `identifier` and `task`. Raises
+    ValueError if a task would reset tools that do not exist.
+    """
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(data, list):
+        raise ValueError(f"{path} must contain a list of tasks")
+    tasks = [
+        BatchTask(
+            identifier=item["identifier"],
+            task=item["task"],
+            reset_tools=item.get("reset_tools", False),
+        )
+        for item in data
+        if isinstance(item, dict) and "identifier" in item and "task" in item
+    ]
+    check_reset_tools(tasks, TOOL_NAMES)
+    return tasks
+
+
+def check_reset_tools(tasks: list[BatchTask], names: frozenset[str]):
+    """Raise ValueError for tasks that would reset tools which are not advertised."""
+    unknown = {
+        task.identifier: sorted(set(task.reset_tools) - names)
+        for task in tasks
+        if isinstance(task.reset_tools, list) and not names.issuperset(task.reset_tools)
+    }
+    if unknown:
+        raise ValueError(f"Unknown tools to reset: {unknown}")
+
+
+def first_turn_request(
+    task: str,
+    *,
+    model: str,
+    system_prompt_suffix: str = "",
+    max_tokens: int = 4096,
+    prefix: PromptPrefix | None = None,
+) -> dict[str, Any]:
+    """
+    The Messages API parameters of sampling_loop's first request for a task. A
+    prefix built once can be passed in place of the suffix to share it over tasks.
+    """
+    prefix = prefix or build_prefix(tool_params(), system_prompt_suffix)
+    messages: list[BetaMessageParam] = [
+        {"role": "user", "content": [{"type": "text", "text": task}]}
+    ]
+    _inject_prompt_caching(messages)
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": prefix.system(cache=True),
+        "tools": prefix.tools,
+        "messages": messages,
+    }
+
+
+def submit_batch(
+    client: Anthropic, requests: list[dict[str, Any]]
+) -> tuple[BetaMessageBatch, list[str]]:
+    """Submit first-turn requests as one batch; returns the batch and the custom ids."""
+    # custom ids must match [a-zA-Z0-9_-]{1,64}, which dataset identifiers need not
+    custom_ids = [f"task-{index:05d}" for index in range(len(requests))]
+    batch = client.beta.messages.batches.create(
+        requests=[
+            {"custom_id": custom_id, "params": params}  # pyright: ignore[reportArgumentType]
+            for custom_id, params in zip(custom_ids, requests, strict=True)
+        ],
+        betas=[COMPUTER_USE_BETA_FLAG, PROMPT_CACHING_BETA_FLAG],
+    )
+    return batch, custom_ids
+
+
+def wait_for_batch(
+    client: Anthropic,
+    batch_id: str,
+    *,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    timeout: float | None = None,
+    sleep: Callable[[float], None] | None = None,
+) -> BetaMessageBatch:
+    """Poll a batch until it has ended, raising TimeoutError after timeout seconds."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        batch = client.beta.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            return batch
+        logger.info(
+            "batch %s: %d of %d requests processing",
+            batch_id,
+            batch.request_counts.processing,
+            sum(batch.request_counts.model_dump().values()),
+        )
+        if deadline is not None and time.monotonic() + poll_interval > deadline:
+            raise TimeoutError(f"Batch {batch_id} did not end within {timeout}s")
+        (sleep or time.sleep)(poll_interval)
+
+
+def write_batch_logs(
+    client: Anthropic,
+    batch_id: str,
+    tasks: dict[str, BatchTask],
+    requests: dict[str, dict[str, Any]],
+    log_dir: str | os.PathLike[str],
+    prefix: str,
+) -> BatchOutcome:
+    """
+    Write one run log per succeeded request, keyed by custom id in tasks and
+    requests, plus a metrics rollup over the whole batch.
+    """
+    log_dir = Path(log_dir)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    store = BlobStore(log_dir / BLOB_DIR_NAME)
+    timestamp = datetime.now().strftime("%Y-%m-%d")
+    outcome = BatchOutcome(batch_id=batch_id)
+
+    for response in client.beta.messages.batches.results(batch_id):
+        task = tasks[response.custom_id]
+        result = response.result
+        if result.type != "succeeded":
+            outcome.failures[task.identifier] = result.type
+            continue
+        turn_metrics = TurnMetrics(turn=1)
+        turn_metrics.record_usage(result.message.usage)
+        task_metrics = MetricsRollup()
+        task_metrics.add_turn(turn_metrics)
+        outcome.metrics.add_task(task_metrics)
+
+        messages = [
+            *requests[response.custom_id]["messages"],
+            {"role": "assistant", "content": _response_to_params(result.message)},
+        ]
+        log_data = build_log(
+            task.identifier, messages, timestamp, metrics=task_metrics.to_dict()
+        )
+        log_path = log_dir / f"{prefix}_{timestamp}_{task.identifier}.json"
+        log_path.write_bytes(dump_log(log_data, store))
+        outcome.log_paths.append(log_path)
+
+    metrics_path = log_dir / f"{prefix}_{timestamp}_metrics.json"
+    metrics_path.write_text(json.dumps(outcome.metrics.to_dict(), indent=4))
+    return outcome
+
+
+def run_batch(
+    tasks: list[BatchTask],
+    *,
+    provider: APIProvider,
+    api_key: str,
+    model: str,
+    log_dir: str | os.PathLike[str],
+    prefix: str,
+    system_prompt_suffix: str = "",
+    max_tokens: int = 4096,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    timeout: float | None = None,
+) -> BatchOutcome:
+    """Evaluate the first turn of every task in one batch and write the run logs."""
+    if provider not in BATCH_PROVIDERS:
+        raise ValueError(f"Message batches are not available for {provider}")
+    check_reset_tools(tasks, TOOL_NAMES)
+    client = make_client(provider, api_key)
+    assert isinstance(client, Anthropic)
+
+    prompt_prefix = build_prefix(tool_params(), system_prompt_suffix)
+    requests = [
+        first_turn_request(
+            task.task, model=model, max_tokens=max_tokens, prefix=prompt_prefix
+        )
+        for task in tasks
+    ]
+    batch, custom_ids = submit_batch(client, requests)
+    logger.info("submitted batch %s with %d requests", batch.id, len(requests))
+    wait_for_batch(client, batch.id, poll_interval=poll_interval, timeout=timeout)
+    return write_batch_logs(
+        client,
+        batch.id,
+        dict(zip(custom_ids, tasks, strict=True)),
+        dict(zip(custom_ids, requests, strict=True)),
+        log_dir,
+        prefix,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tasks", help="dataset file with identifier/task objects")
+    parser.add_argument(
+        "--provider",
+        type=APIProvider,
+        default=os.getenv("API_PROVIDER") or APIProvider.ANTHROPIC,
+    )
+    parser.add_argument("--model")
+    parser.add_argument("--system-prompt-suffix", default="")
+    parser.add_argument("--max-tokens", type=int, default=4096)
+    parser.add_argument("--log-dir", type=Path, default=DEFAULT_LOG_DIR)
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--timeout", type=float)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    outcome = run_batch(
+        load_tasks(args.tasks),
+        provider=args.provider,
+        api_key=os.getenv("ANTHROPIC_API_KEY", ""),
+        model=args.model or PROVIDER_TO_DEFAULT_MODEL_NAME[args.provider],
+        log_dir=args.log_dir,
+        prefix=Path(args.tasks).name,
+        system_prompt_suffix=args.system_prompt_suffix,
+        max_tokens=args.max_tokens,
+        poll_interval=args.poll_interval,
+        timeout=args.timeout,
+    )
+    logger.info(
+        "batch %s: wrote %d logs, %d failed %s",
+        outcome.batch_id,
+        len(outcome.log_paths),
+        len(outcome.failures),
+        outcome.failures or "",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Per-task limits on turns, tokens and wall-clock time for the sampling loop.
+"""
+
+import os
+from dataclasses import dataclass
+
+from .metrics import MetricsRollup
+
+
+@dataclass(frozen=True, kw_only=True)
+class TaskBudget:
+    """
+    Limits a task may use before sampling_loop stops it at the next turn boundary.
+    Input tokens include prompt-cache writes and reads. Unset limits are unbounded.
+    """
+
+    max_turns: int | None = None
+    max_input_tokens: int | None = None
+    max_output_tokens: int | None = None
+    max_seconds: float | None = None
+
+    @classmethod
+    def from_env(cls) -> "TaskBudget":
+        """
+        Read TASK_MAX_TURNS, TASK_MAX_INPUT_TOKENS, TASK_MAX_OUTPUT_TOKENS and
+        TASK_MAX_SECONDS; unset or 0 leaves a limit off.
+        """
+        return cls(
+            max_turns=int(os.getenv("TASK_MAX_TURNS") or 0) or None,
+            max_input_tokens=int(os.getenv("TASK_MAX_INPUT_TOKENS") or 0) or None,
+            max_output_tokens=int(os.getenv("TASK_MAX_OUTPUT_TOKENS") or 0) or None,
+            max_seconds=float(os.getenv("TASK_MAX_SECONDS") or 0) or None,
+        )
+
+    def exceeded(self, spent: MetricsRollup, elapsed: float) -> str | None:
+        """The reason to stop a task that has spent this much, if any."""
+        if self.max_turns is not None and spent.turns >= self.max_turns:
+            return f"turn budget of {self.max_turns} turns exhausted"
+        if (
+            self.max_input_tokens is not None
+            and spent.total_input_tokens >= self.max_input_tokens
+        ):
+            return f"input token budget of {self.max_input_tokens} exhausted"
+        if (
+            self.max_output_tokens is not None
+            and spent.output_tokens >= self.max_output_tokens
+        ):
+            return f"output token budget of {self.max_output_tokens} exhausted"
+        if self.max_seconds is not None and elapsed >= self.max_seconds:
+            return f"time budget of {self.max_seconds:g}s exhausted"
+        return None
@@ -0,0 +1,111 @@
+"""
+Paging and thumbnails for the chat transcript, so that a rerun renders a bounded
+slice of a long session and screenshots reach the browser small unless asked for.
+"""
+
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from PIL import Image
+
+from .tools import ImageData
+
+DEFAULT_TURNS_SHOWN = 10
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_CACHE_SIZE = 512
+
+
+def group_turns(messages: list[Any]) -> list[list[Any]]:
+    """
+    Split a conversation into turns: a user prompt on its own, or an assistant
+    message together with the tool results that answer it.
+    """
+    turns: list[list[Any]] = []
+    for message in messages:
+        if turns and _is_tool_results(message):
+            turns[-1].append(message)
+        else:
+            turns.append([message])
+    return turns
+
+
+def _is_tool_results(message: Any) -> bool:
+    content = message["content"]
+    return (
+        message["role"] == "user"
+        and isinstance(content, list)
+        and any(
+            isinstance(block, dict) and block.get("type") == "tool_result"
+            for block in content
+        )
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class HistoryPage:
+    """The turns on one page of history; page 0 holds the newest turns."""
+
+    turns: list[list[Any]]
+    first: int
+    total: int
+    page: int
+    pages: int
+
+
+def history_page(
+    messages: list[Any], *, turns_per_page: int = DEFAULT_TURNS_SHOWN, page: int = 0
+) -> HistoryPage:
+    """The page-th newest turns_per_page turns of a conversation, oldest first."""
+    turns = group_turns(messages)
+    turns_per_page = max(turns_per_page, 1)
+    pages = max(-(-len(turns) // turns_per_page), 1)
+    page = min(max(page, 0), pages - 1)
+    end = len(turns) - page * turns_per_page
+    first = max(end - turns_per_page, 0)
+    return HistoryPage(
+        turns=turns[first:end], first=first, total=len(turns), page=page, pages=pages
+    )
+
+
+class ThumbnailCache:
+    """
+    Downscaled JPEG copies of screenshots, memoized by image digest, so that each
+    capture is decoded and scaled once however often the transcript is redrawn.
+    The least recently used thumbnails are evicted beyond max_entries.
+    """
+
+    def __init__(
+        self, width: int = THUMBNAIL_WIDTH, max_entries: int = THUMBNAIL_CACHE_SIZE
+    ):
+        self.width = width
+        self.max_entries = max_entries
+        self._thumbnails: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image: ImageData) -> bytes:
+        with self._lock:
+            if (thumbnail := self._thumbnails.get(image.digest)) is not None:
+                self._thumbnails.move_to_end(image.digest)
+                return thumbnail
+        thumbnail = make_thumbnail(image, self.width)
+        with self._lock:
+            self._thumbnails[image.digest] = thumbnail
+            while len(self._thumbnails) > self.max_entries:
+                self._thumbnails.popitem(last=False)
+        return thumbnail
+
+    def __len__(self):
+        return len(self._thumbnails)
+
+
+def make_thumbnail(image: ImageData, width: int = THUMBNAIL_WIDTH) -> bytes:
+    """Scale an image down to width pixels wide, keeping its aspect ratio."""
+    with Image.open(io.BytesIO(image.data)) as source:
+        height = max(source.height * width // max(source.width, 1), 1)
+        source.thumbnail((width, height))
+        output = io.BytesIO()
+        source.convert("RGB").save(output, format="JPEG", quality=75)
+    return output.getvalue()
@@ -0,0 +1,191 @@
+"""
+Typed events sampling_loop publishes for the UI, logs and other consumers, and the
+bus that fans them out without making the agent wait on any of them.
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Any
+
+import httpx
+from anthropic.types.beta import BetaContentBlockParam
+
+from .metrics import TurnMetrics
+from .tools import ToolResult
+
+DEFAULT_QUEUE_SIZE = 256
+
+
+@dataclass(frozen=True, kw_only=True)
+class OutputEvent:
+    """A text or tool_use block of an assistant response."""
+
+    block: BetaContentBlockParam
+
+
+@dataclass(frozen=True, kw_only=True)
+class ToolOutputEvent:
+    result: ToolResult
+    tool_use_id: str
+
+
+@dataclass(frozen=True, kw_only=True)
+class ApiResponseEvent:
+    """An API exchange; response is None or an error body when error is set."""
+
+    request: httpx.Request
+    response: httpx.Response | object | None
+    error: Exception | None
+
+
+@dataclass(frozen=True, kw_only=True)
+class TurnEvent:
+    """A finished turn, as the TurnRecord given to turn_callback."""
+
+    record: dict[str, Any]
+
+
+@dataclass(frozen=True, kw_only=True)
+class MetricsEvent:
+    metrics: TurnMetrics
+
+
+@dataclass(frozen=True, kw_only=True)
+class StopEvent:
+    """The loop stopped a task early, e.g. on its budget."""
+
+    reason: str
+
+
+Event = (
+    OutputEvent
+    | ToolOutputEvent
+    | ApiResponseEvent
+    | TurnEvent
+    | MetricsEvent
+    | StopEvent
+)
+
+
+class DropPolicy(StrEnum):
+    # the publisher waits for room: nothing is lost, at the cost of backpressure
+    BLOCK = "block"
+    # the publisher never waits: a full queue loses its oldest or the new event
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class Subscription:
+    """
+    A bounded queue of the events of some types, drained with `async for`. Iteration
+    ends once the bus is closed and every queued event has been consumed.
+    """
+
+    def __init__(
+        self,
+        kinds: tuple[type, ...],
+        max_size: int,
+        policy: DropPolicy,
+    ):
+        self.kinds = kinds
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.cancelled = False
+        self._events: deque[Event] = deque()
+        self._changed = asyncio.Condition()
+
+    def wants(self, event: Event) -> bool:
+        return not self.kinds or isinstance(event, self.kinds)
+
+    async def deliver(self, event: Event):
+        async with self._changed:
+            if self.policy == DropPolicy.BLOCK:
+                await self._changed.wait_for(
+                    lambda: len(self._events) < self.max_size or self.cancelled
+                )
+            elif len(self._events) >= self.max_size:
+                self.dropped += 1
+                if self.policy == DropPolicy.DROP_NEWEST:
+                    return
+                self._events.popleft()
+            if not self.cancelled:
+                self._events.append(event)
+                self._changed.notify_all()
+
+    async def close(self):
+        """End the iteration once the queued events have been consumed."""
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def cancel(self):
+        """
+        Stop taking events, e.g. when the consumer has failed, so that a blocked
+        publisher never waits on it again.
+        """
+        async with self._changed:
+            self.cancelled = True
+            self._events.clear()
+            self._changed.notify_all()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Event:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self._events or self.closed or self.cancelled
+            )
+            if not self._events:
+                raise StopAsyncIteration
+            event = self._events.popleft()
+            self._changed.notify_all()
+            return event
+
+
+class EventBus:
+    """Fans every published event out to the subscriptions that want its type."""
+
+    def __init__(self):
+        self._subscriptions: list[Subscription] = []
+        self.closed = False
+
+    def subscribe(
+        self,
+        *kinds: type,
+        max_size: int = DEFAULT_QUEUE_SIZE,
+        policy: DropPolicy = DropPolicy.BLOCK,
+    ) -> Subscription:
+        """Subscribe to events of the given types, or to all of them."""
+        subscription = Subscription(kinds, max_size, policy)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    async def publish(self, event: Event):
+        if self.closed:
+            raise RuntimeError("Cannot publish to a closed event bus")
+        for subscription in self._subscriptions:
+            if subscription.wants(event):
+                await subscription.deliver(event)
+
+    async def close(self):
+        """End every subscription once its consumer has drained what is queued."""
+        self.closed = True
+        for subscription in self._subscriptions:
+            await subscription.close()
+
+
+async def consume(subscription: Subscription, handler: Callable[[Event], None]) -> None:
+    """Hand every event of a subscription to handler, e.g. in a background task."""
+    try:
+        async for event in subscription:
+            handler(event)
+            # let the publisher and other consumers run between events
+            await asyncio.sleep(0)
+    finally:
+        await subscription.cancel()
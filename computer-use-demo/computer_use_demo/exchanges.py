@@ -0,0 +1,183 @@
+"""
+Bounded record of the HTTP exchanges made by the sampling loop, for debugging.
+"""
+
+import hashlib
+import itertools
+import json
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+DEFAULT_MAX_EXCHANGES = 50
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+@dataclass(kw_only=True, frozen=True)
+class Exchange:
+    """Summary of one request/response pair; bodies live on disk, not in memory."""
+
+    id: str
+    recorded_at: str
+    method: str
+    url: str
+    request_headers: dict[str, str]
+    request_digest: str
+    request_size: int
+    status_code: int | None = None
+    response_headers: dict[str, str] | None = None
+    elapsed: float | None = None
+    usage: dict[str, Any] | None = None
+    response_summary: str | None = None
+    error: str | None = None
+
+
+class ExchangeRecorder:
+    """
+    Keeps recent exchanges in an LRU of at most max_entries summaries, whose bodies
+    take at most max_bytes together. Full request and response bodies (which carry
+    every screenshot in the conversation) are spilled to spill_dir and only read
+    back when a payload is explicitly requested, which also marks the exchange as
+    recently used. A spill_dir the recorder made itself is removed on close, or
+    when the recorder is collected or the process exits.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_EXCHANGES,
+        spill_dir: str | Path | None = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="computer-use-http-"))
+            self._remove_spill_dir = weakref.finalize(
+                self, shutil.rmtree, self.spill_dir, ignore_errors=True
+            )
+        else:
+            self.spill_dir = Path(spill_dir)
+            self._remove_spill_dir = None
+        self._exchanges: OrderedDict[str, Exchange] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._total_bytes = 0
+        self._ids = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._exchanges)
+
+    def __iter__(self) -> Iterator[Exchange]:
+        return iter(list(self._exchanges.values()))
+
+    def __getitem__(self, exchange_id: str) -> Exchange:
+        exchange = self._exchanges[exchange_id]
+        self._exchanges.move_to_end(exchange_id)
+        return exchange
+
+    def record(
+        self,
+        request: httpx.Request,
+        response: httpx.Response | object | None,
+        error: Exception | None = None,
+    ) -> Exchange:
+        exchange_id = str(next(self._ids))
+        request_body = request.read()
+        self._spill(exchange_id, "request", request_body)
+        size = len(request_body)
+
+        response_fields: dict[str, Any] = {}
+        if isinstance(response, httpx.Response):
+            self._spill(exchange_id, "response", response.content)
+            size += len(response.content)
+            response_fields = {
+                "status_code": response.status_code,
+                "response_headers": dict(response.headers),
+                "elapsed": _elapsed_seconds(response),
+                "usage": _usage(response),
+            }
+        elif response is not None:
+            response_fields = {"response_summary": str(response)}
+
+        exchange = Exchange(
+            id=exchange_id,
+            recorded_at=datetime.now().isoformat(timespec="milliseconds"),
+            method=request.method,
+            url=str(request.url),
+            request_headers=dict(request.headers),
+            request_digest=hashlib.sha256(request_body).hexdigest(),
+            request_size=len(request_body),
+            error=f"{error.__class__.__name__}: {error}" if error else None,
+            **response_fields,
+        )
+        self._exchanges[exchange_id] = exchange
+        self._sizes[exchange_id] = size
+        self._total_bytes += size
+        # the newest exchange is kept even if it alone is over the byte budget
+        while len(self._exchanges) > 1 and (
+            len(self._exchanges) > self.max_entries
+            or self._total_bytes > self.max_bytes
+        ):
+            evicted, _ = self._exchanges.popitem(last=False)
+            self._total_bytes -= self._sizes.pop(evicted)
+            for kind in ("request", "response"):
+                self._body_path(evicted, kind).unlink(missing_ok=True)
+        return exchange
+
+    @property
+    def total_bytes(self) -> int:
+        """Size of the bodies of the exchanges kept."""
+        return self._total_bytes
+
+    def request_body(self, exchange: Exchange) -> str:
+        return self._load(exchange, "request")
+
+    def response_body(self, exchange: Exchange) -> str:
+        return self._load(exchange, "response")
+
+    def close(self):
+        """Forget every exchange and delete the bodies spilled so far."""
+        for exchange_id in self._exchanges:
+            for kind in ("request", "response"):
+                self._body_path(exchange_id, kind).unlink(missing_ok=True)
+        self._exchanges.clear()
+        self._sizes.clear()
+        self._total_bytes = 0
+        if self._remove_spill_dir is not None:
+            self._remove_spill_dir()
+
+    def _body_path(self, exchange_id: str, kind: str) -> Path:
+        return self.spill_dir / f"{exchange_id}.{kind}.json"
+
+    def _spill(self, exchange_id: str, kind: str, body: bytes):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._body_path(exchange_id, kind).write_bytes(body)
+
+    def _load(self, exchange: Exchange, kind: str) -> str:
+        if exchange.id in self._exchanges:
+            self._exchanges.move_to_end(exchange.id)
+        path = self._body_path(exchange.id, kind)
+        return path.read_text() if path.exists() else ""
+
+
+def _elapsed_seconds(response: httpx.Response) -> float | None:
+    try:
+        return response.elapsed.total_seconds()
+    except RuntimeError:
+        # elapsed is only set once the response has been closed
+        return None
+
+
+def _usage(response: httpx.Response) -> dict[str, Any] | None:
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        return None
+    return body.get("usage") if isinstance(body, dict) else None
@@ -0,0 +1,175 @@
+"""
+Incremental JSONL run logs, written from a background thread as each turn completes.
+"""
+
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import IO, Any, Literal
+
+from .transcript import BlobStore, externalize_images
+
+Compression = Literal["zstd"]
+
+_CLOSE = object()
+
+
+class TurnLogSink:
+    """
+    Appends one JSON record per line to a log file. Records are handed as they are
+    to a writer thread through an unbounded queue, so the event loop never copies,
+    serializes or writes them, nor waits for a writer that falls behind; queued
+    records share their payloads with the conversation, so the backlog costs little
+    memory. Each record is flushed as soon as it is written, so a crash or stop
+    mid-task keeps every completed turn.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        *,
+        store: BlobStore | None = None,
+        compression: Compression | None = None,
+        rotate_bytes: int | None = None,
+    ):
+        self.path = Path(path)
+        self.store = store
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.error: Exception | None = None
+
+        self._zstd = _load_zstd(compression)
+        self._queue: queue.SimpleQueue[Any] = queue.SimpleQueue()
+        self._segment = 0
+        self._segment_bytes = 0
+        self._file: IO[bytes] | None = None
+        self._writer: Any = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"log-sink-{self.path.name}", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record: dict[str, Any]) -> None:
+        """
+        Queue a record for writing, without waiting. The writer thread reads the
+        record later, so nothing in it may be mutated once it is written: pass
+        message content through snapshot_content first.
+        """
+        if self.error:
+            raise self.error
+        self._queue.put_nowait(record)
+
+    def close(self) -> None:
+        """Flush all queued records and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self.error:
+            raise self.error
+
+    @property
+    def segment_paths(self) -> list[Path]:
+        return [self._segment_path(index) for index in range(self._segment + 1)]
+
+    def _segment_path(self, index: int) -> Path:
+        suffix = ".zst" if self.compression else ""
+        if index == 0:
+            return self.path.with_name(f"{self.path.name}{suffix}")
+        return self.path.with_name(
+            f"{self.path.stem}.{index}{self.path.suffix}{suffix}"
+        )
+
+    def _run(self):
+        try:
+            while (record := self._queue.get()) is not _CLOSE:
+                if self.store:
+                    record = externalize_images(record, self.store)
+                self._append(
+                    json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                )
+        except Exception as e:
+            self.error = e
+            # drop what is still queued; write() reports the error from now on
+            while self._queue.get() is not _CLOSE:
+                pass
+        finally:
+            self._close_segment()
+
+    def _append(self, line: bytes):
+        if (
+            self._file
+            and self.rotate_bytes
+            and self._segment_bytes + len(line) > self.rotate_bytes
+        ):
+            self._close_segment()
+            self._segment += 1
+        if self._file is None:
+            self._open_segment()
+        self._write_bytes(line)
+        self._segment_bytes += len(line)
+
+    def _open_segment(self):
+        path = self._segment_path(self._segment)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = path.open("ab")
+        self._segment_bytes = 0
+        if self._zstd:
+            self._writer = self._zstd.ZstdCompressor().stream_writer(
+                self._file, closefd=False
+            )
+
+    def _write_bytes(self, data: bytes):
+        if self._writer:
+            self._writer.write(data)
+            # one frame per record keeps every completed record decodable
+            self._writer.flush(self._zstd.FLUSH_FRAME)
+        else:
+            assert self._file
+            self._file.write(data)
+            self._file.flush()
+
+    def _close_segment(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _load_zstd(compression: Compression | None):
+    if compression is None:
+        return None
+    if compression != "zstd":
+        raise ValueError(f"Unsupported log compression: {compression}")
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "zstd log compression requires the `zstandard` package"
+        ) from e
+    return zstandard
+
+
+def read_records(path: str | os.PathLike[str]) -> list[dict[str, Any]]:
+    """Read every record from a (possibly zstd-compressed) JSONL log segment."""
+    path = Path(path)
+    if path.suffix == ".zst":
+        import zstandard
+
+        with path.open("rb") as file:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                file, read_across_frames=True
+            )
+            data = reader.read()
+    else:
+        data = path.read_bytes()
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
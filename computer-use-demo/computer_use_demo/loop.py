@@ -2,18 +2,22 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
-import platform
+import asyncio
+import os
+import time
 from collections.abc import Callable
-from datetime import datetime
 from enum import StrEnum
-from typing import Any, cast
+from functools import partial
+from typing import TYPE_CHECKING, Any, TypedDict, cast
 
 import httpx
 from anthropic import (
     Anthropic,
     AnthropicBedrock,
     AnthropicVertex,
+    APIConnectionError,
     APIError,
+    APIResponse,
     APIResponseValidationError,
     APIStatusError,
 )
@@ -26,48 +30,124 @@ from anthropic.types.beta import (
     BetaTextBlock,
     BetaTextBlockParam,
     BetaToolResultBlockParam,
+    BetaToolUnionParam,
     BetaToolUseBlockParam,
 )
 
-from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from .budget import TaskBudget
+from .events import (
+    ApiResponseEvent,
+    Event,
+    EventBus,
+    MetricsEvent,
+    OutputEvent,
+    StopEvent,
+    ToolOutputEvent,
+    TurnEvent,
+)
+from .metrics import MetricsRollup, TurnMetrics
+from .prompt import (
+    COMPUTER_USE_BETA_FLAG,
+    PROMPT_CACHING_BETA_FLAG,
+    build_prefix,
+)
+from .repetition import ActionLoopDetector
+from .replay import DEFAULT_REPLAY_BASE_URL
+from .response_cache import ResponseCache
+from .scheduler import (
+    MAX_SCHEDULED_ATTEMPTS,
+    RATE_LIMITED_STATUS_CODES,
+    RateLimitScheduler,
+    bucket_key,
+    retry_delay,
+)
+from .tools import (
+    BASH_POOL_SIZE,
+    BashTool,
+    Cancelled,
+    CancelToken,
+    ComputerTool,
+    EditTool,
+    ToolCollection,
+    ToolResult,
+    inline_images,
+)
+from .transcript import snapshot_content
 
-COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
-PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+if TYPE_CHECKING:
+    from .provider_pool import Backend, ProviderPool
 
 
 class APIProvider(StrEnum):
     ANTHROPIC = "anthropic"
     BEDROCK = "bedrock"
     VERTEX = "vertex"
+    REPLAY = "replay"
 
 
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.ANTHROPIC: "claude-3-5-sonnet-20241022",
     APIProvider.BEDROCK: "anthropic.claude-3-5-sonnet-20241022-v2:0",
     APIProvider.VERTEX: "claude-3-5-sonnet-v2@20241022",
+    APIProvider.REPLAY: "claude-3-5-sonnet-20241022",
 }
 
 
-# This system prompt is optimized for the Docker environment in this repository and
-# specific tool combinations enabled.
-# We encourage modifying this system prompt to ensure the model has context for the
-# environment it is running in, and to provide any additional information that may be
-# helpful for the task at hand.
-SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
-* You are utilising an Ubuntu virtual machine using {platform.machine()} architecture with internet access.
-* You can feel free to install Ubuntu applications with your bash tool. Use curl instead of wget.
-* To open firefox, please just click on the firefox icon.  Note, firefox-esr is what is installed on your system.
-* Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
-* When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_editor or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
-* When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
-* When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
-* The current date is {datetime.today().strftime('%A, %B %-d, %Y')}.
-</SYSTEM_CAPABILITY>
-
-<IMPORTANT>
-* When using Firefox, if a startup wizard appears, IGNORE IT.  Do not even click "skip this step".  Instead, click on the address bar where it says "Search or enter address", and enter the appropriate search term or URL there.
-* If the item you are looking at is a pdf, if after taking a single screenshot of the pdf it seems that you want to read the entire document instead of trying to continue to read the pdf from your screenshots + navigation, determine the URL, use curl to download the pdf, install and use pdftotext to convert it to a text file, and then read that text file directly with your StrReplaceEditTool.
-</IMPORTANT>"""
+class TurnRecord(TypedDict):
+    turn: int
+    assistant: list[BetaTextBlockParam | BetaToolUseBlockParam]
+    tool_results: list[BetaToolResultBlockParam]
+    api: dict[str, Any]
+    metrics: dict[str, Any]
+
+
+# the replay stand-in (see replay.py) mimics the Anthropic API, caching headers
+# included, so requests are built exactly as for ANTHROPIC
+PROMPT_CACHING_PROVIDERS = (APIProvider.ANTHROPIC, APIProvider.REPLAY)
+
+# tool result texts longer than this are collapsed to their head and tail once stale
+COMPACT_MIN_CHARS = 4000
+COMPACT_EXCERPT_CHARS = 1000
+# stale results are compacted this many at a time, however long they are kept
+COMPACT_CHUNK = 2
+
+
+def make_client(
+    provider: APIProvider, api_key: str, **client_options: Any
+) -> Anthropic | AnthropicVertex | AnthropicBedrock:
+    """Build the SDK client for a provider; client_options go to its constructor."""
+    if provider == APIProvider.ANTHROPIC:
+        return Anthropic(api_key=api_key, **{"max_retries": 4, **client_options})
+    if provider == APIProvider.VERTEX:
+        return AnthropicVertex(**client_options)
+    if provider == APIProvider.BEDROCK:
+        return AnthropicBedrock(**client_options)
+    if provider == APIProvider.REPLAY:
+        return Anthropic(
+            api_key=api_key or "replay",
+            **{
+                "base_url": os.getenv("REPLAY_BASE_URL", DEFAULT_REPLAY_BASE_URL),
+                "max_retries": 0,
+                **client_options,
+            },
+        )
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def build_tool_collection(bash_pool_size: int = BASH_POOL_SIZE) -> ToolCollection:
+    return ToolCollection(
+        ComputerTool(),
+        BashTool(pool_size=bash_pool_size),
+        EditTool(),
+    )
+
+
+TOOL_NAMES = frozenset({ComputerTool.name, BashTool.name, EditTool.name})
+
+
+def tool_params() -> list[BetaToolUnionParam]:
+    """The params of build_tool_collection's tools, without creating them."""
+    return [ComputerTool.params(), BashTool.params(), EditTool.params()]
 
 
 async def sampling_loop(
@@ -76,80 +156,212 @@ async def sampling_loop(
     provider: APIProvider,
     system_prompt_suffix: str,
     messages: list[BetaMessageParam],
-    output_callback: Callable[[BetaContentBlockParam], None],
-    tool_output_callback: Callable[[ToolResult, str], None],
+    api_key: str,
+    output_callback: Callable[[BetaContentBlockParam], None] | None = None,
+    tool_output_callback: Callable[[ToolResult, str], None] | None = None,
     api_response_callback: Callable[
         [httpx.Request, httpx.Response | object | None, Exception | None], None
-    ],
-    api_key: str,
+    ]
+    | None = None,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    turn_callback: Callable[[TurnRecord], None] | None = None,
+    metrics_callback: Callable[[TurnMetrics], None] | None = None,
+    response_cache: ResponseCache | None = None,
+    scheduler: RateLimitScheduler | None = None,
+    provider_pool: "ProviderPool | None" = None,
+    compact_tool_results_after: int | None = None,
+    budget: TaskBudget | None = None,
+    stop_callback: Callable[[str], None] | None = None,
+    loop_detector: ActionLoopDetector | None = None,
+    tool_collection: ToolCollection | None = None,
+    event_bus: EventBus | None = None,
+    cancel_token: CancelToken | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
-    """
-    tool_collection = ToolCollection(
-        ComputerTool(),
-        BashTool(),
-        EditTool(),
-    )
-    system = BetaTextBlockParam(
-        type="text",
-        text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
-    )
 
+    With a provider_pool, provider and api_key are ignored: every turn goes to the
+    pool's least-loaded healthy backend and fails over to the next one on server
+    errors and overload. With compact_tool_results_after, large tool result texts
+    are collapsed to an excerpt once that many turns old. A task that exhausts its
+    budget, or that a stopping loop_detector finds repeating itself, is stopped
+    before its next request and stop_callback gets the reason.
+
+    A tool_collection owned by the caller is reused as is, bash session included,
+    so callers running many tasks decide when to reset it; otherwise every call
+    builds its own, without pre-started shells that would outlive it.
+
+    Everything the callbacks get is also published to event_bus, if given, for
+    consumers that drain it at their own pace instead of holding up the loop.
+
+    Cancelling cancel_token stops the task as a budget would, with the token's
+    reason, but at once: the API request in flight is aborted and the running tool
+    call cancelled, its result and those of the turn's remaining tool calls being
+    interruption errors, so the returned history stays valid to continue from.
+    """
+    tool_collection = tool_collection or build_tool_collection(bash_pool_size=0)
+    prefix = build_prefix(tool_collection, system_prompt_suffix)
+
+    input_tokens_estimate = 0
+    spent = MetricsRollup()
+    start = time.monotonic()
+    turn = 0
+    stop_reason = None
     while True:
-        enable_prompt_caching = False
-        betas = [COMPUTER_USE_BETA_FLAG]
-        image_truncation_threshold = only_n_most_recent_images or 0
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        if enable_prompt_caching:
-            betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Because cached reads are 10% of the price, we don't think it's
-            # ever sensible to break the cache by truncating images
-            only_n_most_recent_images = 0
-            system["cache_control"] = {"type": "ephemeral"}
-
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
+        if cancel_token and cancel_token.reason and not stop_reason:
+            stop_reason = cancel_token.reason
+        if budget and not stop_reason:
+            stop_reason = budget.exceeded(spent, time.monotonic() - start)
+        if stop_reason:
+            if stop_callback:
+                stop_callback(stop_reason)
+            await _publish(event_bus, StopEvent(reason=stop_reason))
+            return messages
+        turn += 1
+        metrics = TurnMetrics(turn=turn)
+        if compact_tool_results_after:
+            metrics.compacted_tokens = _compact_stale_tool_results(
                 messages,
-                only_n_most_recent_images,
-                min_removal_threshold=image_truncation_threshold,
+                compact_tool_results_after,
+                min_compaction_chunk=COMPACT_CHUNK,
             )
+        failed_backends: set[str] = set()
+        response = None
+        while response is None:
+            if provider_pool:
+                backend = provider_pool.acquire(exclude=failed_backends)
+                turn_provider = backend.provider
+                turn_api_key = backend.api_key
+                turn_model = provider_pool.model_for(backend, model)
+                client = make_client(
+                    turn_provider, turn_api_key, **backend.client_options
+                )
+            else:
+                backend = None
+                turn_provider, turn_api_key, turn_model = provider, api_key, model
+                client = make_client(provider, api_key)
+            if scheduler:
+                # retries are left to _scheduled_create, which spaces rate-limited
+                # ones across every loop through the scheduler
+                client = client.with_options(max_retries=0)
+
+            betas = _prepare_request(turn_provider, messages, only_n_most_recent_images)
+            system = prefix.system(cache=turn_provider in PROMPT_CACHING_PROVIDERS)
+
+            cache_key = None
+            if response_cache:
+                cache_key = response_cache.key(
+                    provider=turn_provider,
+                    model=turn_model,
+                    max_tokens=max_tokens,
+                    system=system,
+                    tools=prefix.tools,
+                    messages=messages,
+                )
+                response = response_cache.get(cache_key)
+                metrics.response_cache_hit = response is not None
+            if response is not None:
+                if provider_pool and backend:
+                    provider_pool.release(backend)
+                break
 
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
+            # Call the API
+            # we use raw_response to provide debug information to streamlit. Your
+            # implementation may be able call the SDK directly with:
+            # `response = client.messages.create(...)` instead.
+            create = partial(
+                client.beta.messages.with_raw_response.create,
                 max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
+                messages=inline_images(messages),
+                model=turn_model,
+                system=system,
+                tools=prefix.tools,
                 betas=betas,
             )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
+            api_start = time.perf_counter()
+            error: APIError | None = None
+            try:
+                if scheduler:
+                    request = _scheduled_create(
+                        create,
+                        scheduler,
+                        bucket_key(turn_provider, turn_api_key),
+                        input_tokens_estimate,
+                        metrics,
+                        should_retry=partial(
+                            _retry_unless_failing_over,
+                            provider_pool=provider_pool,
+                            backend=backend,
+                            failed_backends=failed_backends,
+                        )
+                        if provider_pool and backend
+                        else _should_retry,
+                    )
+                else:
+                    # off the event loop, which stays free for tools and consumers
+                    request = asyncio.to_thread(create)
+                if cancel_token:
+                    raw_response = await cancel_token.race(request)
+                else:
+                    raw_response = await request
+            except APIError as e:
+                error = e
+            except Cancelled:
+                # closing the client aborts the request its thread is waiting on
+                client.close()
+                break
+            finally:
+                if provider_pool and backend:
+                    provider_pool.release(
+                        backend, failed=error is not None and _should_fail_over(error)
+                    )
+            if error is not None:
+                request, error_response = _error_exchange(error)
+                if api_response_callback:
+                    api_response_callback(request, error_response, error)
+                await _publish(
+                    event_bus,
+                    ApiResponseEvent(
+                        request=request, response=error_response, error=error
+                    ),
+                )
+                if (
+                    provider_pool
+                    and backend
+                    and _should_fail_over(error)
+                    and provider_pool.has_alternative(failed_backends | {backend.name})
+                ):
+                    failed_backends.add(backend.name)
+                    continue
+                return messages
+            metrics.api_latency = (
+                time.perf_counter() - api_start - metrics.scheduler_wait
+            )
 
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
+            http_response = raw_response.http_response
+            if api_response_callback:
+                api_response_callback(http_response.request, http_response, None)
+            await _publish(
+                event_bus,
+                ApiResponseEvent(
+                    request=http_response.request, response=http_response, error=None
+                ),
+            )
 
-        response = raw_response.parse()
+            response = raw_response.parse()
+            metrics.record_usage(response.usage)
+            # the next request carries this one's prompt plus a turn, so its size is
+            # a close lower bound for what the next request will draw from the budget
+            input_tokens_estimate = (
+                metrics.input_tokens
+                + metrics.cache_creation_input_tokens
+                + metrics.cache_read_input_tokens
+            )
+            if response_cache and cache_key:
+                response_cache.put(cache_key, response)
+        if response is None:
+            continue
 
         response_params = _response_to_params(response)
         messages.append(
@@ -161,16 +373,56 @@ async def sampling_loop(
 
         tool_result_content: list[BetaToolResultBlockParam] = []
         for content_block in response_params:
-            output_callback(content_block)
+            if output_callback:
+                output_callback(content_block)
+            await _publish(event_bus, OutputEvent(block=content_block))
             if content_block["type"] == "tool_use":
+                tool_start = time.perf_counter()
                 result = await tool_collection.run(
                     name=content_block["name"],
                     tool_input=cast(dict[str, Any], content_block["input"]),
+                    cancel_token=cancel_token,
                 )
+                metrics.record_tool(
+                    content_block["name"], time.perf_counter() - tool_start
+                )
+                if result.image:
+                    metrics.screenshot_bytes += result.image.size
+                if loop_detector:
+                    loop_detector.record(
+                        content_block["name"],
+                        cast(dict[str, Any], content_block["input"]),
+                        result,
+                    )
                 tool_result_content.append(
                     _make_api_tool_result(result, content_block["id"])
                 )
-                tool_output_callback(result, content_block["id"])
+                if tool_output_callback:
+                    tool_output_callback(result, content_block["id"])
+                await _publish(
+                    event_bus,
+                    ToolOutputEvent(result=result, tool_use_id=content_block["id"]),
+                )
+
+        if loop_detector and (cycle_length := loop_detector.cycle_length()):
+            metrics.action_loop = True
+            if loop_detector.stop:
+                stop_reason = loop_detector.reason(cycle_length)
+        spent.add_turn(metrics)
+        if metrics_callback:
+            metrics_callback(metrics)
+        await _publish(event_bus, MetricsEvent(metrics=metrics))
+        if turn_callback or event_bus:
+            record: TurnRecord = {
+                "turn": turn,
+                "assistant": snapshot_content(response_params),
+                "tool_results": snapshot_content(tool_result_content),
+                "api": _response_metadata(response),
+                "metrics": metrics.to_dict(),
+            }
+            if turn_callback:
+                turn_callback(record)
+            await _publish(event_bus, TurnEvent(record=dict(record)))
 
         if not tool_result_content:
             return messages
@@ -178,6 +430,117 @@ async def sampling_loop(
         messages.append({"content": tool_result_content, "role": "user"})
 
 
+async def _scheduled_create(
+    create: Callable[[], APIResponse[BetaMessage]],
+    scheduler: RateLimitScheduler,
+    key: str,
+    input_tokens: int,
+    metrics: TurnMetrics,
+    should_retry: Callable[[APIError], bool],
+) -> APIResponse[BetaMessage]:
+    """
+    Send a request once the scheduler admits it, retrying what the SDK itself would.
+    Rate-limited retries wait for the scheduler to unblock the bucket; others back
+    off on their own, with jitter.
+    """
+    attempts = 1
+    while True:
+        metrics.scheduler_wait += await scheduler.acquire(key, input_tokens)
+        try:
+            raw_response = await asyncio.to_thread(create)
+        except (APIStatusError, APIConnectionError) as e:
+            headers = {}
+            if isinstance(e, APIStatusError):
+                headers = e.response.headers
+                scheduler.record_response(key, headers, e.status_code)
+            if not should_retry(e) or attempts >= MAX_SCHEDULED_ATTEMPTS:
+                raise
+            if not _is_rate_limited(e):
+                delay = retry_delay(headers, attempts)
+                await asyncio.sleep(delay)
+                metrics.scheduler_wait += delay
+            attempts += 1
+            continue
+        scheduler.record_response(key, raw_response.http_response.headers)
+        return raw_response
+
+
+def _prepare_request(
+    provider: APIProvider,
+    messages: list[BetaMessageParam],
+    only_n_most_recent_images: int | None,
+) -> list[str]:
+    """
+    Set up prompt caching or image truncation in place for the provider a request
+    goes to, and return the betas to send.
+    """
+    betas = [COMPUTER_USE_BETA_FLAG]
+    if provider in PROMPT_CACHING_PROVIDERS:
+        betas.append(PROMPT_CACHING_BETA_FLAG)
+        _inject_prompt_caching(messages)
+        # Because cached reads are 10% of the price, we don't think it's
+        # ever sensible to break the cache by truncating images
+        return betas
+
+    # a pooled task may have been served by a caching provider on earlier turns
+    _strip_prompt_caching(messages)
+    if only_n_most_recent_images:
+        _maybe_filter_to_n_most_recent_images(
+            messages,
+            only_n_most_recent_images,
+            min_removal_threshold=only_n_most_recent_images,
+        )
+    return betas
+
+
+def _should_retry(error: APIError) -> bool:
+    """What the SDK retries: timeouts, conflicts, limits, server and connection errors."""
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def _is_rate_limited(error: APIError) -> bool:
+    return (
+        isinstance(error, APIStatusError)
+        and error.status_code in RATE_LIMITED_STATUS_CODES
+    )
+
+
+def _retry_unless_failing_over(
+    error: APIError,
+    *,
+    provider_pool: "ProviderPool",
+    backend: "Backend",
+    failed_backends: set[str],
+) -> bool:
+    """Retry as the SDK would, unless another backend of the pool can take over."""
+    if _should_fail_over(error) and provider_pool.has_alternative(
+        failed_backends | {backend.name}
+    ):
+        return False
+    return _should_retry(error)
+
+
+def _should_fail_over(error: APIError) -> bool:
+    """Server errors, overload and lost connections say nothing about the request."""
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def _error_exchange(error: APIError) -> tuple[httpx.Request, httpx.Response | object]:
+    """The request of a failed call and its response, or the error body without one."""
+    if isinstance(error, APIStatusError | APIResponseValidationError):
+        return error.request, error.response
+    return error.request, error.body
+
+
+async def _publish(event_bus: EventBus | None, event: Event):
+    if event_bus:
+        await event_bus.publish(event)
+
+
 def _maybe_filter_to_n_most_recent_images(
     messages: list[BetaMessageParam],
     images_to_keep: int,
@@ -227,6 +590,58 @@ def _maybe_filter_to_n_most_recent_images(
             tool_result["content"] = new_content
 
 
+def _compact_stale_tool_results(
+    messages: list[BetaMessageParam],
+    turns_to_keep: int,
+    min_compaction_chunk: int = COMPACT_CHUNK,
+) -> int:
+    """
+    Replace the text of tool results that are at least `turns_to_keep` turns old and
+    longer than COMPACT_MIN_CHARS with its head and tail, in place. Like image
+    removal, results are compacted in chunks of min_compaction_chunk so the prompt
+    cache is only broken once per chunk. Returns the estimated tokens saved.
+    """
+    stale_texts: list[tuple[dict[str, Any], str]] = []
+    turns_after = sum(1 for message in messages if message["role"] == "assistant")
+    for message in messages:
+        if message["role"] == "assistant":
+            turns_after -= 1
+            continue
+        if turns_after < turns_to_keep or not isinstance(message["content"], list):
+            continue
+        for item in message["content"]:
+            if not (isinstance(item, dict) and item.get("type") == "tool_result"):
+                continue
+            content = item.get("content")
+            if isinstance(content, str) and len(content) > COMPACT_MIN_CHARS:
+                stale_texts.append((cast(dict[str, Any], item), "content"))
+            elif isinstance(content, list):
+                stale_texts.extend(
+                    (block, "text")
+                    for block in content
+                    if isinstance(block, dict)
+                    and block.get("type") == "text"
+                    and len(block.get("text", "")) > COMPACT_MIN_CHARS
+                )
+
+    to_compact = len(stale_texts) - len(stale_texts) % min_compaction_chunk
+    saved_chars = 0
+    for block, field in stale_texts[:to_compact]:
+        text = block[field]
+        block[field] = _excerpt(text)
+        saved_chars += len(text) - len(block[field])
+    return saved_chars // 4
+
+
+def _excerpt(text: str) -> str:
+    elided = len(text) - 2 * COMPACT_EXCERPT_CHARS
+    return (
+        f"{text[:COMPACT_EXCERPT_CHARS]}\n"
+        f"[... {elided} characters of this earlier tool output were elided ...]\n"
+        f"{text[-COMPACT_EXCERPT_CHARS:]}"
+    )
+
+
 def _response_to_params(
     response: BetaMessage,
 ) -> list[BetaTextBlockParam | BetaToolUseBlockParam]:
@@ -239,6 +654,15 @@ def _response_to_params(
     return res
 
 
+def _response_metadata(response: BetaMessage) -> dict[str, Any]:
+    return {
+        "id": response.id,
+        "model": response.model,
+        "stop_reason": response.stop_reason,
+        "usage": response.usage.model_dump(),
+    }
+
+
 def _inject_prompt_caching(
     messages: list[BetaMessageParam],
 ):
@@ -263,6 +687,14 @@ def _inject_prompt_caching(
                 break
 
 
+def _strip_prompt_caching(messages: list[BetaMessageParam]):
+    for message in messages:
+        if isinstance(content := message["content"], list):
+            for block in content:
+                if isinstance(block, dict):
+                    block.pop("cache_control", None)
+
+
 def _make_api_tool_result(
     result: ToolResult, tool_use_id: str
 ) -> BetaToolResultBlockParam:
@@ -280,14 +712,16 @@ def _make_api_tool_result(
                     "text": _maybe_prepend_system_tool_result(result, result.output),
                 }
             )
-        if result.base64_image:
+        if result.image:
+            # the message keeps the shared ImageData; base64 is produced when the
+            # request is serialized
             tool_result_content.append(
                 {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
-                        "data": result.base64_image,
+                        "media_type": cast(Any, result.image.media_type),
+                        "data": cast(str, result.image),
                     },
                 }
             )
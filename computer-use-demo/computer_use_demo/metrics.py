@@ -0,0 +1,128 @@
+"""
+Token, prompt-cache and latency accounting for the sampling loop.
+"""
+
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from anthropic.types.beta import BetaUsage
+
+
+@dataclass(kw_only=True)
+class TurnMetrics:
+    """Usage and timing of a single assistant turn and the tools it called."""
+
+    turn: int
+    input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    output_tokens: int = 0
+    api_latency: float = 0.0
+    scheduler_wait: float = 0.0
+    tool_latency: dict[str, float] = field(default_factory=dict)
+    screenshot_bytes: int = 0
+    response_cache_hit: bool = False
+    compacted_tokens: int = 0
+    action_loop: bool = False
+
+    def record_usage(self, usage: BetaUsage):
+        self.input_tokens = usage.input_tokens
+        self.output_tokens = usage.output_tokens
+        # providers without prompt caching leave these unset
+        self.cache_creation_input_tokens = usage.cache_creation_input_tokens or 0
+        self.cache_read_input_tokens = usage.cache_read_input_tokens or 0
+
+    def record_tool(self, name: str, latency: float):
+        self.tool_latency[name] = self.tool_latency.get(name, 0.0) + latency
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass(kw_only=True)
+class MetricsRollup:
+    """Totals over the turns of a task, or over the tasks of a dataset."""
+
+    tasks: int = 0
+    turns: int = 0
+    input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    output_tokens: int = 0
+    api_latency: float = 0.0
+    scheduler_wait: float = 0.0
+    tool_latency: dict[str, float] = field(default_factory=dict)
+    screenshot_bytes: int = 0
+    response_cache_hits: int = 0
+    first_turns: int = 0
+    first_turn_cache_reads: int = 0
+    compacted_tokens: int = 0
+    action_loop_turns: int = 0
+
+    def add_turn(self, metrics: TurnMetrics):
+        self.turns += 1
+        if metrics.turn == 1 and not metrics.response_cache_hit:
+            self.first_turns += 1
+            self.first_turn_cache_reads += metrics.cache_read_input_tokens > 0
+        self.input_tokens += metrics.input_tokens
+        self.cache_creation_input_tokens += metrics.cache_creation_input_tokens
+        self.cache_read_input_tokens += metrics.cache_read_input_tokens
+        self.output_tokens += metrics.output_tokens
+        self.api_latency += metrics.api_latency
+        self.scheduler_wait += metrics.scheduler_wait
+        for name, latency in metrics.tool_latency.items():
+            self.tool_latency[name] = self.tool_latency.get(name, 0.0) + latency
+        self.screenshot_bytes += metrics.screenshot_bytes
+        self.response_cache_hits += metrics.response_cache_hit
+        self.compacted_tokens += metrics.compacted_tokens
+        self.action_loop_turns += metrics.action_loop
+
+    def add_task(self, task: "MetricsRollup"):
+        self.tasks += max(task.tasks, 1)
+        self.turns += task.turns
+        self.input_tokens += task.input_tokens
+        self.cache_creation_input_tokens += task.cache_creation_input_tokens
+        self.cache_read_input_tokens += task.cache_read_input_tokens
+        self.output_tokens += task.output_tokens
+        self.api_latency += task.api_latency
+        self.scheduler_wait += task.scheduler_wait
+        for name, latency in task.tool_latency.items():
+            self.tool_latency[name] = self.tool_latency.get(name, 0.0) + latency
+        self.screenshot_bytes += task.screenshot_bytes
+        self.response_cache_hits += task.response_cache_hits
+        self.first_turns += task.first_turns
+        self.first_turn_cache_reads += task.first_turn_cache_reads
+        self.compacted_tokens += task.compacted_tokens
+        self.action_loop_turns += task.action_loop_turns
+
+    @property
+    def total_input_tokens(self) -> int:
+        return (
+            self.input_tokens
+            + self.cache_creation_input_tokens
+            + self.cache_read_input_tokens
+        )
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of prompt tokens that were served from the prompt cache."""
+        if not self.total_input_tokens:
+            return 0.0
+        return self.cache_read_input_tokens / self.total_input_tokens
+
+    @property
+    def prefix_cache_hit_rate(self) -> float:
+        """
+        Share of first turns that read the system and tools prefix from the prompt
+        cache, i.e. that reused a prefix written by another task or worker.
+        """
+        if not self.first_turns:
+            return 0.0
+        return self.first_turn_cache_reads / self.first_turns
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "cache_hit_rate": self.cache_hit_rate,
+            "prefix_cache_hit_rate": self.prefix_cache_hit_rate,
+        }
@@ -0,0 +1,142 @@
+"""
+The system prompt and tool definitions that prefix every request.
+
+The API caches prompts by exact prefix, tools first and then system, so the prefix is
+assembled deterministically: workers and processes that share a date, machine and
+screen send byte-identical tools and system text, identified by a fingerprint.
+"""
+
+import hashlib
+import json
+import platform
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from functools import cached_property, lru_cache
+from typing import Any
+
+from anthropic.types.beta import (
+    BetaTextBlockParam,
+    BetaToolUnionParam,
+    BetaUsage,
+)
+
+from .tools import ToolCollection
+
+COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
+PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
+# cache entries live for five minutes after their last use
+PROMPT_CACHE_TTL_SECONDS = 300
+WARMUP_MESSAGE = "."
+
+# This system prompt is optimized for the Docker environment in this repository and
+# specific tool combinations enabled.
+# We encourage modifying this system prompt to ensure the model has context for the
+# environment it is running in, and to provide any additional information that may be
+# helpful for the task at hand.
+SYSTEM_PROMPT_TEMPLATE = """<SYSTEM_CAPABILITY>
+* You are utilising an Ubuntu virtual machine using {machine} architecture with internet access.
+* You can feel free to install Ubuntu applications with your bash tool. Use curl instead of wget.
+* To open firefox, please just click on the firefox icon.  Note, firefox-esr is what is installed on your system.
+* Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
+* When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_editor or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
+* When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
+* When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
+* The current date is {today}.
+</SYSTEM_CAPABILITY>
+
+<IMPORTANT>
+* When using Firefox, if a startup wizard appears, IGNORE IT.  Do not even click "skip this step".  Instead, click on the address bar where it says "Search or enter address", and enter the appropriate search term or URL there.
+* If the item you are looking at is a pdf, if after taking a single screenshot of the pdf it seems that you want to read the entire document instead of trying to continue to read the pdf from your screenshots + navigation, determine the URL, use curl to download the pdf, install and use pdftotext to convert it to a text file, and then read that text file directly with your StrReplaceEditTool.
+</IMPORTANT>"""
+
+
+def system_prompt(today: date | None = None, machine: str | None = None) -> str:
+    """The prompt for today, unless given another date; it changes at midnight."""
+    return _system_prompt(today or date.today(), machine or platform.machine())
+
+
+@lru_cache(maxsize=8)
+def _system_prompt(today: date, machine: str) -> str:
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        machine=machine, today=today.strftime("%A, %B %-d, %Y")
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class PromptPrefix:
+    """
+    The cacheable part of a request. The custom suffix is sent as a second system
+    block after the cache breakpoint, so runs with different suffixes still share
+    the cached tools and base prompt.
+    """
+
+    text: str
+    suffix: str
+    tools: list[BetaToolUnionParam]
+
+    @cached_property
+    def fingerprint(self) -> str:
+        canonical = json.dumps(
+            {"system": self.text, "tools": self.tools},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def system(self, cache: bool) -> list[BetaTextBlockParam]:
+        base = BetaTextBlockParam(type="text", text=self.text)
+        if cache:
+            base["cache_control"] = {"type": "ephemeral"}
+        if not self.suffix:
+            return [base]
+        return [base, BetaTextBlockParam(type="text", text=self.suffix)]
+
+
+def build_prefix(
+    tools: ToolCollection | list[BetaToolUnionParam],
+    system_prompt_suffix: str = "",
+    today: date | None = None,
+) -> PromptPrefix:
+    """The prefix advertising tools, given as a collection or as their params."""
+    return PromptPrefix(
+        text=system_prompt(today),
+        suffix=system_prompt_suffix,
+        tools=tools.to_params() if isinstance(tools, ToolCollection) else tools,
+    )
+
+
+_warmed: dict[str, float] = {}
+_warmed_lock = threading.Lock()
+
+
+def warm_prompt_cache(
+    client: Any, *, model: str, prefix: PromptPrefix, scope: str = ""
+) -> BetaUsage | None:
+    """
+    Write the prefix to the prompt cache with a one-token request, so that the first
+    turn of every task reads it instead of each worker creating it. Requests are
+    skipped while an earlier warmup for the same scope (the key or account the cache
+    belongs to), model and fingerprint is still live; returns the warmup's usage.
+    """
+    key = f"{scope}:{model}:{prefix.fingerprint}"
+    now = time.monotonic()
+    with _warmed_lock:
+        if now - _warmed.get(key, -PROMPT_CACHE_TTL_SECONDS) < PROMPT_CACHE_TTL_SECONDS:
+            return None
+        _warmed[key] = now
+    try:
+        response = client.beta.messages.create(
+            max_tokens=1,
+            model=model,
+            system=prefix.system(cache=True),
+            tools=prefix.tools,
+            messages=[{"role": "user", "content": WARMUP_MESSAGE}],
+            betas=[COMPUTER_USE_BETA_FLAG, PROMPT_CACHING_BETA_FLAG],
+        )
+    except Exception:
+        with _warmed_lock:
+            _warmed.pop(key, None)
+        raise
+    return response.usage
@@ -0,0 +1,191 @@
+"""
+A weighted pool of Anthropic, Bedrock and Vertex backends that sampling_loop routes
+turns across, with failover away from backends returning server errors.
+"""
+
+import json
+import os
+import threading
+import time
+from collections.abc import Collection
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from .loop import PROVIDER_TO_DEFAULT_MODEL_NAME, APIProvider
+
+DEFAULT_COOLDOWN_SECONDS = 30.0
+MAX_COOLDOWN_SECONDS = 600.0
+
+
+@dataclass(frozen=True, kw_only=True)
+class Backend:
+    """
+    One key or endpoint. max_in_flight is a soft limit: a backend at its limit is
+    only chosen once every healthy backend is. client_options are passed to the SDK
+    client, e.g. `aws_region` for Bedrock or `region` and `project_id` for Vertex.
+    """
+
+    name: str
+    provider: APIProvider
+    api_key: str = field(default="", repr=False)
+    weight: float = 1.0
+    max_in_flight: int | None = None
+    model: str | None = None
+    client_options: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(kw_only=True)
+class _Health:
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+
+
+class ProviderPool:
+    """
+    Routes each request to the healthy backend with the lowest in-flight load
+    relative to its weight. A backend that fails is skipped for a cooldown that
+    doubles with every consecutive failure, and is healthy again after a success.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        *,
+        cooldown: float = DEFAULT_COOLDOWN_SECONDS,
+    ):
+        if not backends:
+            raise ValueError("A provider pool needs at least one backend")
+        names = [backend.name for backend in backends]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Backend names must be unique: {names}")
+        for backend in backends:
+            # load is in-flight requests over weight, so it must be positive
+            if not backend.weight > 0:
+                raise ValueError(
+                    f"Backend {backend.name} needs a positive weight, not {backend.weight}"
+                )
+        self.backends = backends
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._health = {backend.name: _Health() for backend in backends}
+
+    @classmethod
+    def from_file(cls, path: str | os.PathLike[str]) -> "ProviderPool":
+        """
+        Load a pool from a JSON file such as
+
+        ```json
+        {
+            "cooldown": 30,
+            "backends": [
+                {"name": "key-a", "provider": "anthropic",
+                 "api_key_env": "ANTHROPIC_API_KEY_A", "weight": 2},
+                {"name": "bedrock-us", "provider": "bedrock", "max_in_flight": 4,
+                 "client_options": {"aws_region": "us-west-2"}}
+            ]
+        }
+        ```
+
+        Keys are read from the environment variable named by api_key_env so they
+        stay out of the file.
+        """
+        config = json.loads(Path(path).read_text(encoding="utf-8"))
+        backends = []
+        for entry in config["backends"]:
+            api_key_env = entry.get("api_key_env")
+            backends.append(
+                Backend(
+                    name=entry["name"],
+                    provider=APIProvider(entry["provider"]),
+                    api_key=os.getenv(api_key_env, "") if api_key_env else "",
+                    weight=float(entry.get("weight", 1.0)),
+                    max_in_flight=entry.get("max_in_flight"),
+                    model=entry.get("model"),
+                    client_options=entry.get("client_options", {}),
+                )
+            )
+        return cls(backends, cooldown=config.get("cooldown", DEFAULT_COOLDOWN_SECONDS))
+
+    def model_for(self, backend: Backend, model: str) -> str:
+        """
+        Translate a model name to the backend's provider: a provider's default model
+        maps to the default of the backend's provider, anything else is kept.
+        """
+        if backend.model:
+            return backend.model
+        if model in PROVIDER_TO_DEFAULT_MODEL_NAME.values():
+            return PROVIDER_TO_DEFAULT_MODEL_NAME[backend.provider]
+        return model
+
+    def acquire(self, exclude: Collection[str] = ()) -> Backend:
+        """Pick a backend for one request; every acquire needs a matching release."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                backend for backend in self.backends if backend.name not in exclude
+            ]
+            if not candidates:
+                raise ValueError("Every backend in the pool has been excluded")
+            healthy = [
+                backend
+                for backend in candidates
+                if self._health[backend.name].unhealthy_until <= now
+            ]
+            if healthy:
+                backend = min(
+                    healthy,
+                    key=lambda backend: (self._is_full(backend), self._load(backend)),
+                )
+            else:
+                backend = min(
+                    candidates,
+                    key=lambda backend: self._health[backend.name].unhealthy_until,
+                )
+            health = self._health[backend.name]
+            health.in_flight += 1
+            health.requests += 1
+            return backend
+
+    def release(self, backend: Backend, failed: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            health = self._health[backend.name]
+            health.in_flight -= 1
+            if not failed:
+                health.consecutive_failures = 0
+                health.unhealthy_until = 0.0
+                return
+            health.failures += 1
+            health.consecutive_failures += 1
+            cooldown = self.cooldown * 2 ** (health.consecutive_failures - 1)
+            health.unhealthy_until = now + min(cooldown, MAX_COOLDOWN_SECONDS)
+
+    def has_alternative(self, exclude: Collection[str]) -> bool:
+        return any(backend.name not in exclude for backend in self.backends)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                backend.name: {
+                    "provider": str(backend.provider),
+                    "healthy": self._health[backend.name].unhealthy_until <= now,
+                    "in_flight": self._health[backend.name].in_flight,
+                    "requests": self._health[backend.name].requests,
+                    "failures": self._health[backend.name].failures,
+                }
+                for backend in self.backends
+            }
+
+    def _load(self, backend: Backend) -> float:
+        return (self._health[backend.name].in_flight + 1) / backend.weight
+
+    def _is_full(self, backend: Backend) -> bool:
+        return (
+            backend.max_in_flight is not None
+            and self._health[backend.name].in_flight >= backend.max_in_flight
+        )
@@ -0,0 +1,72 @@
+"""
+Detection of degenerate trajectories where the agent repeats the same actions while
+the screen does not change.
+"""
+
+import hashlib
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from .tools import ToolResult
+
+LOOP_DETECTED = "loop_detected"
+
+
+@dataclass(kw_only=True)
+class ActionLoopDetector:
+    """
+    Fingerprints each tool call together with what it produced (output, error and
+    screenshot digest) and flags the trajectory once the last `min_repeats` cycles of
+    some length up to max_cycle_length, within the last `window` steps, are
+    identical. A detector keeps the history of one task, so use one per task. With
+    stop unset, loops are only counted in the turn metrics.
+    """
+
+    window: int = 12
+    max_cycle_length: int = 4
+    min_repeats: int = 3
+    stop: bool = True
+    _steps: deque[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.max_cycle_length * self.min_repeats > self.window:
+            raise ValueError("window is too short for max_cycle_length * min_repeats")
+        self._steps = deque(maxlen=self.window)
+
+    def record(self, name: str, tool_input: dict[str, Any], result: ToolResult):
+        self._steps.append(_fingerprint(name, tool_input, result))
+
+    def cycle_length(self) -> int | None:
+        """The length of the shortest cycle the recent steps repeat, if any."""
+        steps = list(self._steps)
+        for length in range(1, self.max_cycle_length + 1):
+            span = length * self.min_repeats
+            if span > len(steps):
+                break
+            recent = steps[-span:]
+            if all(recent[i] == recent[i % length] for i in range(length, span)):
+                return length
+        return None
+
+    def reason(self, length: int) -> str:
+        return (
+            f"{LOOP_DETECTED}: the last {length} action(s) repeated "
+            f"{self.min_repeats} times without changing the screen"
+        )
+
+
+def _fingerprint(name: str, tool_input: dict[str, Any], result: ToolResult) -> str:
+    step = json.dumps(
+        {
+            "name": name,
+            "input": tool_input,
+            "output": result.output,
+            "error": result.error,
+            "image": result.image.digest if result.image else None,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(step.encode()).hexdigest()
@@ -0,0 +1,408 @@
+"""
+Local stand-in for the Messages API that replays recorded or scripted assistant turns.
+
+The server speaks enough of the HTTP API for the SDK client used by sampling_loop, so
+selecting APIProvider.REPLAY exercises the whole loop, tool and logging path offline
+and deterministically. It also serves the Message Batches endpoints used by batch.py.
+Run it with `python -m computer_use_demo.replay <scripts...>`.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Literal
+
+DEFAULT_REPLAY_PORT = 8765
+DEFAULT_REPLAY_BASE_URL = f"http://127.0.0.1:{DEFAULT_REPLAY_PORT}"
+EXHAUSTED_TEXT = "Replay script exhausted."
+
+
+@dataclass(frozen=True, kw_only=True)
+class LatencyModel:
+    """Response delay distribution; seconds is the median for lognormal."""
+
+    distribution: Literal["fixed", "uniform", "lognormal"] = "fixed"
+    seconds: float = 0.0
+    spread: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """Parse `fixed:0.5`, `uniform:1.0:0.25` or `lognormal:1.0:0.4`."""
+        distribution, *params = spec.split(":")
+        if distribution not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        values = [float(param) for param in params] + [0.0, 0.0]
+        return cls(
+            distribution=distribution,  # pyright: ignore[reportArgumentType]
+            seconds=values[0],
+            spread=values[1],
+        )
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "uniform":
+            return max(
+                0.0, rng.uniform(self.seconds - self.spread, self.seconds + self.spread)
+            )
+        if self.distribution == "lognormal" and self.seconds > 0:
+            return rng.lognormvariate(math.log(self.seconds), self.spread)
+        return self.seconds
+
+
+@dataclass(frozen=True, kw_only=True)
+class ReplayScript:
+    """The assistant turns to serve for one task, matched by its first user message."""
+
+    turns: list[list[dict[str, Any]]]
+    task: str | None = None
+
+
+@dataclass(kw_only=True)
+class _ReplayBatch:
+    requests: list[dict[str, Any]]
+    created_at: datetime
+    polls: int = 0
+    ended_at: datetime | None = None
+    results: list[dict[str, Any]] = field(default_factory=list)
+
+
+def load_scripts(path: str | Path) -> list[ReplayScript]:
+    """
+    Load replay scripts from a run log (.json with `messages`), a per-turn log
+    (.jsonl with `assistant` records) or a scripted file: either a list of turns or
+    `{"task": ..., "turns": [...]}` / a list of such objects.
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".jsonl":
+        records = [json.loads(line) for line in text.splitlines() if line]
+        task = next(
+            (
+                _first_text(record["messages"])
+                for record in records
+                if "messages" in record
+            ),
+            None,
+        )
+        turns = [record["assistant"] for record in records if "assistant" in record]
+        return [ReplayScript(turns=turns, task=task)]
+
+    data = json.loads(text)
+    if isinstance(data, dict) and "messages" in data:
+        messages = data["messages"]
+        turns = [
+            message["content"]
+            for message in messages
+            if message["role"] == "assistant"
+            and not any(
+                isinstance(block, dict) and block.get("type") == "tool_result"
+                for block in message["content"]
+            )
+        ]
+        return [ReplayScript(turns=turns, task=_first_text(messages))]
+    if isinstance(data, dict):
+        data = [data]
+    if data and all(isinstance(item, dict) and "turns" in item for item in data):
+        return [
+            ReplayScript(turns=item["turns"], task=item.get("task")) for item in data
+        ]
+    return [ReplayScript(turns=data)]
+
+
+def _first_text(messages: list[dict[str, Any]]) -> str | None:
+    for message in messages:
+        if message.get("role") != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            return content
+        for block in content:
+            if isinstance(block, dict) and block.get("type") == "text":
+                return block["text"]
+    return None
+
+
+class ReplayServer:
+    """
+    Serves POST /v1/messages from replay scripts. The turn to replay is derived from
+    the number of assistant messages in the request, so the server holds no
+    per-session state and any number of concurrent tasks can share it.
+
+    The tools and system prefix is reported as written to the prompt cache on first
+    use and read from it afterwards. Message batches are answered from the same
+    scripts. A batch reports
+    `in_progress` for its first batch_polls retrievals, so clients exercise their
+    polling path, and ends on the next one.
+    """
+
+    def __init__(
+        self,
+        scripts: list[ReplayScript],
+        *,
+        latency: LatencyModel | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+        batch_polls: int = 1,
+    ):
+        self.scripts = {script.task: script for script in scripts}
+        self.default_script = scripts[0] if scripts else ReplayScript(turns=[])
+        self.latency = latency or LatencyModel()
+        self.requests_served = 0
+        self.batch_polls = batch_polls
+        self._batches: dict[str, _ReplayBatch] = {}
+        self._cached_prefixes: set[str] = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="replay-server", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def delay(self) -> float:
+        with self._lock:
+            self.requests_served += 1
+            return self.latency.sample(self._rng)
+
+    def respond(self, request: dict[str, Any]) -> dict[str, Any]:
+        messages = request.get("messages", [])
+        script = self.scripts.get(_first_text(messages), self.default_script)
+        turn = sum(1 for message in messages if message.get("role") == "assistant")
+        if turn < len(script.turns):
+            content = script.turns[turn]
+        else:
+            content = [{"type": "text", "text": EXHAUSTED_TEXT}]
+        stop_reason = (
+            "tool_use"
+            if any(block.get("type") == "tool_use" for block in content)
+            else "end_turn"
+        )
+        return {
+            "id": f"msg_replay_{turn:04d}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", "replay"),
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": len(json.dumps(messages)) // 4,
+                "output_tokens": len(json.dumps(content)) // 4,
+                **self._prefix_usage(request),
+            },
+        }
+
+    def _prefix_usage(self, request: dict[str, Any]) -> dict[str, int]:
+        """
+        Mimic prompt caching of the tools and system prefix: the first request with a
+        breakpoint on a given prefix writes it, later ones read it.
+        """
+        system = request.get("system")
+        breakpoints = [
+            index
+            for index, block in enumerate(system if isinstance(system, list) else [])
+            if isinstance(block, dict) and "cache_control" in block
+        ]
+        if not breakpoints:
+            return {"cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        prefix = json.dumps(
+            [request.get("model"), request.get("tools"), system[: breakpoints[-1] + 1]],
+            sort_keys=True,
+        )
+        key = hashlib.sha256(prefix.encode()).hexdigest()
+        with self._lock:
+            cached = key in self._cached_prefixes
+            self._cached_prefixes.add(key)
+        tokens = len(prefix) // 4
+        return {
+            "cache_creation_input_tokens": 0 if cached else tokens,
+            "cache_read_input_tokens": tokens if cached else 0,
+        }
+
+    def create_batch(self, body: dict[str, Any]) -> dict[str, Any]:
+        batch = _ReplayBatch(
+            requests=body.get("requests", []), created_at=datetime.now(timezone.utc)
+        )
+        with self._lock:
+            batch_id = f"msgbatch_replay_{len(self._batches):04d}"
+            self._batches[batch_id] = batch
+        return self._batch_payload(batch_id, batch)
+
+    def retrieve_batch(self, batch_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            batch.polls += 1
+            if batch.ended_at is None and batch.polls > self.batch_polls:
+                batch.results = [
+                    {
+                        "custom_id": request["custom_id"],
+                        "result": {
+                            "type": "succeeded",
+                            "message": self.respond(request["params"]),
+                        },
+                    }
+                    for request in batch.requests
+                ]
+                batch.ended_at = datetime.now(timezone.utc)
+        return self._batch_payload(batch_id, batch)
+
+    def batch_results(self, batch_id: str) -> list[dict[str, Any]] | None:
+        batch = self._batches.get(batch_id)
+        if batch is None or batch.ended_at is None:
+            return None
+        return batch.results
+
+    def _batch_payload(self, batch_id: str, batch: _ReplayBatch) -> dict[str, Any]:
+        ended = batch.ended_at is not None
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(batch.requests),
+                "succeeded": len(batch.results),
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": batch.created_at.isoformat(),
+            "expires_at": (batch.created_at + timedelta(days=1)).isoformat(),
+            "ended_at": batch.ended_at.isoformat() if batch.ended_at else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": (
+                f"{self.base_url}/v1/messages/batches/{batch_id}/results"
+                if ended
+                else None
+            ),
+        }
+
+
+def _make_handler(server: ReplayServer) -> type[BaseHTTPRequestHandler]:
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("content-length") or 0))
+            path = self.path.split("?")[0]
+            if path == "/v1/messages":
+                time.sleep(server.delay())
+                self._send_json(HTTPStatus.OK, server.respond(json.loads(body)))
+            elif path == "/v1/messages/batches":
+                self._send_json(HTTPStatus.OK, server.create_batch(json.loads(body)))
+            else:
+                self._send_not_found()
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if parts[:3] != ["v1", "messages", "batches"] or len(parts) not in (4, 5):
+                self._send_not_found()
+            elif len(parts) == 4 and (batch := server.retrieve_batch(parts[3])):
+                self._send_json(HTTPStatus.OK, batch)
+            elif (
+                parts[4:] == ["results"]
+                and (results := server.batch_results(parts[3])) is not None
+            ):
+                data = "".join(json.dumps(result) + "\n" for result in results)
+                self._send_bytes(HTTPStatus.OK, data.encode(), "application/x-jsonl")
+            else:
+                self._send_not_found()
+
+        def _send_not_found(self):
+            self._send_json(
+                HTTPStatus.NOT_FOUND,
+                {
+                    "type": "error",
+                    "error": {
+                        "type": "not_found_error",
+                        "message": f"{self.path} is not served by the replay provider",
+                    },
+                },
+            )
+
+        def _send_json(self, status: HTTPStatus, payload: dict[str, Any]):
+            self._send_bytes(status, json.dumps(payload).encode(), "application/json")
+
+        def _send_bytes(self, status: HTTPStatus, data: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(data)))
+            self.send_header("request-id", f"req_replay_{server.requests_served}")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return ReplayHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scripts", nargs="+", help="run logs or scripted turn files")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_REPLAY_PORT)
+    parser.add_argument(
+        "--latency",
+        type=LatencyModel.parse,
+        default=LatencyModel(),
+        help="fixed:<s>, uniform:<s>:<half-width> or lognormal:<median>:<sigma>",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--batch-polls",
+        type=int,
+        default=1,
+        help="retrievals a message batch reports in_progress before it ends",
+    )
+    args = parser.parse_args()
+
+    scripts = [script for path in args.scripts for script in load_scripts(path)]
+    server = ReplayServer(
+        scripts,
+        latency=args.latency,
+        host=args.host,
+        port=args.port,
+        seed=args.seed,
+        batch_polls=args.batch_polls,
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+On-disk cache of Messages API responses, for re-running datasets without paying for
+turns whose request is unchanged.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from anthropic.types.beta import BetaMessage
+
+from .tools import ImageData
+
+DEFAULT_MAX_ENTRIES = 2000
+
+
+class ResponseCache:
+    """
+    Maps a canonical hash of (provider, model, max_tokens, system, tools, messages)
+    to the parsed response. Images are hashed rather than inlined into the key, and
+    cache_control markers are ignored since they move between turns without changing
+    the output. Entries are evicted least-recently-used once max_entries is exceeded,
+    going by an index of the directory read once and kept up to date from then on.
+    """
+
+    def __init__(
+        self, directory: str | os.PathLike[str], max_entries: int = DEFAULT_MAX_ENTRIES
+    ):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = 0
+        self._index: OrderedDict[str, None] | None = None
+
+    def key(
+        self,
+        *,
+        provider: str,
+        model: str,
+        max_tokens: int,
+        system: Any,
+        tools: Any,
+        messages: Any,
+    ) -> str:
+        canonical = json.dumps(
+            _canonical(
+                {
+                    "provider": provider,
+                    "model": model,
+                    "max_tokens": max_tokens,
+                    "system": system,
+                    "tools": tools,
+                    "messages": messages,
+                }
+            ),
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> BetaMessage | None:
+        path = self._path(key)
+        try:
+            response = BetaMessage.model_validate_json(path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self._touch(path)
+        self._used(key)
+        self.hits += 1
+        return response
+
+    def put(self, key: str, response: BetaMessage):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(response.model_dump_json())
+        tmp_path.replace(path)
+        self._touch(path)
+        self._used(key)
+        self._evict()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _touch(self, path: Path):
+        # filesystem timestamps can be too coarse to order back-to-back accesses, so
+        # entries are stamped from a clock that strictly increases
+        self._clock = max(time.time_ns(), self._clock + 1)
+        os.utime(path, ns=(self._clock, self._clock))
+
+    def _entries(self) -> OrderedDict[str, None]:
+        """The keys on disk, least recently used first."""
+        if self._index is None:
+            entries = []
+            for entry in self.directory.glob("*.json"):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.stem))
+                except FileNotFoundError:
+                    continue
+            self._index = OrderedDict((key, None) for _, key in sorted(entries))
+        return self._index
+
+    def _used(self, key: str):
+        entries = self._entries()
+        entries[key] = None
+        entries.move_to_end(key)
+
+    def _evict(self):
+        entries = self._entries()
+        while len(entries) > self.max_entries:
+            key, _ = entries.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, ImageData):
+        return {"sha256": value.digest}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    source = value.get("source")
+    if (
+        value.get("type") == "image"
+        and isinstance(source, dict)
+        and isinstance(data := source.get("data"), str)
+    ):
+        value = {
+            **value,
+            "source": {
+                **source,
+                "data": {"sha256": ImageData.from_base64(data).digest},
+            },
+        }
+    return {
+        key: _canonical(item) for key, item in value.items() if key != "cache_control"
+    }
@@ -0,0 +1,803 @@
+"""
+Long-lived runner for dataset runs, controlled through a small local HTTP API.
+
+A run works through a task file as the Streamlit app does: each task goes through
+sampling_loop with the service's tools, and its run log and resume point are
+written as it ends, the dataset's metrics rollup once the run does. Runs live in
+this process, not in a browser session, so reloading or closing the UI neither
+interrupts nor loses them; the UI only starts, stops and polls them. Run it with
+`python -m computer_use_demo.runner`.
+
+    POST /runs                start a run, e.g. {"dataset": "tasks.json"}
+    GET  /runs                the status of every run
+    GET  /runs/<id>           the status of one run
+    GET  /runs/<id>/events    its newest events, ?after=<seq>&limit=<n>
+    POST /runs/<id>/stop      stop it, saving the current task's log
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Coroutine
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from enum import StrEnum
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, TypeVar
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from anthropic import APIError
+from anthropic.types.beta import BetaMessageParam
+
+from .batch import BatchTask, load_tasks
+from .budget import TaskBudget
+from .events import (
+    ApiResponseEvent,
+    Event,
+    EventBus,
+    MetricsEvent,
+    OutputEvent,
+    StopEvent,
+    ToolOutputEvent,
+    TurnEvent,
+    consume,
+)
+from .log_sink import TurnLogSink
+from .loop import (
+    PROMPT_CACHING_PROVIDERS,
+    PROVIDER_TO_DEFAULT_MODEL_NAME,
+    APIProvider,
+    build_tool_collection,
+    make_client,
+    sampling_loop,
+)
+from .metrics import MetricsRollup
+from .prompt import PromptPrefix, build_prefix, warm_prompt_cache
+from .provider_pool import ProviderPool
+from .repetition import ActionLoopDetector
+from .scheduler import bucket_key, shared_scheduler
+from .tools import CancelToken, ToolCollection
+from .transcript import (
+    BLOB_DIR_NAME,
+    BlobStore,
+    build_log,
+    dump_log,
+    snapshot_messages,
+)
+
+DEFAULT_RUNNER_PORT = 8502
+DEFAULT_RUNNER_URL = f"http://127.0.0.1:{DEFAULT_RUNNER_PORT}"
+DEFAULT_DATA_DIR = Path(__file__).parent / "data"
+DEFAULT_LOG_DIR = Path(__file__).parent / "log"
+# events each run keeps for pollers; older ones are only in the logs
+RECENT_EVENTS = 500
+EVENT_TEXT_CHARS = 2000
+STOPPED_BY_USER = "stopped_by_user"
+# scene-change tasks only prepare the desktop, and get no run log
+SCENE_CHANGE_PREFIX = "scenchg"
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RunState(StrEnum):
+    RUNNING = "running"
+    STOPPING = "stopping"
+    FINISHED = "finished"
+    STOPPED = "stopped"
+    FAILED = "failed"
+
+
+@dataclass(frozen=True, kw_only=True)
+class RunConfig:
+    """
+    What to run and how. An empty api_key falls back to the runner's
+    ANTHROPIC_API_KEY; restart ignores the dataset's resume point.
+    """
+
+    dataset: str
+    provider: APIProvider = APIProvider.ANTHROPIC
+    model: str | None = None
+    api_key: str = ""
+    system_prompt_suffix: str = ""
+    only_n_most_recent_images: int | None = 3
+    compact_tool_results_after: int | None = None
+    max_tokens: int = 4096
+    restart: bool = False
+    # the longest a task's first tool call waits for the desktop to settle after
+    # the last task, e.g. a scene change; the task's first API call does not wait
+    settle_timeout: float = 4.0
+
+    def __post_init__(self):
+        object.__setattr__(self, "provider", APIProvider(self.provider))
+        if Path(self.dataset).name != self.dataset or not self.dataset.endswith(
+            ".json"
+        ):
+            raise ValueError(f"{self.dataset!r} is not a dataset file name")
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "RunConfig":
+        """Build a config from a request body, rejecting unknown fields."""
+        if unknown := set(data) - {field.name for field in fields(cls)}:
+            raise ValueError(f"Unknown run options: {', '.join(sorted(unknown))}")
+        try:
+            return cls(**data)
+        except TypeError as e:
+            raise ValueError(str(e)) from e
+
+    def to_dict(self) -> dict[str, Any]:
+        """The config as reported in a run's status, without its credentials."""
+        data = asdict(self)
+        del data["api_key"]
+        return data
+
+
+class Run:
+    """
+    A dataset run: its progress, metrics rollup and newest events. The runner's
+    event loop updates it while HTTP threads read it, so every access is locked.
+    """
+
+    def __init__(self, run_id: str, config: RunConfig, tasks: list[BatchTask]):
+        self.id = run_id
+        self.config = config
+        self.tasks = tasks
+        self.state = RunState.RUNNING
+        self.task_index: int | None = None
+        self.identifier: str | None = None
+        self.completed = 0
+        self.error: str | None = None
+        self.metrics = MetricsRollup()
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.future: concurrent.futures.Future[None] | None = None
+        # cancelled to stop the run's current API call or tool call
+        self.cancel_token = CancelToken()
+        self._events: deque[dict[str, Any]] = deque(maxlen=RECENT_EVENTS)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.state in (RunState.RUNNING, RunState.STOPPING)
+
+    @property
+    def stopping(self) -> bool:
+        return self.state == RunState.STOPPING
+
+    def begin_task(self, index: int, identifier: str):
+        with self._lock:
+            self.task_index = index
+            self.identifier = identifier
+
+    def end_task(self, metrics: MetricsRollup):
+        with self._lock:
+            self.completed += 1
+            self.metrics.add_task(metrics)
+
+    def request_stop(self) -> bool:
+        """Mark a running run as stopping; False if it had already ended."""
+        with self._lock:
+            if self.state != RunState.RUNNING:
+                return False
+            self.state = RunState.STOPPING
+            return True
+
+    def finish(self, state: RunState, error: str | None = None):
+        with self._lock:
+            self.state = state
+            self.error = error
+            self.finished_at = time.time()
+
+    def record(self, identifier: str, event: Event):
+        summary = _summarize(event)
+        with self._lock:
+            self._seq += 1
+            self._events.append(
+                {"seq": self._seq, "time": time.time(), "identifier": identifier}
+                | summary
+            )
+
+    def events(self, after: int = 0, limit: int = 100) -> list[dict[str, Any]]:
+        """The newest limit events after sequence number after, oldest first."""
+        with self._lock:
+            newer = [event for event in self._events if event["seq"] > after]
+        return newer[-limit:] if limit > 0 else []
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "id": self.id,
+                "dataset": self.config.dataset,
+                "config": self.config.to_dict(),
+                "state": self.state,
+                "task_index": self.task_index,
+                "task_count": len(self.tasks),
+                "identifier": self.identifier,
+                "completed": self.completed,
+                "error": self.error,
+                "metrics": self.metrics.to_dict(),
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "last_event": self._seq,
+            }
+
+
+def _summarize(event: Event) -> dict[str, Any]:
+    """A JSON-ready digest of an event; screenshots are left to the run logs."""
+    if isinstance(event, OutputEvent):
+        block = event.block
+        if block["type"] == "text":
+            return {"type": "text", "text": block["text"][:EVENT_TEXT_CHARS]}
+        if block["type"] == "tool_use":
+            return {"type": "tool_use", "name": block["name"], "input": block["input"]}
+        return {"type": block["type"]}
+    if isinstance(event, ToolOutputEvent):
+        result = event.result
+        return {
+            "type": "tool_result",
+            "tool_use_id": event.tool_use_id,
+            "output": (result.output or "")[:EVENT_TEXT_CHARS],
+            "error": (result.error or "")[:EVENT_TEXT_CHARS],
+            "system": result.system,
+            "image": result.image is not None,
+        }
+    if isinstance(event, ApiResponseEvent):
+        response = event.response
+        return {
+            "type": "api_response",
+            "status": (
+                response.status_code if isinstance(response, httpx.Response) else None
+            ),
+            "error": str(event.error) if event.error else None,
+        }
+    if isinstance(event, TurnEvent):
+        return {"type": "turn", "turn": event.record["turn"]}
+    if isinstance(event, MetricsEvent):
+        return {"type": "metrics", "metrics": event.metrics.to_dict()}
+    assert isinstance(event, StopEvent)
+    return {"type": "stop", "reason": event.reason}
+
+
+class TaskRunner:
+    """
+    Runs datasets one at a time on an event loop thread of its own, with one set of
+    tools shared by every run, since they all drive the same desktop. Its methods
+    are called from other threads and never wait for a task to make progress.
+    """
+
+    def __init__(
+        self,
+        *,
+        data_dir: str | os.PathLike[str] = DEFAULT_DATA_DIR,
+        log_dir: str | os.PathLike[str] = DEFAULT_LOG_DIR,
+        tool_collection_factory: Callable[[], ToolCollection] = build_tool_collection,
+    ):
+        self.data_dir = Path(data_dir)
+        self.log_dir = Path(log_dir)
+        self.runs: dict[str, Run] = {}
+        self._tool_collection_factory = tool_collection_factory
+        self._tool_collection: ToolCollection | None = None
+        self._provider_pool: ProviderPool | None = None
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="runner-loop", daemon=True
+        )
+        # writes run logs and resume points in order, while the next task runs
+        self._writer = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="runner-writer"
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def close(self, timeout: float | None = None):
+        """Stop every run, wait for their logs and release the tools."""
+        for run in self.list_runs():
+            self.stop_run(run.id)
+            if run.future:
+                concurrent.futures.wait([run.future], timeout=timeout)
+        if self._thread.is_alive():
+            self._call(self._close_tools()).result(timeout)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+        self._loop.close()
+        self._writer.shutdown()
+
+    def list_runs(self) -> list[Run]:
+        with self._lock:
+            return list(self.runs.values())
+
+    def get_run(self, run_id: str) -> Run:
+        with self._lock:
+            if run := self.runs.get(run_id):
+                return run
+        raise LookupError(f"No run {run_id}")
+
+    def start_run(self, config: RunConfig) -> Run:
+        """
+        Start working through a dataset. Raises LookupError for an unknown dataset,
+        ValueError for an invalid one and RuntimeError while another run is active.
+        """
+        path = self.data_dir / config.dataset
+        if not path.is_file():
+            raise LookupError(f"No dataset {config.dataset}")
+        tasks = load_tasks(path)
+        with self._lock:
+            if active := next((r for r in self.runs.values() if r.active), None):
+                raise RuntimeError(
+                    f"Run {active.id} on {active.config.dataset} is active"
+                )
+            run = Run(secrets.token_hex(6), config, tasks)
+            self.runs[run.id] = run
+        run.future = self._call(self._execute(run))
+        return run
+
+    def stop_run(self, run_id: str) -> Run:
+        """
+        Stop a run. Its current API call or tool call is aborted and the task is
+        logged with stop reason stopped_by_user; the tools are reset.
+        """
+        run = self.get_run(run_id)
+        if run.request_stop():
+            run.cancel_token.cancel(STOPPED_BY_USER)
+        return run
+
+    def _call(self, coroutine: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _tools(self) -> ToolCollection:
+        # built on the runner's loop, which its pre-started shells belong to
+        if self._tool_collection is None:
+            self._tool_collection = self._tool_collection_factory()
+        return self._tool_collection
+
+    async def _close_tools(self):
+        if self._tool_collection is not None:
+            await self._tool_collection.close()
+
+    def provider_pool(self) -> ProviderPool | None:
+        if self._provider_pool is None and (path := os.getenv("PROVIDER_POOL_FILE")):
+            self._provider_pool = ProviderPool.from_file(path)
+        return self._provider_pool
+
+    async def _execute(self, run: Run):
+        config = run.config
+        writes: list[asyncio.Future[None]] = []
+        # the first request writes the prefix to the cache itself, so the warmup
+        # requests go out on a thread alongside it rather than ahead of it
+        prefix = build_prefix(self._tools(), config.system_prompt_suffix)
+        warmup = asyncio.ensure_future(
+            asyncio.to_thread(
+                self._warm_prompt_cache, config, prefix, self.provider_pool()
+            )
+        )
+        try:
+            try:
+                first = self._resume_index(run)
+                for index in range(first, len(run.tasks)):
+                    if run.stopping:
+                        break
+                    task = run.tasks[index]
+                    run.begin_task(index, task.identifier)
+                    setup = self._tools().hold(
+                        self._set_up_task(
+                            task, config.settle_timeout if index > first else 0
+                        )
+                    )
+                    stop_reason = await self._run_task(run, task, writes)
+                    if run.stopping:
+                        setup.cancel()
+                    await asyncio.wait([setup])
+                    if not setup.cancelled() and (error := setup.exception()):
+                        # the task's tool calls already failed with this error
+                        logger.warning(
+                            "setting up task %s failed: %r", task.identifier, error
+                        )
+                    if stop_reason == STOPPED_BY_USER:
+                        # the interrupted tool call may have left a command running
+                        await self._tools().reset()
+                    else:
+                        writes.append(self._write(self._save_resume_point, run, index))
+            finally:
+                # the last tasks' logs may still be being written
+                await asyncio.gather(warmup, *writes)
+        except Exception as e:
+            logger.exception("run %s failed", run.id)
+            run.finish(RunState.FAILED, error=repr(e))
+        else:
+            run.finish(RunState.STOPPED if run.stopping else RunState.FINISHED)
+        finally:
+            self._save_dataset_metrics(run)
+
+    async def _set_up_task(self, task: BatchTask, settle_timeout: float):
+        tools = self._tools()
+        if task.reset_tools:
+            await tools.reset(None if task.reset_tools is True else task.reset_tools)
+        await tools.wait_ready(settle_timeout)
+
+    def _write(self, write: Callable[..., None], *args: Any) -> asyncio.Future[None]:
+        return self._loop.run_in_executor(self._writer, write, *args)
+
+    async def _run_task(
+        self, run: Run, task: BatchTask, writes: list[asyncio.Future[None]]
+    ) -> str | None:
+        """
+        Run one task to its end and queue the writing of its run log onto writes;
+        returns its stop reason.
+        """
+        config = run.config
+        messages: list[BetaMessageParam] = [
+            {"role": "user", "content": [{"type": "text", "text": task.task}]}
+        ]
+        metrics = MetricsRollup()
+        stop_reason: str | None = None
+
+        def stop_callback(reason: str):
+            nonlocal stop_reason
+            stop_reason = reason
+
+        event_bus = EventBus()
+        recorder = asyncio.ensure_future(
+            consume(event_bus.subscribe(), partial(run.record, task.identifier))
+        )
+        with self._open_turn_log(run, task, messages) as turn_log:
+            try:
+                await sampling_loop(
+                    model=config.model
+                    or PROVIDER_TO_DEFAULT_MODEL_NAME[config.provider],
+                    provider=config.provider,
+                    system_prompt_suffix=config.system_prompt_suffix,
+                    messages=messages,
+                    api_key=config.api_key or os.getenv("ANTHROPIC_API_KEY", ""),
+                    only_n_most_recent_images=config.only_n_most_recent_images,
+                    compact_tool_results_after=config.compact_tool_results_after,
+                    max_tokens=config.max_tokens,
+                    turn_callback=turn_log.write,
+                    metrics_callback=metrics.add_turn,
+                    scheduler=shared_scheduler(),
+                    provider_pool=self.provider_pool(),
+                    budget=TaskBudget.from_env(),
+                    stop_callback=stop_callback,
+                    loop_detector=_action_loop_detector(),
+                    tool_collection=self._tools(),
+                    event_bus=event_bus,
+                    cancel_token=run.cancel_token,
+                )
+            finally:
+                await event_bus.close()
+                await recorder
+
+        run.end_task(metrics)
+        if not task.identifier.startswith(SCENE_CHANGE_PREFIX):
+            writes.append(
+                self._write(
+                    self._save_run_log, run, task, messages, metrics, stop_reason
+                )
+            )
+        return stop_reason
+
+    def _open_turn_log(
+        self, run: Run, task: BatchTask, messages: list[BetaMessageParam]
+    ) -> TurnLogSink:
+        timestamp = datetime.now().strftime("%Y-%m-%d")
+        rotate_bytes = os.getenv("TURN_LOG_ROTATE_BYTES")
+        turn_log = TurnLogSink(
+            self.log_dir / f"{run.config.dataset}_{timestamp}_{task.identifier}.jsonl",
+            store=BlobStore(self.log_dir / BLOB_DIR_NAME),
+            compression="zstd" if os.getenv("TURN_LOG_COMPRESSION") == "zstd" else None,
+            rotate_bytes=int(rotate_bytes) if rotate_bytes else None,
+        )
+        turn_log.write(
+            {"identifier": task.identifier, "messages": snapshot_messages(messages)}
+        )
+        return turn_log
+
+    def _save_run_log(
+        self,
+        run: Run,
+        task: BatchTask,
+        messages: list[BetaMessageParam],
+        metrics: MetricsRollup,
+        stop_reason: str | None,
+    ):
+        log_data = build_log(
+            task.identifier,
+            messages,
+            metrics=metrics.to_dict(),
+            stop_reason=stop_reason,
+        )
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        log_path = (
+            self.log_dir
+            / f"{run.config.dataset}_{log_data['timestamp']}_{task.identifier}.json"
+        )
+        log_path.write_bytes(
+            dump_log(log_data, BlobStore(self.log_dir / BLOB_DIR_NAME))
+        )
+
+    def _save_dataset_metrics(self, run: Run):
+        timestamp = datetime.now().strftime("%Y-%m-%d")
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        metrics_path = self.log_dir / f"{run.config.dataset}_{timestamp}_metrics.json"
+        metrics_path.write_text(json.dumps(run.status()["metrics"], indent=4))
+
+    def _resume_path(self, run: Run) -> Path:
+        # the file the Streamlit app resumes from too
+        return self.data_dir / f"{run.config.dataset}_last_task.json"
+
+    def _resume_index(self, run: Run) -> int:
+        """The first task to run: the one after the last finished, unless restarting."""
+        path = self._resume_path(run)
+        if run.config.restart or not path.is_file():
+            return 0
+        try:
+            resume_point = json.loads(path.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            logger.warning("ignoring corrupt resume point %s", path)
+            return 0
+        identifiers = [task.identifier for task in run.tasks]
+        identifier = resume_point.get("last_identifier")
+        if identifier not in identifiers:
+            return 0
+        if resume_point.get("finished"):
+            return len(identifiers)
+        return identifiers.index(identifier)
+
+    def _save_resume_point(self, run: Run, index: int):
+        # the identifier of the next task, or the last one with finished set
+        last = index + 1 >= len(run.tasks)
+        resume_point: dict[str, Any] = {
+            "last_identifier": run.tasks[index if last else index + 1].identifier
+        }
+        if last:
+            resume_point["finished"] = True
+        self._resume_path(run).write_text(
+            json.dumps(resume_point, indent=4, ensure_ascii=False), encoding="utf-8"
+        )
+
+    def _warm_prompt_cache(
+        self, config: RunConfig, prefix: PromptPrefix, pool: ProviderPool | None
+    ):
+        model = config.model or PROVIDER_TO_DEFAULT_MODEL_NAME[config.provider]
+        if pool:
+            targets = [
+                (
+                    backend.provider,
+                    backend.api_key,
+                    pool.model_for(backend, model),
+                    backend.client_options,
+                )
+                for backend in pool.backends
+            ]
+        else:
+            api_key = config.api_key or os.getenv("ANTHROPIC_API_KEY", "")
+            targets = [(config.provider, api_key, model, {})]
+        for provider, api_key, target_model, client_options in targets:
+            if provider not in PROMPT_CACHING_PROVIDERS:
+                continue
+            try:
+                warm_prompt_cache(
+                    make_client(provider, api_key, **client_options),
+                    model=target_model,
+                    prefix=prefix,
+                    scope=bucket_key(provider, api_key),
+                )
+            except APIError as e:
+                logger.warning("prompt cache warmup failed: %s", e)
+
+
+def _action_loop_detector() -> ActionLoopDetector | None:
+    # ACTION_LOOP_DETECTION is report (default), stop or off, as in the app
+    mode = os.getenv("ACTION_LOOP_DETECTION", "report")
+    if mode == "off":
+        return None
+    return ActionLoopDetector(stop=mode == "stop")
+
+
+class RunnerService:
+    """A TaskRunner behind its HTTP control API."""
+
+    def __init__(
+        self,
+        runner: TaskRunner,
+        *,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_RUNNER_PORT,
+    ):
+        self.runner = runner
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(runner))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.runner.start()
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="runner-api", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+        self.runner.close()
+
+    def serve_forever(self):
+        self.runner.start()
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self.runner.close()
+
+
+def _make_handler(runner: TaskRunner) -> type[BaseHTTPRequestHandler]:
+    class RunnerHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip("/").split("/")
+            query = parse_qs(url.query)
+            if parts == ["runs"]:
+                self._send_json(
+                    HTTPStatus.OK, {"runs": [r.status() for r in runner.list_runs()]}
+                )
+            elif len(parts) == 2 and parts[0] == "runs":
+                self._handle(lambda: runner.get_run(parts[1]).status())
+            elif len(parts) == 3 and parts[0] == "runs" and parts[2] == "events":
+                self._handle(
+                    lambda: {
+                        "events": runner.get_run(parts[1]).events(
+                            after=int(query.get("after", ["0"])[0]),
+                            limit=int(query.get("limit", ["100"])[0]),
+                        )
+                    }
+                )
+            else:
+                self._send_error(HTTPStatus.NOT_FOUND, f"{url.path} is not served")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("content-length") or 0))
+            parts = urlsplit(self.path).path.strip("/").split("/")
+            if parts == ["runs"]:
+                self._handle(
+                    lambda: runner.start_run(
+                        RunConfig.from_dict(json.loads(body or b"{}"))
+                    ).status(),
+                    HTTPStatus.CREATED,
+                )
+            elif len(parts) == 3 and parts[0] == "runs" and parts[2] == "stop":
+                self._handle(
+                    lambda: runner.stop_run(parts[1]).status(), HTTPStatus.ACCEPTED
+                )
+            else:
+                self._send_error(HTTPStatus.NOT_FOUND, f"{self.path} is not served")
+
+        def _handle(
+            self,
+            action: Callable[[], dict[str, Any]],
+            status: HTTPStatus = HTTPStatus.OK,
+        ):
+            try:
+                payload = action()
+            except LookupError as e:
+                self._send_error(HTTPStatus.NOT_FOUND, str(e))
+            except (ValueError, KeyError) as e:
+                self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            except RuntimeError as e:
+                self._send_error(HTTPStatus.CONFLICT, str(e))
+            else:
+                self._send_json(status, payload)
+
+        def _send_error(self, status: HTTPStatus, message: str):
+            self._send_json(status, {"error": message})
+
+        def _send_json(self, status: HTTPStatus, payload: dict[str, Any]):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return RunnerHandler
+
+
+class RunnerError(Exception):
+    """Raised when the runner service rejects a request."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RunnerClient:
+    """Starts, stops and polls runs of a runner service, e.g. for the Streamlit app."""
+
+    def __init__(self, base_url: str = DEFAULT_RUNNER_URL, timeout: float = 5.0):
+        self._client = httpx.Client(base_url=base_url, timeout=timeout)
+
+    def start(self, config: RunConfig) -> dict[str, Any]:
+        return self._request(
+            "POST", "/runs", json=config.to_dict() | {"api_key": config.api_key}
+        )
+
+    def stop(self, run_id: str) -> dict[str, Any]:
+        return self._request("POST", f"/runs/{run_id}/stop")
+
+    def status(self, run_id: str) -> dict[str, Any]:
+        return self._request("GET", f"/runs/{run_id}")
+
+    def runs(self) -> list[dict[str, Any]]:
+        return self._request("GET", "/runs")["runs"]
+
+    def events(
+        self, run_id: str, *, after: int = 0, limit: int = 100
+    ) -> list[dict[str, Any]]:
+        return self._request(
+            "GET", f"/runs/{run_id}/events", params={"after": after, "limit": limit}
+        )["events"]
+
+    def close(self):
+        self._client.close()
+
+    def _request(self, method: str, path: str, **kwargs) -> dict[str, Any]:
+        response = self._client.request(method, path, **kwargs)
+        if response.is_error:
+            raise RunnerError(
+                response.json().get("error", response.text), response.status_code
+            )
+        return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_RUNNER_PORT)
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR)
+    parser.add_argument("--log-dir", type=Path, default=DEFAULT_LOG_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    service = RunnerService(
+        TaskRunner(data_dir=args.data_dir, log_dir=args.log_dir),
+        host=args.host,
+        port=args.port,
+    )
+    logger.info("runner listening on %s", service.base_url)
+    service.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Process-wide, rate-limit-aware scheduling of Messages API requests.
+"""
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+
+RATE_LIMITED_STATUS_CODES = (429, 529)
+# as many attempts as the SDK's own max_retries=4 would make
+MAX_SCHEDULED_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# the response headers are documented at
+# https://docs.anthropic.com/en/api/rate-limits#response-headers
+_BUDGET_HEADERS = {
+    "requests": "anthropic-ratelimit-requests",
+    "input_tokens": "anthropic-ratelimit-input-tokens",
+    "output_tokens": "anthropic-ratelimit-output-tokens",
+}
+_COMBINED_TOKENS_HEADER = "anthropic-ratelimit-tokens"
+
+
+def bucket_key(provider: str, api_key: str = "") -> str:
+    """Identify the rate-limit bucket of a provider and key without keeping the key."""
+    if not api_key:
+        return provider
+    return f"{provider}:{hashlib.sha256(api_key.encode()).hexdigest()[:12]}"
+
+
+@dataclass(kw_only=True)
+class _Budget:
+    """What the API last reported as left of a limit, until the limit resets."""
+
+    remaining: int | None = None
+    reset_at: float = 0.0
+
+    def delay(self, now: float, amount: int) -> float:
+        if self.remaining is None or now >= self.reset_at or self.remaining >= amount:
+            return 0.0
+        return self.reset_at - now
+
+    def consume(self, now: float, amount: int):
+        if now >= self.reset_at:
+            self.remaining = None
+        elif self.remaining is not None:
+            self.remaining = max(0, self.remaining - amount)
+
+
+@dataclass(kw_only=True)
+class _Bucket:
+    budgets: dict[str, _Budget] = field(
+        default_factory=lambda: {name: _Budget() for name in _BUDGET_HEADERS}
+    )
+    blocked_until: float = 0.0
+    consecutive_limited: int = 0
+    queue: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]] = field(
+        default_factory=deque
+    )
+    requests: int = 0
+    rate_limited: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def delay(self, now: float, input_tokens: int) -> float:
+        return max(
+            self.blocked_until - now,
+            self.budgets["requests"].delay(now, 1),
+            self.budgets["input_tokens"].delay(now, input_tokens),
+            self.budgets["output_tokens"].delay(now, 1),
+        )
+
+
+class RateLimitScheduler:
+    """
+    Admits requests one bucket (provider and key) at a time, in arrival order, once
+    the bucket's last reported request and token budgets cover them. Budgets come
+    from the rate-limit headers of every response; 429 and 529 responses block the
+    bucket for `retry-after` or an exponential backoff. Callers may run on different
+    threads and event loops, as Streamlit sessions do.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, _Bucket] = {}
+
+    async def acquire(self, key: str, input_tokens: int = 0) -> float:
+        """Wait for a turn to send a request in bucket key; returns the time waited."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        entry = (loop, loop.create_future())
+        with self._lock:
+            bucket = self._buckets.setdefault(key, _Bucket())
+            bucket.queue.append(entry)
+            if len(bucket.queue) == 1:
+                entry[1].set_result(None)
+        try:
+            await entry[1]
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    delay = bucket.delay(now, input_tokens)
+                    if delay <= 0:
+                        bucket.budgets["requests"].consume(now, 1)
+                        bucket.budgets["input_tokens"].consume(now, input_tokens)
+                        break
+                await asyncio.sleep(delay)
+        finally:
+            with self._lock:
+                self._leave(bucket, entry)
+        waited = time.monotonic() - start
+        with self._lock:
+            bucket.requests += 1
+            bucket.total_wait += waited
+            bucket.max_wait = max(bucket.max_wait, waited)
+        return waited
+
+    def record_response(
+        self, key: str, headers: Mapping[str, str], status_code: int = 200
+    ):
+        """Update a bucket from the headers of a response, successful or not."""
+        now = time.monotonic()
+        wall_now = datetime.now(timezone.utc)
+        with self._lock:
+            bucket = self._buckets.setdefault(key, _Bucket())
+            for name, prefix in _BUDGET_HEADERS.items():
+                remaining = headers.get(f"{prefix}-remaining")
+                reset = headers.get(f"{prefix}-reset")
+                if name != "requests" and remaining is None:
+                    remaining = headers.get(f"{_COMBINED_TOKENS_HEADER}-remaining")
+                    reset = headers.get(f"{_COMBINED_TOKENS_HEADER}-reset")
+                if remaining is None or reset is None:
+                    continue
+                bucket.budgets[name] = _Budget(
+                    remaining=int(remaining),
+                    reset_at=now + _seconds_until(reset, wall_now),
+                )
+
+            if status_code not in RATE_LIMITED_STATUS_CODES:
+                bucket.consecutive_limited = 0
+                return
+            bucket.rate_limited += 1
+            bucket.consecutive_limited += 1
+            retry_after = retry_delay(headers, bucket.consecutive_limited)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Queue depth, waiting time and last known budgets of every bucket."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: {
+                    "queue_depth": len(bucket.queue),
+                    "requests": bucket.requests,
+                    "rate_limited": bucket.rate_limited,
+                    "total_wait": bucket.total_wait,
+                    "max_wait": bucket.max_wait,
+                    "blocked_for": max(0.0, bucket.blocked_until - now),
+                    **{
+                        f"{name}_remaining": budget.remaining
+                        for name, budget in bucket.budgets.items()
+                        if budget.remaining is not None and now < budget.reset_at
+                    },
+                }
+                for key, bucket in self._buckets.items()
+            }
+
+    def _leave(
+        self,
+        bucket: _Bucket,
+        entry: tuple[asyncio.AbstractEventLoop, asyncio.Future[None]],
+    ):
+        was_head = bucket.queue[0] is entry
+        bucket.queue.remove(entry)
+        if was_head and bucket.queue:
+            loop, future = bucket.queue[0]
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # the waiter's event loop is gone, so pass its turn on
+                self._leave(bucket, bucket.queue[0])
+
+
+def _wake(future: asyncio.Future[None]):
+    if not future.done():
+        future.set_result(None)
+
+
+def retry_delay(headers: Mapping[str, str], attempt: int) -> float:
+    """How long to wait before retry number attempt: retry-after, else a backoff."""
+    retry_after = _retry_after(headers)
+    if retry_after is not None:
+        return retry_after
+    backoff = BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)
+    return min(backoff, BACKOFF_MAX_SECONDS) * random.uniform(1, 1.25)
+
+
+def _seconds_until(reset: str, now: datetime) -> float:
+    try:
+        reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    return max(0.0, (reset_at - now).total_seconds())
+
+
+def _retry_after(headers: Mapping[str, str]) -> float | None:
+    if (retry_after_ms := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+_shared_scheduler: RateLimitScheduler | None = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler() -> RateLimitScheduler:
+    """The scheduler shared by every sampling loop in this process."""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = RateLimitScheduler()
+        return _shared_scheduler
@@ -8,19 +8,19 @@ import os
 import sys
 import subprocess
 import traceback
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
 from enum import StrEnum
 from functools import partial
 from pathlib import PosixPath
-from typing import cast
+from typing import Any, cast
 import json
 from datetime import datetime
 import streamlit.components.v1 as components
 
 import httpx
 import streamlit as st
-from anthropic import RateLimitError
+from anthropic import APIError, RateLimitError
 from anthropic.types.beta import (
     BetaContentBlockParam,
     BetaTextBlockParam,
@@ -28,12 +28,58 @@ from anthropic.types.beta import (
 )
 from streamlit.delta_generator import DeltaGenerator
 
+from computer_use_demo.budget import TaskBudget
+from computer_use_demo.chat_history import (
+    DEFAULT_TURNS_SHOWN,
+    ThumbnailCache,
+    history_page,
+)
+from computer_use_demo.events import (
+    ApiResponseEvent,
+    Event,
+    EventBus,
+    OutputEvent,
+    ToolOutputEvent,
+    consume,
+)
+from computer_use_demo.exchanges import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_EXCHANGES,
+    Exchange,
+    ExchangeRecorder,
+)
+from computer_use_demo.log_sink import TurnLogSink
+from computer_use_demo.metrics import MetricsRollup, TurnMetrics
+from computer_use_demo.provider_pool import ProviderPool
+from computer_use_demo.repetition import ActionLoopDetector
+from computer_use_demo.response_cache import ResponseCache
+from computer_use_demo.prompt import PromptPrefix, build_prefix, warm_prompt_cache
+from computer_use_demo.scheduler import bucket_key, shared_scheduler
 from computer_use_demo.loop import (
+    PROMPT_CACHING_PROVIDERS,
     PROVIDER_TO_DEFAULT_MODEL_NAME,
+    TOOL_NAMES,
     APIProvider,
+    build_tool_collection,
+    make_client,
     sampling_loop,
+    tool_params,
+)
+from computer_use_demo.runner import (
+    STOPPED_BY_USER,
+    RunConfig,
+    RunnerClient,
+    RunnerError,
+    RunState,
+)
+from computer_use_demo.tools import CancelToken, ToolResult, inline_images
+from computer_use_demo.transcript import (
+    BLOB_DIR_NAME,
+    BlobStore,
+    build_log,
+    dump_log,
+    snapshot_messages,
 )
-from computer_use_demo.tools import ToolResult
 
 CONFIG_DIR = PosixPath("~/.anthropic").expanduser()
 API_KEY_FILE = CONFIG_DIR / "api_key"
@@ -61,6 +107,12 @@ INTERRUPT_TOOL_ERROR = "human stopped or interrupted tool execution"
 
 DATA_DIR = "/home/computeruse/computer_use_demo/data"
 LOG_DIR = "/home/computeruse/computer_use_demo/log" 
+RUNNER_POLL_SECONDS = 2
+RUNNER_EVENTS_SHOWN = 30
+# how soon a stopped or rerun script aborts the sampling loop it was running
+STOP_POLL_SECONDS = 0.2
+# the longest a task's first tool call waits for the desktop to settle
+TASK_SETTLE_SECONDS = 4
 
 def get_json_files():
     """data/ 폴더 내 JSON 파일 리스트 반환"""
@@ -127,10 +179,23 @@ def load_tasks_from_json(file_path):
 
         formatted_data = []
         for item in data:
-            if isinstance(item, dict) and "identifier" in item and "task" in item:
-                formatted_data.append({"identifier": item["identifier"], "task": item["task"]})
-            else:
+            if not (isinstance(item, dict) and "identifier" in item and "task" in item):
                 st.warning(f"⚠️ JSON 항목이 올바른 형식이 아닙니다: {item}")
+            elif isinstance(
+                reset := item.get("reset_tools"), list
+            ) and not TOOL_NAMES.issuperset(reset):
+                st.warning(
+                    f"⚠️ Unknown tools to reset in {item['identifier']}: "
+                    f"{sorted(set(reset) - TOOL_NAMES)}"
+                )
+            else:
+                formatted_data.append(
+                    {
+                        key: item[key]
+                        for key in ("identifier", "task", "reset_tools")
+                        if key in item
+                    }
+                )
 
         return formatted_data
 
@@ -205,15 +270,29 @@ def setup_state():
     if "auth_validated" not in st.session_state:
         st.session_state.auth_validated = False
     if "responses" not in st.session_state:
-        st.session_state.responses = {}
+        st.session_state.responses = ExchangeRecorder(
+            max_entries=int(os.getenv("HTTP_LOG_MAX_ENTRIES", DEFAULT_MAX_EXCHANGES)),
+            max_bytes=int(os.getenv("HTTP_LOG_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        )
     if "tools" not in st.session_state:
         st.session_state.tools = {}
+    if "tool_collection" not in st.session_state:
+        # one set of tool sessions per browser session, i.e. per desktop
+        st.session_state.tool_collection = build_tool_collection()
     if "only_n_most_recent_images" not in st.session_state:
         st.session_state.only_n_most_recent_images = 3
+    if "compact_tool_results_after" not in st.session_state:
+        st.session_state.compact_tool_results_after = 0
     if "custom_system_prompt" not in st.session_state:
         st.session_state.custom_system_prompt = load_from_storage("system_prompt") or ""
     if "hide_images" not in st.session_state:
         st.session_state.hide_images = False
+    if "chat_turns_shown" not in st.session_state:
+        st.session_state.chat_turns_shown = int(
+            os.getenv("CHAT_TURNS_SHOWN", DEFAULT_TURNS_SHOWN)
+        )
+    if "chat_page" not in st.session_state:
+        st.session_state.chat_page = 0
     if "in_sampling_loop" not in st.session_state:
         st.session_state.in_sampling_loop = False
     if "log_saved" not in st.session_state:
@@ -226,6 +305,14 @@ def setup_state():
         st.session_state.saved_file_content = None  # 메모리 저장 방식으로 변경
     if "last_message_count" not in st.session_state:
         st.session_state.last_message_count = 0
+    if "response_cache_enabled" not in st.session_state:
+        st.session_state.response_cache_enabled = False
+    if "response_cache" not in st.session_state:
+        st.session_state.response_cache = ResponseCache(CONFIG_DIR / "response_cache")
+    if "task_metrics" not in st.session_state:
+        st.session_state.task_metrics = MetricsRollup()
+    if "dataset_metrics" not in st.session_state:
+        st.session_state.dataset_metrics = MetricsRollup()
     # 선택된 JSON 파일 기준으로 task 로드
     if "selected_file" in st.session_state:
         file_path = os.path.join(DATA_DIR, st.session_state.selected_file)
@@ -320,15 +407,43 @@ async def main():
             key="only_n_most_recent_images",
             help="To decrease the total tokens sent, remove older screenshots from the conversation",
         )
+        st.number_input(
+            "Compact tool outputs older than N turns",
+            min_value=0,
+            key="compact_tool_results_after",
+            help="To decrease the total tokens sent, shorten large tool outputs to their first and last lines once they are N turns old. 0 keeps them in full",
+        )
         st.text_area(
             "Custom System Prompt Suffix",
             key="custom_system_prompt",
-            help="Additional instructions to append to the system prompt. see computer_use_demo/loop.py for the base system prompt.",
+            help="Additional instructions to append to the system prompt. see computer_use_demo/prompt.py for the base system prompt.",
             on_change=lambda: save_to_storage(
                 "system_prompt", st.session_state.custom_system_prompt
             ),
         )
         st.checkbox("Hide screenshots", key="hide_images")
+        st.number_input(
+            "Chat turns shown per page",
+            min_value=1,
+            key="chat_turns_shown",
+            help="Render only this many turns of the conversation at a time; older turns are a page away",
+        )
+        st.checkbox(
+            "Cache API responses",
+            key="response_cache_enabled",
+            help="Serve turns whose model, system prompt, tools and history are unchanged from a local cache, e.g. when re-running a dataset",
+        )
+        if st.session_state.response_cache_enabled:
+            cache_stats = st.session_state.response_cache.stats()
+            st.caption(
+                f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses"
+            )
+        if pool := provider_pool():
+            with st.expander("Provider pool"):
+                st.json(pool.stats())
+        if scheduler_stats := shared_scheduler().stats():
+            with st.expander("Rate limits"):
+                st.json(scheduler_stats)
 
         if st.button("Reset", type="primary"):
             with st.spinner("Resetting..."):
@@ -339,7 +454,8 @@ async def main():
                 await asyncio.sleep(1)
                 subprocess.run("./start_all.sh", shell=True)  # noqa: ASYNC221
 
-    if not st.session_state.auth_validated:
+    # pooled backends carry their own credentials
+    if not st.session_state.auth_validated and not provider_pool():
         if auth_error := validate_auth(
             st.session_state.provider, st.session_state.api_key
         ):
@@ -354,8 +470,12 @@ async def main():
     filtered_files = [file for file in json_files if "_last_task" not in file]
 
     chat, http_logs = st.tabs(["Chat", "HTTP Exchange Logs"])
+    client = runner_client()
     for file in filtered_files:
         if st.button(file):
+            if client:
+                start_background_run(client, file)
+                continue
             st.session_state.selected_file = file
             st.session_state.messages = []
             st.session_state.task_index = 0
@@ -363,21 +483,49 @@ async def main():
             await run_task_loop(http_logs, file)
             st.experimental_rerun()  # UI 업데이트 강제 적용
 
+    if client:
+        render_background_run(client)
+
     new_message = st.chat_input(
         "Type a message to send to Claude to control the computer..."
     )
     with chat:
-        # render past chats
-        for message in st.session_state.messages:
-            if isinstance(message["content"], str):
-                _render_message(message["role"], message["content"])
-            elif isinstance(message["content"], list):
+        # render past chats, a page of turns at a time
+        page = history_page(
+            st.session_state.messages,
+            turns_per_page=st.session_state.chat_turns_shown,
+            page=st.session_state.chat_page,
+        )
+        if page.pages > 1:
+            older, position, newer = st.columns([1, 3, 1])
+            older.button(
+                "Older turns",
+                disabled=page.page == page.pages - 1,
+                on_click=_turn_chat_page,
+                args=(page.page + 1,),
+            )
+            position.caption(
+                f"Turns {page.first + 1}-{page.first + len(page.turns)} of {page.total}"
+            )
+            newer.button(
+                "Newer turns",
+                disabled=page.page == 0,
+                on_click=_turn_chat_page,
+                args=(page.page - 1,),
+            )
+        for turn in page.turns:
+            for message in turn:
+                if isinstance(message["content"], str):
+                    _render_message(message["role"], message["content"])
+                    continue
                 for block in message["content"]:
                     # the tool result we send back to the Anthropic API isn't sufficient to render all details,
                     # so we store the tool use responses
                     if isinstance(block, dict) and block["type"] == "tool_result":
                         _render_message(
-                            Sender.TOOL, st.session_state.tools[block["tool_use_id"]]
+                            Sender.TOOL,
+                            st.session_state.tools[block["tool_use_id"]],
+                            key=block["tool_use_id"],
                         )
                     else:
                         _render_message(
@@ -386,11 +534,11 @@ async def main():
                         )
 
         # render past http exchanges
-        for identity, (request, response) in st.session_state.responses.items():
-            _render_api_response(request, response, identity, http_logs)
+        for exchange in st.session_state.responses:
+            _render_api_response(exchange, st.session_state.responses, http_logs)
 
-        # render past chats
         if new_message:
+            st.session_state.chat_page = 0
             st.session_state.messages.append(
                 {
                     "role": Sender.USER,
@@ -411,25 +559,33 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
-        with track_sampling_loop():
-            # run the agent sampling loop with the newest message
-            st.session_state.messages = await sampling_loop(
-                system_prompt_suffix=st.session_state.custom_system_prompt,
-                model=st.session_state.model,
-                provider=st.session_state.provider,
-                messages=st.session_state.messages,
-                output_callback=partial(_render_message, Sender.BOT),
-                tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
-                ),
-                api_response_callback=partial(
-                    _api_response_callback,
-                    tab=http_logs,
-                    response_state=st.session_state.responses,
-                ),
-                api_key=st.session_state.api_key,
-                only_n_most_recent_images=st.session_state.only_n_most_recent_images,
-            )
+        with open_turn_log() as turn_log, track_sampling_loop():
+            async with cancel_on_stop() as cancel_token, ui_event_bus(
+                http_logs, cancel_token
+            ) as event_bus:
+                # run the agent sampling loop with the newest message
+                st.session_state.messages = await sampling_loop(
+                    system_prompt_suffix=st.session_state.custom_system_prompt,
+                    model=st.session_state.model,
+                    provider=st.session_state.provider,
+                    messages=st.session_state.messages,
+                    event_bus=event_bus,
+                    api_key=st.session_state.api_key,
+                    only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+                    compact_tool_results_after=st.session_state.compact_tool_results_after,
+                    turn_callback=turn_log.write,
+                    metrics_callback=_metrics_callback,
+                    response_cache=(
+                        st.session_state.response_cache
+                        if st.session_state.response_cache_enabled
+                        else None
+                    ),
+                    scheduler=shared_scheduler(),
+                    provider_pool=provider_pool(),
+                    tool_collection=st.session_state.tool_collection,
+                    cancel_token=cancel_token,
+                )
+        await finish_log_write()
 
 def maybe_add_interruption_blocks():
     if not st.session_state.in_sampling_loop:
@@ -454,6 +610,192 @@ def maybe_add_interruption_blocks():
     result.append(BetaTextBlockParam(type="text", text=INTERRUPT_TEXT))
     return result
 
+def _turn_chat_page(page: int):
+    st.session_state.chat_page = page
+
+
+@st.cache_resource
+def thumbnail_cache() -> ThumbnailCache:
+    """Screenshot thumbnails shared by every session, since captures are immutable"""
+    return ThumbnailCache()
+
+
+@st.cache_resource
+def _load_provider_pool(path: str) -> ProviderPool:
+    return ProviderPool.from_file(path)
+
+
+def provider_pool() -> ProviderPool | None:
+    """The pool shared by every session when PROVIDER_POOL_FILE is set"""
+    if path := os.getenv("PROVIDER_POOL_FILE"):
+        return _load_provider_pool(path)
+    return None
+
+
+def start_prompt_cache_warmup() -> asyncio.Future[list[tuple[bool, str]]]:
+    """Warm the prompt cache of every backend in use on a worker thread"""
+    prefix = build_prefix(tool_params(), st.session_state.custom_system_prompt)
+    if pool := provider_pool():
+        targets = [
+            (
+                backend.provider,
+                backend.api_key,
+                pool.model_for(backend, st.session_state.model),
+                backend.client_options,
+            )
+            for backend in pool.backends
+        ]
+    else:
+        targets = [
+            (
+                st.session_state.provider,
+                st.session_state.api_key,
+                st.session_state.model,
+                {},
+            )
+        ]
+    return asyncio.ensure_future(asyncio.to_thread(warm_prompt_caches, prefix, targets))
+
+
+def warm_prompt_caches(
+    prefix: PromptPrefix, targets: list[tuple[APIProvider, str, str, dict[str, Any]]]
+) -> list[tuple[bool, str]]:
+    """Write the prefix to the prompt cache of each target; returns (failed, report) pairs"""
+    reports = []
+    for provider, api_key, model, client_options in targets:
+        if provider not in PROMPT_CACHING_PROVIDERS:
+            continue
+        try:
+            usage = warm_prompt_cache(
+                make_client(provider, api_key, **client_options),
+                model=model,
+                prefix=prefix,
+                scope=bucket_key(provider, api_key),
+            )
+        except APIError as e:
+            reports.append((True, f"Prompt cache warmup failed: {e}"))
+            continue
+        if usage is not None:
+            reports.append(
+                (
+                    False,
+                    f"Prompt cache warmed: {usage.cache_creation_input_tokens or 0}"
+                    f" tokens written, {usage.cache_read_input_tokens or 0} read",
+                )
+            )
+    return reports
+
+
+async def finish_prompt_cache_warmup(warmup: asyncio.Future[list[tuple[bool, str]]]):
+    """Wait for the warmup started with the task loop and report on it"""
+    try:
+        reports = await warmup
+    except Exception as e:
+        st.warning(f"Prompt cache warmup failed: {e}")
+        return
+    for failed, report in reports:
+        (st.warning if failed else st.write)(report)
+
+
+async def reset_tools(names: list[str] | None):
+    """Give the next task fresh sessions of the named tools, or of all of them"""
+    await st.session_state.tool_collection.reset(names)
+    st.write(f"🔁 Reset tools: {', '.join(names) if names else 'all'}")
+
+
+async def set_up_task_tools(reset: bool | list[str] | None, settle_timeout: float):
+    """Reset the tools a task asks for, then let the desktop settle after the last task"""
+    if reset:
+        await reset_tools(None if reset is True else reset)
+    await st.session_state.tool_collection.wait_ready(settle_timeout)
+
+
+def action_loop_detector() -> ActionLoopDetector | None:
+    """A fresh detector per task; ACTION_LOOP_DETECTION is report (default), stop or off"""
+    mode = os.getenv("ACTION_LOOP_DETECTION", "report")
+    if mode == "off":
+        return None
+    return ActionLoopDetector(stop=mode == "stop")
+
+
+@st.cache_resource
+def _runner_client(url: str) -> RunnerClient:
+    # one connection pool for every rerun, poll and session, however long it runs
+    return RunnerClient(url)
+
+
+def runner_client() -> RunnerClient | None:
+    """The background runner's client when RUNNER_URL is set; dataset runs then live there"""
+    if url := os.getenv("RUNNER_URL"):
+        return _runner_client(url)
+    return None
+
+
+def start_background_run(client: RunnerClient, selected_file: str):
+    """Hand a dataset to the background runner with this session's settings"""
+    config = RunConfig(
+        dataset=selected_file,
+        provider=st.session_state.provider,
+        model=st.session_state.model,
+        api_key=st.session_state.api_key,
+        system_prompt_suffix=st.session_state.custom_system_prompt,
+        only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+        compact_tool_results_after=st.session_state.compact_tool_results_after,
+    )
+    try:
+        run = client.start(config)
+    except (RunnerError, httpx.HTTPError) as e:
+        st.error(f"Could not start a background run of {selected_file}: {e}")
+        return
+    st.success(f"🚀 Background run {run['id']} of {selected_file} started")
+
+
+@st.fragment(run_every=RUNNER_POLL_SECONDS)
+def render_background_run(client: RunnerClient):
+    """Poll the most recent background run; only this fragment reruns"""
+    try:
+        runs = client.runs()
+        run = max(runs, key=lambda run: run["started_at"]) if runs else None
+        events = client.events(run["id"], limit=RUNNER_EVENTS_SHOWN) if run else []
+    except httpx.HTTPError as e:
+        st.warning(f"Background runner unavailable: {e}")
+        return
+    if run is None:
+        return
+    done = run["completed"]
+    st.subheader(f"Background run of {run['dataset']}: {run['state']}")
+    st.progress(
+        done / max(run["task_count"], 1),
+        text=f"{done} of {run['task_count']} tasks, now {run['identifier'] or '-'}",
+    )
+    if run["error"]:
+        st.error(run["error"])
+    if run["state"] == RunState.RUNNING and st.button("Stop background run"):
+        client.stop(run["id"])
+    with st.expander("Run metrics"):
+        st.json(run["metrics"])
+    with st.expander("Recent events", expanded=True):
+        for event in events:
+            _render_runner_event(event)
+
+
+def _render_runner_event(event: dict):
+    label = f"[{event['identifier']}] {event['type']}"
+    if event["type"] == "text":
+        st.markdown(f"**{label}** {event['text']}")
+    elif event["type"] == "tool_use":
+        st.markdown(f"**{label}** `{event['name']}`")
+        st.code(json.dumps(event["input"]))
+    elif event["type"] == "tool_result":
+        st.markdown(f"**{label}**{' 🖼️' if event['image'] else ''}")
+        if event["output"] or event["error"]:
+            st.code(event["output"] or event["error"])
+    elif event["type"] == "api_response" and event["error"]:
+        st.warning(f"{label}: {event['error']}")
+    elif event["type"] == "stop":
+        st.warning(f"{label}: {event['reason']}")
+
+
 def validate_auth(provider: APIProvider, api_key: str | None):
     if provider == APIProvider.ANTHROPIC:
         if not api_key:
@@ -502,21 +844,113 @@ def save_to_storage(filename: str, data: str) -> None:
         st.write(f"Debug: Error saving {filename}: {e}")
 
 
+@asynccontextmanager
+async def cancel_on_stop():
+    """
+    A cancel token for one sampling loop run, cancelled as soon as the user stops
+    the script or a widget reruns it, so that its API call and tool calls are
+    aborted rather than left running unseen. The stop or rerun is raised on exit.
+    """
+    cancel_token = CancelToken()
+    watcher = asyncio.create_task(_watch_for_stop(cancel_token))
+    try:
+        yield cancel_token
+    finally:
+        watcher.cancel()
+        await asyncio.wait([watcher])
+        if not watcher.cancelled() and (error := watcher.exception()):
+            raise error
+
+
+async def _watch_for_stop(cancel_token: CancelToken):
+    try:
+        while True:
+            # reading session state is an interrupt point: it raises once a stop or
+            # rerun of the script is pending
+            st.session_state.get("in_sampling_loop")
+            await asyncio.sleep(STOP_POLL_SECONDS)
+    finally:
+        cancel_token.cancel(STOPPED_BY_USER)
+
+
+@asynccontextmanager
+async def ui_event_bus(
+    http_logs: DeltaGenerator, cancel_token: CancelToken | None = None
+):
+    """
+    An event bus for one sampling loop run. The chat and HTTP log are rendered
+    from it by a background task whenever the loop awaits, e.g. on its tools, and
+    are complete once the block exits, before the run's logs are saved. If
+    rendering fails, e.g. on a stop or rerun of the script, cancel_token is
+    cancelled.
+    """
+    event_bus = EventBus()
+    renderer = asyncio.create_task(
+        consume(
+            event_bus.subscribe(OutputEvent, ToolOutputEvent, ApiResponseEvent),
+            partial(
+                _render_event,
+                tab=http_logs,
+                tool_state=st.session_state.tools,
+                response_state=st.session_state.responses,
+            ),
+        )
+    )
+    if cancel_token:
+
+        def cancel_if_failed(task: asyncio.Task[None]):
+            if not task.cancelled() and task.exception() is not None:
+                cancel_token.cancel(STOPPED_BY_USER)
+
+        renderer.add_done_callback(cancel_if_failed)
+    try:
+        yield event_bus
+    finally:
+        await event_bus.close()
+        await renderer
+
+
+def _render_event(
+    event: Event,
+    tab: DeltaGenerator,
+    tool_state: dict[str, ToolResult],
+    response_state: ExchangeRecorder,
+):
+    if isinstance(event, OutputEvent):
+        _render_message(Sender.BOT, event.block)
+    elif isinstance(event, ToolOutputEvent):
+        _tool_output_callback(event.result, event.tool_use_id, tool_state)
+    elif isinstance(event, ApiResponseEvent):
+        _api_response_callback(
+            event.request, event.response, event.error, tab, response_state
+        )
+
+
 def _api_response_callback(
     request: httpx.Request,
     response: httpx.Response | object | None,
     error: Exception | None,
     tab: DeltaGenerator,
-    response_state: dict[str, tuple[httpx.Request, httpx.Response | object | None]],
+    response_state: ExchangeRecorder,
 ):
     """
-    Handle an API response by storing it to state and rendering it.
+    Handle an API response by recording it to state and rendering it.
     """
-    response_id = datetime.now().isoformat()
-    response_state[response_id] = (request, response)
+    exchange = response_state.record(request, response, error)
     if error:
         _render_error(error)
-    _render_api_response(request, response, response_id, tab)
+    _render_api_response(exchange, response_state, tab)
+
+
+def _metrics_callback(metrics: TurnMetrics):
+    """Accumulate a turn's metrics into the current task's rollup."""
+    st.session_state.task_metrics.add_turn(metrics)
+
+
+def _stop_callback(reason: str):
+    """Keep the reason a task was stopped early for its run log."""
+    st.session_state.stop_reason = reason
+    st.warning(f"Task stopped: {reason}")
 
 
 def _tool_output_callback(
@@ -524,33 +958,42 @@ def _tool_output_callback(
 ):
     """Handle a tool output by storing it to state and rendering it."""
     tool_state[tool_id] = tool_output
-    _render_message(Sender.TOOL, tool_output)
+    _render_message(Sender.TOOL, tool_output, key=tool_id)
 
 
 def _render_api_response(
-    request: httpx.Request,
-    response: httpx.Response | object | None,
-    response_id: str,
+    exchange: Exchange,
+    recorder: ExchangeRecorder,
     tab: DeltaGenerator,
 ):
-    """Render an API response to a streamlit tab"""
+    """Render an API exchange to a streamlit tab, loading payloads only on demand"""
     if isinstance(tab, DeltaGenerator):  # ✅ 올바른 타입인지 체크
 
         with tab:
-            with st.expander(f"Request/Response ({response_id})"):
+            with st.expander(f"Request/Response ({exchange.recorded_at})"):
                 newline = "\n\n"
                 st.markdown(
-                    f"`{request.method} {request.url}`{newline}{newline.join(f'`{k}: {v}`' for k, v in request.headers.items())}"
+                    f"`{exchange.method} {exchange.url}`{newline}{newline.join(f'`{k}: {v}`' for k, v in exchange.request_headers.items())}"
+                )
+                st.markdown(
+                    f"`sha256: {exchange.request_digest}` `{exchange.request_size} bytes`"
                 )
-                st.json(request.read().decode())
+                if st.toggle("Show request body", key=f"request-{exchange.id}"):
+                    st.json(recorder.request_body(exchange))
                 st.markdown("---")
-                if isinstance(response, httpx.Response):
+                if exchange.status_code is not None:
+                    headers = exchange.response_headers or {}
                     st.markdown(
-                        f"`{response.status_code}`{newline}{newline.join(f'`{k}: {v}`' for k, v in response.headers.items())}"
+                        f"`{exchange.status_code}`{newline}{newline.join(f'`{k}: {v}`' for k, v in headers.items())}"
                     )
-                    st.json(response.text)
+                    if exchange.elapsed is not None:
+                        st.markdown(f"`elapsed: {exchange.elapsed:.3f}s`")
+                    if exchange.usage:
+                        st.json(exchange.usage)
+                    if st.toggle("Show response body", key=f"response-{exchange.id}"):
+                        st.json(recorder.response_body(exchange))
                 else:
-                    st.write(response)
+                    st.write(exchange.response_summary)
     else:
         st.error("⚠️ Invalid tab object detected!")
 
@@ -572,8 +1015,12 @@ def _render_error(error: Exception):
 def _render_message(
     sender: Sender,
     message: str | BetaContentBlockParam | ToolResult,
+    key: str | None = None,
 ):
-    """Convert input from the user or output from the agent to a streamlit message."""
+    """
+    Convert input from the user or output from the agent to a streamlit message.
+    Screenshots are shown as thumbnails; with a key, a toggle shows them full size.
+    """
     # streamlit's hotreloading breaks isinstance checks, so we need to check for class names
     is_tool_result = not isinstance(message, str | dict)
     if not message or (
@@ -593,8 +1040,10 @@ def _render_message(
                     st.markdown(message.output)
             if message.error:
                 st.error(message.error)
-            if message.base64_image and not st.session_state.hide_images:
-                st.image(base64.b64decode(message.base64_image))
+            if message.image and not st.session_state.hide_images:
+                st.image(thumbnail_cache().get(message.image))
+                if key and st.toggle("Full size", key=f"full_image_{key}"):
+                    st.image(message.image.data)
         elif isinstance(message, dict):
             if message["type"] == "text":
                 st.write(message["text"])
@@ -620,30 +1069,15 @@ def download_chat_logs(selected_file):
      # 가장 최근 identifier 가져오기 (없으면 "unknown")
     last_identifier = st.session_state.get("current_identifier", "unknown")
 
-    # 날짜만 포함된 timestamp 생성
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-
-    processed_messages = []
-
-    for msg in st.session_state.messages:
-        role = msg.get("role", "unknown")
-        content = msg.get("content", "")
-
-        # user 역할이지만 tool_result 타입을 포함한 경우 role을 assistant로 변경
-        if role == "user" and isinstance(content, list):
-            for item in content:
-                if item.get("type") == "tool_result":
-                    role = "assistant"
-                    break  # 한 개만 있어도 변경하므로 빠르게 종료
-
-        processed_messages.append({"role": role, "content": content})
-
-    log_data = {
-        "timestamp": timestamp,
-        "identifier": last_identifier,  # identifier 추가
-        "messages": processed_messages,
-    }
-    json_bytes = json.dumps(log_data, indent=4, ensure_ascii=False).encode("utf-8")
+    log_data = build_log(
+        last_identifier,
+        st.session_state.messages,
+        stop_reason=st.session_state.get("stop_reason"),
+    )
+    timestamp = log_data["timestamp"]
+    json_bytes = json.dumps(
+        inline_images(log_data), indent=4, ensure_ascii=False
+    ).encode("utf-8")
     st.session_state.saved_file_content = io.BytesIO(json_bytes)
     st.session_state.saved_file_name = f"{selected_file}_{timestamp}_{last_identifier}.json"
     st.write("✅ Log saved completed:", st.session_state.saved_file_name)
@@ -707,10 +1141,14 @@ def trigger_auto_download():
 def track_sampling_loop():
     """State management during sampling loop progress"""
     st.session_state.in_sampling_loop = True
+    st.session_state.task_metrics = MetricsRollup()
+    st.session_state.stop_reason = None
     st.write("🔄 Start sampling loop")
     yield
     st.session_state.in_sampling_loop = False
     st.write("✅ End sampling loop")
+    st.session_state.dataset_metrics.add_task(st.session_state.task_metrics)
+    st.write("📊 Task metrics", st.session_state.task_metrics.to_dict())
     
     last_identifier = st.session_state.get("current_identifier", "unknown")
     save_last_task(st.session_state.selected_file, last_identifier)
@@ -727,7 +1165,7 @@ def track_sampling_loop():
     if not last_identifier.startswith("scenchg"):
         st.session_state.download_ready = True
         save_log_to_dir(st.session_state.selected_file)
-        st.write("📂 Conversation auto-save completed!") 
+        st.write("📂 Conversation auto-save started") 
 
     # Reset message after saving log (start new conversation)
     if st.session_state.messages:
@@ -737,6 +1175,9 @@ def track_sampling_loop():
 
 async def run_task_loop(http_logs, selected_file):
     """Task를 반복해서 실행하는 루프 (중단된 위치부터 재시작)"""
+    # the first task's API call goes out while the caches are warmed
+    warmup: asyncio.Future[list[tuple[bool, str]]] | None = start_prompt_cache_warmup()
+    first_task = True
     while True:
         new_identifier, new_task = get_next_task(selected_file)
         #track_sampling_loop 끝과 함께 시작 전에도 대화 데이터 삭제
@@ -744,6 +1185,10 @@ async def run_task_loop(http_logs, selected_file):
             st.session_state.messages=[]
         if new_task is None:
             st.warning("All tasks are exhausted. End.")
+            if warmup is not None:
+                await finish_prompt_cache_warmup(warmup)
+            await finish_log_write()
+            save_dataset_metrics(selected_file)
             break  # 모든 Task가 끝났으면 종료
 
         st.session_state.current_identifier = new_identifier  
@@ -761,32 +1206,98 @@ async def run_task_loop(http_logs, selected_file):
         )
         _render_message(Sender.USER, new_task)
         st.success(f"New Task assigned: [{new_identifier}] {new_task}")
+        # the task's first API call goes out while its tools are set up
+        setup = st.session_state.tool_collection.hold(
+            set_up_task_tools(
+                st.session_state.tasks[st.session_state.task_index].get("reset_tools"),
+                settle_timeout=0 if first_task else TASK_SETTLE_SECONDS,
+            )
+        )
+        first_task = False
 
         # 🚀 새로운 Task를 Claude가 자동으로 실행하도록 다시 샘플링 루프 실행
-        with track_sampling_loop():
-            st.session_state.messages = await sampling_loop(
-                system_prompt_suffix=st.session_state.custom_system_prompt,
-                model=st.session_state.model,
-                provider=st.session_state.provider,
-                messages=st.session_state.messages,
-                output_callback=partial(_render_message, Sender.BOT),
-                tool_output_callback=partial(
-                    _tool_output_callback, tool_state=st.session_state.tools
-                ),
-                api_response_callback=partial(
-                    _api_response_callback,
-                    tab=http_logs,
-                    response_state=st.session_state.responses,
-                ),
-                api_key=st.session_state.api_key,
-                only_n_most_recent_images=st.session_state.only_n_most_recent_images,
-            )
+        try:
+            with open_turn_log() as turn_log, track_sampling_loop():
+                async with cancel_on_stop() as cancel_token, ui_event_bus(
+                    http_logs, cancel_token
+                ) as event_bus:
+                    st.session_state.messages = await sampling_loop(
+                        system_prompt_suffix=st.session_state.custom_system_prompt,
+                        model=st.session_state.model,
+                        provider=st.session_state.provider,
+                        messages=st.session_state.messages,
+                        event_bus=event_bus,
+                        api_key=st.session_state.api_key,
+                        only_n_most_recent_images=st.session_state.only_n_most_recent_images,
+                        compact_tool_results_after=st.session_state.compact_tool_results_after,
+                        turn_callback=turn_log.write,
+                        metrics_callback=_metrics_callback,
+                        response_cache=(
+                            st.session_state.response_cache
+                            if st.session_state.response_cache_enabled
+                            else None
+                        ),
+                        scheduler=shared_scheduler(),
+                        provider_pool=provider_pool(),
+                        budget=TaskBudget.from_env(),
+                        stop_callback=_stop_callback,
+                        loop_detector=action_loop_detector(),
+                        tool_collection=st.session_state.tool_collection,
+                        cancel_token=cancel_token,
+                    )
+                    # the previous task's log was written while this task ran
+                    await finish_log_write()
+        except BaseException:
+            # a loop that raised must not leave the setup pending, its error unseen
+            setup.cancel()
+            raise
+        finally:
+            await asyncio.wait([setup])
+            if not setup.cancelled() and (error := setup.exception()):
+                st.warning(f"Setting up the task's tools failed: {error!r}")
+            if warmup is not None:
+                await finish_prompt_cache_warmup(warmup)
+                warmup = None
+
+
+def save_dataset_metrics(selected_file):
+    """Write the rollup of every task run from this file so far"""
+    timestamp = datetime.now().strftime("%Y-%m-%d")
+    metrics = st.session_state.dataset_metrics.to_dict()
+    os.makedirs(LOG_DIR, exist_ok=True)
+    metrics_path = os.path.join(LOG_DIR, f"{selected_file}_{timestamp}_metrics.json")
+    with open(metrics_path, "w", encoding="utf-8") as metrics_file:
+        json.dump(metrics, metrics_file, indent=4)
+    st.write("📊 Dataset metrics", metrics)
 
-        await asyncio.sleep(4)  # 너무 빠른 반복을 방지하기 위해 4초 대기
+
+def open_turn_log() -> TurnLogSink:
+    """Open the per-turn JSONL log for the current task and record its starting messages"""
+    selected_file = st.session_state.get("selected_file", "chat")
+    last_identifier = st.session_state.get("current_identifier", "unknown")
+    timestamp = datetime.now().strftime("%Y-%m-%d")
+    rotate_bytes = os.getenv("TURN_LOG_ROTATE_BYTES")
+    turn_log = TurnLogSink(
+        os.path.join(LOG_DIR, f"{selected_file}_{timestamp}_{last_identifier}.jsonl"),
+        store=BlobStore(os.path.join(LOG_DIR, BLOB_DIR_NAME)),
+        compression="zstd" if os.getenv("TURN_LOG_COMPRESSION") == "zstd" else None,
+        rotate_bytes=int(rotate_bytes) if rotate_bytes else None,
+    )
+    turn_log.write(
+        {
+            "identifier": last_identifier,
+            "messages": snapshot_messages(st.session_state.messages),
+        }
+    )
+    return turn_log
 
 
 def save_log_to_dir(selected_file):
-    """로그를 log 디렉토리에 저장하는 함수"""
+    """
+    Start saving the task's log to the log directory. Serialising and writing it
+    happens on a worker thread, overlapping the next task; finish_log_write
+    reports the outcome.
+    """
     st.write("⚠️ save_log_to_dir")
     if not st.session_state.messages:
         st.write("⚠️ No messages to save")
@@ -798,54 +1309,61 @@ def save_log_to_dir(selected_file):
 
     st.session_state.log_saved = True
 
-    last_identifier = st.session_state.get("current_identifier", "unknown")
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-
-    processed_messages = []
-    for msg in st.session_state.messages:
-        role = msg.get("role", "unknown")
-        content = msg.get("content", "")
-
-        if role == "user" and isinstance(content, list):
-            for item in content:
-                if item.get("type") == "tool_result":
-                    role = "assistant"
-                    break
-
-        processed_messages.append({"role": role, "content": content})
+    # the message list is replaced, not changed, once the task is over
+    st.session_state.log_write = asyncio.ensure_future(
+        asyncio.to_thread(
+            _write_log,
+            selected_file,
+            st.session_state.get("current_identifier", "unknown"),
+            st.session_state.messages,
+            st.session_state.task_metrics.to_dict(),
+            st.session_state.get("stop_reason"),
+        )
+    )
 
-    log_data = {
-        "timestamp": timestamp,
-        "identifier": last_identifier,
-        "messages": processed_messages,
-    }
 
-    json_bytes = json.dumps(log_data, indent=4, ensure_ascii=False).encode("utf-8")
+def _write_log(
+    selected_file, last_identifier, messages, metrics, stop_reason
+) -> tuple[str, bytes]:
+    """Serialise a task's log and write it to the log directory; no st.* calls"""
+    log_data = build_log(
+        last_identifier, messages, metrics=metrics, stop_reason=stop_reason
+    )
+    timestamp = log_data["timestamp"]
 
-    # ✅ 로그 디렉토리 존재 확인 후 파일 저장
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR, exist_ok=True)
+    # screenshots go to the shared blob store, the transcript only keeps digests
+    json_bytes = dump_log(log_data, BlobStore(os.path.join(LOG_DIR, BLOB_DIR_NAME)))
 
+    os.makedirs(LOG_DIR, exist_ok=True)
     log_file_path = os.path.join(LOG_DIR, f"{selected_file}_{timestamp}_{last_identifier}.json")
+    with open(log_file_path, "wb") as log_file:
+        log_file.write(json_bytes)
+    return log_file_path, json_bytes
 
-    try:
-        with open(log_file_path, "wb") as log_file:
-            log_file.write(json_bytes)
-
-        # ✅ 파일이 정상적으로 저장되었는지 확인
-        if os.path.exists(log_file_path) and os.stat(log_file_path).st_size > 0:
-            st.session_state.saved_file_name = log_file_path
-            st.session_state.saved_file_content = io.BytesIO(json_bytes)
-            st.write(f"✅ Log successfully saved: {log_file_path}")
-            st.write(f"📄 File size: {os.stat(log_file_path).st_size} bytes")
-            #return True
-        else:
-            st.error("❌ Log file was created but is empty. Please check the writing process.")
-            #return False
 
+async def finish_log_write():
+    """Wait for the log write started by save_log_to_dir, if any, and report on it"""
+    write = st.session_state.get("log_write")
+    if write is None:
+        return
+    st.session_state.log_write = None
+    if write.get_loop() is not asyncio.get_running_loop():
+        # started by an earlier run of the script; its thread finishes the write
+        return
+    try:
+        log_file_path, json_bytes = await write
     except Exception as e:
         st.error(f"❌ Log saving failed: {e}")
-        #return False
+        return
+
+    # ✅ 파일이 정상적으로 저장되었는지 확인
+    if os.path.exists(log_file_path) and os.stat(log_file_path).st_size > 0:
+        st.session_state.saved_file_name = log_file_path
+        st.session_state.saved_file_content = io.BytesIO(json_bytes)
+        st.write(f"✅ Log successfully saved: {log_file_path}")
+        st.write(f"📄 File size: {os.stat(log_file_path).st_size} bytes")
+    else:
+        st.error("❌ Log file was created but is empty. Please check the writing process.")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,14 +1,22 @@
 from .base import CLIResult, ToolResult
-from .bash import BashTool
+from .bash import BASH_POOL_SIZE, BashTool
+from .cancellation import INTERRUPTED_TOOL_ERROR, Cancelled, CancelToken
 from .collection import ToolCollection
 from .computer import ComputerTool
 from .edit import EditTool
+from .image import ImageData, inline_images
 
 __ALL__ = [
+    BASH_POOL_SIZE,
     BashTool,
     CLIResult,
+    Cancelled,
+    CancelToken,
     ComputerTool,
     EditTool,
+    INTERRUPTED_TOOL_ERROR,
+    ImageData,
     ToolCollection,
     ToolResult,
+    inline_images,
 ]
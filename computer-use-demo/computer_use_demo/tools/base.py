@@ -4,6 +4,8 @@ from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .image import ImageData
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -19,6 +21,19 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    async def reset(self):
+        """Return the tool to the state of a new instance, for task isolation."""
+        # stateless tools have nothing to reset
+        return
+
+    async def close(self):
+        """Release processes and other resources the tool holds."""
+        return
+
+    async def ready(self):
+        """Return once the tool can take a new task's first call."""
+        return
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -28,9 +43,16 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    image: ImageData | None = None
+
+    def __post_init__(self):
+        # base64_image is accepted for compatibility; image is the shared representation
+        if self.base64_image and self.image is None:
+            object.__setattr__(self, "image", ImageData.from_base64(self.base64_image))
 
     def __bool__(self):
-        return any(getattr(self, field.name) for field in fields(self))
+        # only content counts; metadata such as a command's duration does not
+        return any(getattr(self, field.name) for field in fields(ToolResult))
 
     def __add__(self, other: "ToolResult"):
         def combine_fields(
@@ -42,20 +64,38 @@ class ToolResult:
                 raise ValueError("Cannot combine tool results")
             return field or other_field
 
+        if self.image and other.image:
+            raise ValueError("Cannot combine tool results")
+
         return ToolResult(
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            image=self.image or other.image,
         )
 
     def replace(self, **kwargs):
-        """Returns a new ToolResult with the given fields replaced."""
+        """
+        Returns a new ToolResult with the given fields replaced. base64_image and
+        image are two forms of one screenshot, so replacing either drops the other.
+        """
+        if "base64_image" in kwargs and "image" not in kwargs:
+            kwargs["image"] = None
+        elif "image" in kwargs and "base64_image" not in kwargs:
+            kwargs["base64_image"] = None
         return replace(self, **kwargs)
 
 
+@dataclass(kw_only=True, frozen=True)
 class CLIResult(ToolResult):
-    """A ToolResult that can be rendered as a CLI output."""
+    """
+    A ToolResult that can be rendered as a CLI output, with the exit status and
+    duration of the command where known.
+    """
+
+    exit_code: int | None = None
+    duration: float | None = None
 
 
 class ToolFailure(ToolResult):
@@ -1,11 +1,24 @@
 import asyncio
+import contextlib
+import logging
 import os
-from typing import ClassVar, Literal
+import re
+import secrets
+import signal
+import time
+from collections import deque
+from collections.abc import Coroutine, Iterator
+from typing import Any, ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 
+logger = logging.getLogger(__name__)
+
+# started shells each BashTool keeps ready for restarts and new sessions
+BASH_POOL_SIZE = 2
+
 
 class _BashSession:
     """A session of a bash shell."""
@@ -16,25 +29,43 @@ class _BashSession:
     command: str = "/bin/bash"
     _output_delay: float = 0.2  # seconds
     _timeout: float = 120.0  # seconds
+    _kill_timeout: float = 5.0  # seconds
     _sentinel: str = "<<exit>>"
 
     def __init__(self):
         self._started = False
         self._timed_out = False
+        self._loop: asyncio.AbstractEventLoop | None = None
 
     async def start(self):
         if self._started:
             return
 
-        self._process = await asyncio.create_subprocess_shell(
-            self.command,
-            preexec_fn=os.setsid,
-            shell=True,
-            bufsize=0,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        spawn = asyncio.ensure_future(
+            asyncio.create_subprocess_shell(
+                self.command,
+                preexec_fn=os.setsid,
+                shell=True,
+                bufsize=0,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
         )
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._process = await asyncio.shield(spawn)
+        except asyncio.CancelledError:
+            # a spawn cancelled midway leaves its transport waiting forever for the
+            # killed child, so let it finish and reap the shell instead
+            self._process = await spawn
+            self._started = True
+            await self.close()
+            raise
+        # job control puts every command in a process group of its own, so a
+        # timed-out command can be interrupted without touching the shell
+        assert self._process.stdin
+        self._process.stdin.write(b"set -m\n")
 
         self._started = True
 
@@ -46,8 +77,47 @@ class _BashSession:
             return
         self._process.terminate()
 
+    def kill(self, sig: int = signal.SIGTERM):
+        """Signal the shell and its jobs, including commands still running."""
+        if not self._started:
+            return
+        # the shell leads its own process group, see preexec_fn in start
+        for group in {self._process.pid, *self._job_groups()}:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(group, sig)
+
+    async def close(self):
+        """Kill the shell and, on its own event loop, reap it."""
+        self.kill()
+        if not self._started or not self.usable:
+            return
+        # the process only counts as finished once every pipe is closed
+        assert self._process.stdin
+        self._process.stdin.close()
+        try:
+            async with asyncio.timeout(self._kill_timeout):
+                await self._process.wait()
+        except TimeoutError:
+            self.kill(signal.SIGKILL)
+            await self._process.wait()
+
+    @property
+    def alive(self) -> bool:
+        """Whether the shell is running and can take another command."""
+        return (
+            self._started and self._process.returncode is None and not self._timed_out
+        )
+
+    @property
+    def usable(self) -> bool:
+        """Whether the shell can take commands from the running event loop."""
+        return self._loop is asyncio.get_running_loop()
+
     async def run(self, command: str):
-        """Execute a command in the bash shell."""
+        """
+        Execute a command in the bash shell. If the caller is cancelled, e.g. when
+        its task is stopped, the jobs the command started are stopped with it.
+        """
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -65,42 +135,215 @@ class _BashSession:
         assert self._process.stdout
         assert self._process.stderr
 
-        # send command to the process
+        # a fresh sentinel per command, so the end of an interrupted command is
+        # never mistaken for the end of the next one
+        sentinel = f"{self._sentinel[:-2]}:{secrets.token_hex(4)}:"
+        jobs_before = self._job_groups()
+        start = time.monotonic()
+
+        # send command to the process; the sentinel goes on its own line so that
+        # trailing comments and heredocs do not swallow it
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            command.encode() + f'\necho "{sentinel}$?>>"\n'.encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
         try:
-            async with asyncio.timeout(self._timeout):
+            finished = await self._read_until(sentinel, self._timeout)
+        except asyncio.CancelledError:
+            if await self._interrupt(sentinel, jobs_before) is None:
+                self._timed_out = True
+            # the next command's output must not start with this one's
+            self._take_stderr()
+            raise
+        if finished is None:
+            finished = await self._interrupt(sentinel, jobs_before)
+            if finished is None:
+                self._timed_out = True
+                raise ToolError(
+                    f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
+                )
+            output, exit_code = finished
+            error = self._take_stderr()
+            message = (
+                f"timed out: the command did not finish in {self._timeout} seconds"
+                f" and was interrupted (exit status {exit_code}); the shell is still"
+                " usable"
+            )
+            raise ToolError(
+                "\n".join(part for part in (message, output, error) if part)
+            )
+
+        output, exit_code = finished
+        return CLIResult(
+            output=output,
+            error=self._take_stderr(),
+            exit_code=exit_code,
+            duration=time.monotonic() - start,
+        )
+
+    async def _interrupt(
+        self, sentinel: str, jobs_before: set[int]
+    ) -> tuple[str, int] | None:
+        """
+        Stop the jobs a command started and wait for its end, as _read_until; None
+        if the shell itself does not return.
+        """
+        # stop only the jobs the command started, forcibly if they linger; not
+        # with SIGINT, on which a non-interactive shell exits along with its job
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            for group in self._job_groups() - jobs_before:
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(group, sig)
+            if finished := await self._read_until(sentinel, self._kill_timeout):
+                return finished
+        return None
+
+    async def _read_until(
+        self, sentinel: str, timeout: float
+    ) -> tuple[str, int] | None:
+        """
+        Wait for the sentinel and the exit status after it; returns the output
+        before it and the status, or None after timeout seconds.
+        """
+        assert self._process.stdout
+        pattern = re.compile(re.escape(sentinel) + r"(\d+)>>\n?")
+        try:
+            async with asyncio.timeout(timeout):
                 while True:
                     await asyncio.sleep(self._output_delay)
                     # if we read directly from stdout/stderr, it will wait forever for
                     # EOF. use the StreamReader buffer directly instead.
                     output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
+                    if match := pattern.search(output):
                         break
         except asyncio.TimeoutError:
-            self._timed_out = True
-            raise ToolError(
-                f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
-            ) from None
+            return None
 
+        # clear the buffer so that the next output can be read correctly
+        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        output = output[: match.start()]
         if output.endswith("\n"):
             output = output[:-1]
+        return output, int(match.group(1))
 
+    def _take_stderr(self) -> str:
+        assert self._process.stderr
         error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
         if error.endswith("\n"):
             error = error[:-1]
+        return error
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+    def _job_groups(self) -> set[int]:
+        """
+        The process groups of the shell's jobs: with job control on, every command
+        and pipeline the shell starts gets a group of its own.
+        """
+        shell_group = self._process.pid
+        processes = list(_processes())
+        group_of = {pid: pgid for pid, _, pgid in processes}
+        return {
+            pgid
+            for _, ppid, pgid in processes
+            if pgid != shell_group and group_of.get(ppid) == shell_group
+        }
+
+
+def _processes() -> Iterator[tuple[int, int, int]]:
+    """The pid, parent pid and process group of every process, read from /proc."""
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat") as stat:
+                # the command name in parentheses may contain anything
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        yield int(entry.name), int(fields[1]), int(fields[2])
+
+
+class _BashSessionPool:
+    """
+    Started shells waiting to be handed out. Every hand-out refills the pool in the
+    background, and discarded shells are reaped in the background, so neither
+    spawning nor reaping is on the request path. Background work that fails is
+    logged and counted in failures; a refill that failed is retried on the next
+    hand-out. Shells belong to the event loop they were started on, and so does the
+    pool.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: deque[_BashSession] = deque()
+        self._loop = asyncio.get_running_loop()
+        self._refilling = False
+        self._tasks: set[asyncio.Task[None]] = set()
+        self.failures = 0
+
+    @property
+    def usable(self) -> bool:
+        return self._loop is asyncio.get_running_loop()
+
+    async def acquire(self) -> _BashSession:
+        while self._idle:
+            session = self._idle.popleft()
+            if session.alive:
+                break
+            self.discard(session)
+        else:
+            session = _BashSession()
+            await session.start()
+        self._spawn(self._refill())
+        return session
+
+    def discard(self, session: _BashSession):
+        self._spawn(session.close())
 
-        return CLIResult(output=output, error=error)
+    async def close(self):
+        """Reap every idle shell and wait for background work to finish."""
+        while self._idle:
+            self.discard(self._idle.popleft())
+        self.size = 0
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def abandon(self):
+        """
+        Kill the idle shells of a pool whose event loop has closed, e.g. after a
+        Streamlit rerun; they can be signalled from another loop but not reaped.
+        """
+        self.size = 0
+        while self._idle:
+            self._idle.popleft().kill()
+        # a loop closed by asyncio.run has already cancelled its tasks
+        with contextlib.suppress(RuntimeError):
+            for task in self._tasks:
+                self._loop.call_soon_threadsafe(task.cancel)
+
+    async def _refill(self):
+        if self._refilling:
+            return
+        self._refilling = True
+        try:
+            while len(self._idle) < self.size:
+                session = _BashSession()
+                await session.start()
+                self._idle.append(session)
+        finally:
+            self._refilling = False
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]):
+        task = self._loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task[None]):
+        self._tasks.discard(task)
+        if not task.cancelled() and (error := task.exception()) is not None:
+            self.failures += 1
+            logger.warning("bash session pool: background work failed", exc_info=error)
 
 
 class BashTool(BaseAnthropicTool):
@@ -110,35 +353,75 @@ class BashTool(BaseAnthropicTool):
     """
 
     _session: _BashSession | None
+    _pool: _BashSessionPool | None
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
+    def __init__(self, pool_size: int = BASH_POOL_SIZE):
         self._session = None
+        self._pool = None
+        self.pool_size = pool_size
         super().__init__()
 
     async def __call__(
         self, command: str | None = None, restart: bool = False, **kwargs
     ):
         if restart:
-            if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+            self._discard_session()
+            self._session = await self._new_session()
 
             return ToolResult(system="tool has been restarted.")
 
+        if self._session is not None and not self._session.usable:
+            # a shell started on an earlier event loop cannot be driven from this one
+            self._discard_session()
         if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await self._new_session()
 
         if command is not None:
             return await self._session.run(command)
 
         raise ToolError("no command provided.")
 
+    async def reset(self):
+        """Stop the bash session; the next command starts a new one."""
+        self._discard_session()
+
+    async def close(self):
+        """Reap the current and pre-started shells, e.g. when a worker shuts down."""
+        self._discard_session()
+        if self._pool is not None:
+            if self._pool.usable:
+                await self._pool.close()
+            else:
+                self._pool.abandon()
+        self._pool = None
+
+    async def _new_session(self) -> _BashSession:
+        if self._pool is not None and not self._pool.usable:
+            self._pool.abandon()
+            self._pool = None
+        if self._pool is None:
+            self._pool = _BashSessionPool(self.pool_size)
+        return await self._pool.acquire()
+
+    def _discard_session(self):
+        if self._session is None:
+            return
+        session, self._session = self._session, None
+        if self._pool is not None and self._pool.usable and session.usable:
+            self._pool.discard(session)
+        else:
+            # a shell of an earlier event loop can only be signalled, not reaped
+            session.kill()
+
     def to_params(self) -> BetaToolBash20241022Param:
+        return self.params()
+
+    @classmethod
+    def params(cls) -> BetaToolBash20241022Param:
+        """What to_params returns, without creating a tool."""
         return {
-            "type": self.api_type,
-            "name": self.name,
+            "type": cls.api_type,
+            "name": cls.name,
         }
@@ -0,0 +1,90 @@
+"""Cooperative cancellation of the API calls and tool calls of a task."""
+
+import asyncio
+import contextlib
+import inspect
+import threading
+from collections.abc import Awaitable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+INTERRUPTED_TOOL_ERROR = "the task was stopped before this tool call finished"
+
+
+class Cancelled(Exception):
+    """Raised by CancelToken.race when the token is cancelled first."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    A request to stop a task, e.g. by the user. It can be cancelled from any thread,
+    and work raced against it with race() is cancelled at once rather than at its
+    next check, so that subprocesses are killed and requests aborted promptly.
+    """
+
+    def __init__(self):
+        self.reason: str | None = None
+        self._lock = threading.Lock()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the token; later calls keep the first reason."""
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            # the waiter's loop may have closed since
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(_wake, waiter)
+
+    async def wait(self):
+        """Return once the token is cancelled."""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self._lock:
+            if self.reason is not None:
+                return
+            self._waiters.append((loop, waiter))
+        try:
+            await waiter
+        finally:
+            with self._lock, contextlib.suppress(ValueError):
+                self._waiters.remove((loop, waiter))
+
+    async def race(self, awaitable: Awaitable[T]) -> T:
+        """
+        Await awaitable, unless the token is cancelled first: then its task is
+        cancelled, given the chance to clean up, and Cancelled is raised.
+        """
+        if self.reason is not None:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise Cancelled(self.reason)
+        task = asyncio.ensure_future(awaitable)
+        cancelled = asyncio.ensure_future(self.wait())
+        try:
+            await asyncio.wait([task, cancelled], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancelled.cancel()
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+        if task.cancelled() and self.reason is not None:
+            raise Cancelled(self.reason)
+        return task.result()
+
+
+def _wake(waiter: asyncio.Future[None]):
+    if not waiter.done():
+        waiter.set_result(None)
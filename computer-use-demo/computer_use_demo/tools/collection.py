@@ -1,5 +1,7 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
+from collections.abc import Awaitable, Collection
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -10,6 +12,7 @@ from .base import (
     ToolFailure,
     ToolResult,
 )
+from .cancellation import INTERRUPTED_TOOL_ERROR, Cancelled, CancelToken
 
 
 class ToolCollection:
@@ -18,17 +21,88 @@ class ToolCollection:
     def __init__(self, *tools: BaseAnthropicTool):
         self.tools = tools
         self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        self._setup: asyncio.Future[Any] | None = None
 
     def to_params(
         self,
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
-    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+    async def reset(self, names: Collection[str] | None = None):
+        """
+        Reset the named tools, or all of them, so a collection kept across tasks can
+        give a task a clean session where it needs one.
+        """
+        if names is not None and (unknown := set(names) - self.tool_map.keys()):
+            raise ValueError(f"Unknown tools: {sorted(unknown)}")
+        for name, tool in self.tool_map.items():
+            if names is None or name in names:
+                await tool.reset()
+
+    async def close(self):
+        for tool in self.tools:
+            await tool.close()
+
+    async def wait_ready(self, timeout: float):
+        """
+        Wait for every tool to be ready for a new task, e.g. for the desktop to
+        settle after the last one, but no longer than timeout seconds.
+        """
+        if timeout <= 0:
+            return
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.gather(*(tool.ready() for tool in self.tools))
+        except TimeoutError:
+            return
+
+    def hold(self, setup: Awaitable[Any]) -> asyncio.Future[Any]:
+        """
+        Hold tool calls until setup is done, so that a task's setup, such as
+        resetting tools or waiting for them to be ready, overlaps its first API call
+        instead of delaying it. Returns the setup's future; calls that waited for a
+        setup that failed get its error as their result.
+        """
+        self._setup = future = asyncio.ensure_future(setup)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, setup: asyncio.Future[Any]):
+        if self._setup is setup:
+            self._setup = None
+
+    async def run(
+        self,
+        *,
+        name: str,
+        tool_input: dict[str, Any],
+        cancel_token: CancelToken | None = None,
+    ) -> ToolResult:
+        """
+        Run a tool. Once cancel_token is cancelled, a running call is cancelled and
+        new ones do not start; either way the result is an interruption error.
+        """
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
+        call = self._call(tool, tool_input)
         try:
-            return await tool(**tool_input)
+            if cancel_token:
+                return await cancel_token.race(call)
+            return await call
         except ToolError as e:
             return ToolFailure(error=e.message)
+        except Cancelled:
+            return ToolFailure(error=INTERRUPTED_TOOL_ERROR)
+
+    async def _call(self, tool: BaseAnthropicTool, tool_input: dict[str, Any]):
+        if (setup := self._setup) is not None and not setup.cancelled():
+            try:
+                await asyncio.shield(setup)
+            except asyncio.CancelledError:
+                # a cancelled setup, e.g. of a stopped task, holds nothing up
+                if not setup.cancelled():
+                    raise
+            except Exception as e:
+                return ToolFailure(error=f"Tool setup failed: {e!r}")
+        return await tool(**tool_input)
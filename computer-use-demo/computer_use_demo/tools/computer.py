@@ -1,20 +1,20 @@
 import asyncio
-import base64
 import os
-import shlex
-import shutil
+from collections.abc import Sequence
 from enum import StrEnum
-from pathlib import Path
 from typing import Literal, TypedDict
-from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
-from .run import run
-
-OUTPUT_DIR = "/tmp/outputs"
-
+from .cursor import cursor_overlay, forget_cursor_overlay
+from .damage import X_ERRORS, damage_tracker, forget_damage_tracker
+from .image import ImageData
+from .run import run, run_binary
+from .screenshots import ScreenshotStore
+
+# how often to compare screenshots while waiting for the desktop to settle
+SETTLE_POLL_SECONDS = 0.5
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
 
@@ -57,6 +57,25 @@ class ComputerToolOptions(TypedDict):
     display_number: int | None
 
 
+def screen_from_env() -> tuple[int, int, int | None]:
+    """The width, height and display number of the screen, from the environment."""
+    width = int(os.getenv("WIDTH") or 0)
+    height = int(os.getenv("HEIGHT") or 0)
+    assert width and height, "WIDTH, HEIGHT must be set"
+    display_num = os.getenv("DISPLAY_NUM")
+    return width, height, None if display_num is None else int(display_num)
+
+
+def scaling_target(width: int, height: int) -> Resolution | None:
+    """The target a screen of this size is scaled down to, if any."""
+    ratio = width / height
+    for dimension in MAX_SCALING_TARGETS.values():
+        # allow some error in the aspect ratio - not ratios are exactly 16:9
+        if abs(dimension["width"] / dimension["height"] - ratio) < 0.02:
+            return dimension if dimension["width"] < width else None
+    return None
+
+
 def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
@@ -90,20 +109,34 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
+    @classmethod
+    def params(cls) -> BetaToolComputerUse20241022Param:
+        """What to_params of a tool created now returns, without creating one."""
+        width, height, display_num = screen_from_env()
+        if cls._scaling_enabled and (target := scaling_target(width, height)):
+            width, height = target["width"], target["height"]
+        return {
+            "name": cls.name,
+            "type": cls.api_type,
+            "display_width_px": width,
+            "display_height_px": height,
+            "display_number": display_num,
+        }
+
     def __init__(self):
         super().__init__()
 
-        self.width = int(os.getenv("WIDTH") or 0)
-        self.height = int(os.getenv("HEIGHT") or 0)
-        assert self.width and self.height, "WIDTH, HEIGHT must be set"
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
-            self.display_num = int(display_num)
-            self._display_prefix = f"DISPLAY=:{self.display_num} "
+        self.width, self.height, self.display_num = screen_from_env()
+        # commands are executed without a shell, the display going by environment
+        if self.display_num is not None:
+            self._env = {"DISPLAY": f":{self.display_num}"}
+            self._display_name = self._env["DISPLAY"]
         else:
-            self.display_num = None
-            self._display_prefix = ""
+            self._env = None
+            self._display_name = os.getenv("DISPLAY")
 
-        self.xdotool = f"{self._display_prefix}xdotool"
+        self.xdotool = "xdotool"
+        self.screenshots = ScreenshotStore.from_env()
 
     async def __call__(
         self,
@@ -128,10 +161,13 @@ class ComputerTool(BaseAnthropicTool):
             )
 
             if action == "mouse_move":
-                return await self.shell(f"{self.xdotool} mousemove --sync {x} {y}")
+                return await self.shell(
+                    [self.xdotool, "mousemove", "--sync", str(x), str(y)]
+                )
             elif action == "left_click_drag":
                 return await self.shell(
-                    f"{self.xdotool} mousedown 1 mousemove --sync {x} {y} mouseup 1"
+                    [self.xdotool, "mousedown", "1", "mousemove", "--sync"]
+                    + [str(x), str(y), "mouseup", "1"]
                 )
 
         if action in ("key", "type"):
@@ -143,17 +179,20 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(output=f"{text} must be a string")
 
             if action == "key":
-                return await self.shell(f"{self.xdotool} key -- {text}")
+                # keys are separated by whitespace, as a shell would split them
+                return await self.shell([self.xdotool, "key", "--", *text.split()])
             elif action == "type":
                 results: list[ToolResult] = []
                 for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    cmd = f"{self.xdotool} type --delay {TYPING_DELAY_MS} -- {shlex.quote(chunk)}"
-                    results.append(await self.shell(cmd, take_screenshot=False))
-                screenshot_base64 = (await self.screenshot()).base64_image
+                    cmd = [self.xdotool, "type", "--delay", str(TYPING_DELAY_MS), "--"]
+                    results.append(
+                        await self.shell([*cmd, chunk], take_screenshot=False)
+                    )
+                screenshot = (await self.screenshot()).image
                 return ToolResult(
                     output="".join(result.output or "" for result in results),
                     error="".join(result.error or "" for result in results),
-                    base64_image=screenshot_base64,
+                    image=screenshot,
                 )
 
         if action in (
@@ -173,7 +212,7 @@ class ComputerTool(BaseAnthropicTool):
                 return await self.screenshot()
             elif action == "cursor_position":
                 result = await self.shell(
-                    f"{self.xdotool} getmouselocation --shell",
+                    [self.xdotool, "getmouselocation", "--shell"],
                     take_screenshot=False,
                 )
                 output = result.output or ""
@@ -184,68 +223,107 @@ class ComputerTool(BaseAnthropicTool):
                 )
                 return result.replace(output=f"X={x},Y={y}")
             else:
-                click_arg = {
-                    "left_click": "1",
-                    "right_click": "3",
-                    "middle_click": "2",
-                    "double_click": "--repeat 2 --delay 500 1",
+                click_args = {
+                    "left_click": ["1"],
+                    "right_click": ["3"],
+                    "middle_click": ["2"],
+                    "double_click": ["--repeat", "2", "--delay", "500", "1"],
                 }[action]
-                return await self.shell(f"{self.xdotool} click {click_arg}")
+                return await self.shell([self.xdotool, "click", *click_args])
 
         raise ToolError(f"Invalid action: {action}")
 
     async def screenshot(self):
-        """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-
-        # Try gnome-screenshot first
-        if shutil.which("gnome-screenshot"):
-            screenshot_cmd = f"{self._display_prefix}gnome-screenshot -f {path} -p"
-        else:
-            # Fall back to scrot if gnome-screenshot isn't available
-            screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
-
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
+        """
+        Take a screenshot of the current screen, pointer included, and return it as
+        shared ImageData. Where the display reports damage, only what changed since
+        the last one is captured, and an unchanged screen returns the same image
+        again; otherwise it is captured, scaled and encoded in one pass straight to
+        memory, and the pointer drawn on after. The screenshot is kept in the
+        screenshot store.
+        """
+        image = await self._take_screenshot()
+        self.screenshots.add(image)
+        return ToolResult(image=image)
+
+    async def _take_screenshot(self) -> ImageData:
+        size = None
         if self._scaling_enabled:
-            x, y = self.scale_coordinates(
+            size = self.scale_coordinates(
                 ScalingSource.COMPUTER, self.width, self.height
             )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
-
-        if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
+        image = await asyncio.to_thread(self._capture_damage, size)
+        if image is None:
+            command = ["import", "-window", "root"]
+            if size is not None:
+                command += ["-resize", f"{size[0]}x{size[1]}!"]
+            code, data, error = await run_binary([*command, "png:-"], env=self._env)
+            if code or not data:
+                raise ToolError(f"Failed to take screenshot: {error.decode().strip()}")
+            image = ImageData.from_bytes(
+                await asyncio.to_thread(self._draw_cursor, data)
             )
-        raise ToolError(f"Failed to take screenshot: {result.error}")
-
-    async def shell(self, command: str, take_screenshot=True) -> ToolResult:
-        """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
-        base64_image = None
+        return image
+
+    def _draw_cursor(self, data: bytes) -> bytes:
+        """A screenshot with the pointer drawn on, where the display can tell where."""
+        if (overlay := cursor_overlay(self._display_name)) is None:
+            return data
+        try:
+            return overlay.draw(data)
+        except X_ERRORS:
+            forget_cursor_overlay(self._display_name)
+            return data
+
+    def _capture_damage(self, size: tuple[int, int] | None) -> ImageData | None:
+        """The screen from its display's damage tracker, or None without one."""
+        if (tracker := damage_tracker(self._display_name)) is None:
+            return None
+        try:
+            return tracker.capture(size)
+        except X_ERRORS:
+            forget_damage_tracker(self._display_name)
+            return None
+
+    async def ready(self):
+        """
+        Return once two screenshots in a row match, i.e. the desktop has settled.
+        These polls are not shown to the model, so they stay out of the store.
+        """
+        previous = None
+        while True:
+            try:
+                image = await self._take_screenshot()
+            except ToolError:
+                image = None
+            if image is not None and previous is not None:
+                if image.digest == previous.digest:
+                    return
+            previous = image
+            await asyncio.sleep(SETTLE_POLL_SECONDS)
+
+    async def shell(
+        self, command: str | Sequence[str], take_screenshot=True
+    ) -> ToolResult:
+        """
+        Run a command on the display, as an argv list unless it needs a shell, and
+        return the output, error, and optionally a screenshot.
+        """
+        _, stdout, stderr = await run(command, env=self._env)
+        image = None
 
         if take_screenshot:
             # delay to let things settle before taking a screenshot
             await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
+            image = (await self.screenshot()).image
 
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+        return ToolResult(output=stdout, error=stderr, image=image)
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
         if not self._scaling_enabled:
             return x, y
-        ratio = self.width / self.height
-        target_dimension = None
-        for dimension in MAX_SCALING_TARGETS.values():
-            # allow some error in the aspect ratio - not ratios are exactly 16:9
-            if abs(dimension["width"] / dimension["height"] - ratio) < 0.02:
-                if dimension["width"] < self.width:
-                    target_dimension = dimension
-                break
+        target_dimension = scaling_target(self.width, self.height)
         if target_dimension is None:
             return x, y
         # should be less than 1
@@ -0,0 +1,149 @@
+"""
+The mouse pointer, which X screen captures leave out, read with the XFIXES
+extension so that it can be drawn onto screenshots.
+"""
+
+import contextlib
+import io
+import struct
+import threading
+from dataclasses import dataclass
+
+from PIL import Image
+from Xlib import error
+from Xlib.display import Display
+from Xlib.ext import xfixes
+
+# errors that mean a display cannot, or can no longer, be used
+X_ERRORS = (
+    error.DisplayError,
+    error.ConnectionClosedError,
+    error.XauthError,
+    error.XNoAuthError,
+    error.XError,
+    OSError,
+)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Cursor:
+    """The pointer image, placed with its top-left corner at x, y on the screen."""
+
+    x: int
+    y: int
+    serial: int
+    image: Image.Image
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        """Equal for two reads only if the pointer looks and sits the same."""
+        return self.x, self.y, self.serial
+
+    def draw(
+        self, frame: Image.Image, scale: tuple[float, float] = (1, 1)
+    ) -> Image.Image:
+        """A copy of frame, the screen scaled by scale, with the pointer on it."""
+        image = self.image
+        if scale != (1, 1):
+            image = image.resize(
+                (
+                    max(round(image.width * scale[0]), 1),
+                    max(round(image.height * scale[1]), 1),
+                ),
+                Image.Resampling.LANCZOS,
+            )
+        frame = frame.copy()
+        frame.paste(
+            image, (round(self.x * scale[0]), round(self.y * scale[1])), mask=image
+        )
+        return frame
+
+
+def has_cursor(display: Display) -> bool:
+    """Whether the pointer of display can be read, enabling XFIXES if so."""
+    if not display.has_extension(xfixes.extname):
+        return False
+    display.xfixes_query_version()
+    return True
+
+
+def read_cursor(display: Display) -> Cursor | None:
+    """The pointer of a display that has_cursor, or None if it has no image."""
+    reply = display.xfixes_get_cursor_image(None)
+    if not reply.width or not reply.height:
+        return None
+    # premultiplied ARGB pixels, one 32-bit value each
+    pixels = struct.pack(f"<{len(reply.cursor_image)}I", *reply.cursor_image)
+    image = Image.frombytes(
+        "RGBa", (reply.width, reply.height), pixels, "raw", "BGRa"
+    ).convert("RGBA")
+    return Cursor(
+        x=reply.x - reply.xhot,
+        y=reply.y - reply.yhot,
+        serial=reply.cursor_serial,
+        image=image,
+    )
+
+
+class CursorOverlay:
+    """
+    Draws the pointer onto screenshots taken some other way, e.g. by ImageMagick,
+    over a connection of its own to the display.
+    """
+
+    def __init__(self, display: Display):
+        self._display = display
+        screen = display.screen()
+        self.width, self.height = screen.width_in_pixels, screen.height_in_pixels
+        self._lock = threading.Lock()
+
+    def draw(self, data: bytes) -> bytes:
+        """A PNG screenshot, possibly scaled, with the pointer drawn on it."""
+        with self._lock:
+            cursor = read_cursor(self._display)
+        if cursor is None:
+            return data
+        with Image.open(io.BytesIO(data)) as frame:
+            scale = (frame.width / self.width, frame.height / self.height)
+            output = io.BytesIO()
+            cursor.draw(frame.convert("RGB"), scale).save(output, format="PNG")
+        return output.getvalue()
+
+    def close(self):
+        with self._lock:
+            self._display.close()
+
+
+_overlays: dict[str | None, CursorOverlay | None] = {}
+_overlays_lock = threading.Lock()
+
+
+def cursor_overlay(display_name: str | None) -> CursorOverlay | None:
+    """
+    The display's shared overlay, or None where its pointer cannot be read. A
+    display that cannot be reached is tried again next time.
+    """
+    with _overlays_lock:
+        if display_name not in _overlays:
+            try:
+                display = Display(display_name)
+            except X_ERRORS:
+                return None
+            try:
+                overlay = CursorOverlay(display) if has_cursor(display) else None
+            except X_ERRORS:
+                display.close()
+                return None
+            if overlay is None:
+                display.close()
+            _overlays[display_name] = overlay
+        return _overlays[display_name]
+
+
+def forget_cursor_overlay(display_name: str | None):
+    """Drop the overlay of a display whose connection failed."""
+    with _overlays_lock:
+        overlay = _overlays.pop(display_name, None)
+    if overlay is not None:
+        with contextlib.suppress(*X_ERRORS):
+            overlay.close()
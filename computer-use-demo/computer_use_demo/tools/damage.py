@@ -0,0 +1,196 @@
+"""
+Screenshots of an X display that capture only what the DAMAGE extension reports
+as drawn since the last one, so that an action with no visible effect costs no
+capture at all. The pointer is drawn on from XFIXES, as captures leave it out.
+"""
+
+import contextlib
+import io
+import threading
+from dataclasses import dataclass
+
+from PIL import Image
+from Xlib import X
+from Xlib.display import Display
+from Xlib.ext import damage
+
+from .cursor import X_ERRORS, Cursor, has_cursor, read_cursor
+from .image import ImageData
+
+
+class DamageUnavailable(Exception):
+    """The display lacks what damage tracking needs; capture it in full instead."""
+
+
+@dataclass(frozen=True, kw_only=True)
+class Region:
+    x: int
+    y: int
+    width: int
+    height: int
+
+    def union(self, other: "Region") -> "Region":
+        x, y = min(self.x, other.x), min(self.y, other.y)
+        return Region(
+            x=x,
+            y=y,
+            width=max(self.x + self.width, other.x + other.width) - x,
+            height=max(self.y + self.height, other.y + other.height) - y,
+        )
+
+    def clip(self, width: int, height: int) -> "Region | None":
+        x, y = max(self.x, 0), max(self.y, 0)
+        right, bottom = (
+            min(self.x + self.width, width),
+            min(self.y + self.height, height),
+        )
+        if right <= x or bottom <= y:
+            return None
+        return Region(x=x, y=y, width=right - x, height=bottom - y)
+
+
+class DamageTracker:
+    """
+    The screen of one display, kept as its last full-resolution frame. Each
+    capture grabs only the bounding box of what was drawn since the one before,
+    and an unchanged screen under an unmoved pointer returns the image encoded
+    last time. A resize of the screen, e.g. by xrandr, is seen as a ConfigureNotify
+    of the root window, after which the screen is captured in full at its new size.
+    Its methods block on the X connection, so run them in a thread.
+    """
+
+    def __init__(self, display: Display):
+        if not display.has_extension(damage.extname):
+            raise DamageUnavailable("the display has no DAMAGE extension")
+        screen = display.screen()
+        if screen.root_depth != 24:
+            raise DamageUnavailable(f"unsupported screen depth {screen.root_depth}")
+        display.damage_query_version()
+        self._display = display
+        self._root = screen.root
+        self._root.change_attributes(event_mask=X.StructureNotifyMask)
+        self._read_geometry()
+        self._damage = self._root.damage_create(damage.DamageReportBoundingBox)
+        self._notify = display.extension_event.DamageNotify
+        self._has_cursor = has_cursor(display)
+        self._lock = threading.Lock()
+        self._frame: Image.Image | None = None
+        self._cursor_key: tuple[int, int, int] | None = None
+        self._encoded: dict[tuple[int, int], ImageData] = {}
+
+    @classmethod
+    def open(cls, display_name: str | None) -> "DamageTracker":
+        display = Display(display_name)
+        try:
+            return cls(display)
+        except BaseException:
+            display.close()
+            raise
+
+    def capture(self, size: tuple[int, int] | None = None) -> ImageData:
+        """The screen, scaled to size if given."""
+        with self._lock:
+            changed = self._take_damage()
+            if self._frame is None:
+                self._read_geometry()
+                changed = Region(x=0, y=0, width=self.width, height=self.height)
+            if changed is not None:
+                patch = self._grab(changed)
+                if self._frame is None or patch.size == self._frame.size:
+                    self._frame = patch
+                else:
+                    self._frame.paste(patch, (changed.x, changed.y))
+                self._encoded.clear()
+            cursor = read_cursor(self._display) if self._has_cursor else None
+            cursor_key = None if cursor is None else cursor.key
+            if cursor_key != self._cursor_key:
+                self._cursor_key = cursor_key
+                self._encoded.clear()
+            size = size or self._frame.size
+            if (image := self._encoded.get(size)) is None:
+                image = self._encoded[size] = _encode(self._frame, size, cursor)
+            return image
+
+    def close(self):
+        with self._lock:
+            self._display.close()
+
+    def _read_geometry(self):
+        geometry = self._root.get_geometry()
+        self.width, self.height = geometry.width, geometry.height
+
+    def _take_damage(self) -> Region | None:
+        """
+        The bounding box of what was drawn since the last call, or None. Damage is
+        cleared before the round trip that collects its events, so anything drawn
+        meanwhile is reported now and again next time rather than lost. A resized
+        screen drops the frame, as nothing of it can be reused.
+        """
+        self._display.damage_subtract(self._damage)
+        self._display.sync()
+        changed = None
+        while self._display.pending_events():
+            event = self._display.next_event()
+            if event.type == X.ConfigureNotify:
+                if (event.width, event.height) != (self.width, self.height):
+                    self._frame = None
+                continue
+            if event.type != self._notify:
+                continue
+            area = Region(
+                x=event.area.x,
+                y=event.area.y,
+                width=event.area.width,
+                height=event.area.height,
+            )
+            changed = area if changed is None else changed.union(area)
+        return None if changed is None else changed.clip(self.width, self.height)
+
+    def _grab(self, region: Region) -> Image.Image:
+        reply = self._root.get_image(
+            region.x, region.y, region.width, region.height, X.ZPixmap, 0xFFFFFFFF
+        )
+        return Image.frombytes(
+            "RGB", (region.width, region.height), reply.data, "raw", "BGRX"
+        )
+
+
+def _encode(
+    frame: Image.Image, size: tuple[int, int], cursor: Cursor | None
+) -> ImageData:
+    if cursor is not None:
+        frame = cursor.draw(frame)
+    if frame.size != size:
+        frame = frame.resize(size, Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    frame.save(output, format="PNG")
+    return ImageData.from_bytes(output.getvalue())
+
+
+_trackers: dict[str | None, DamageTracker | None] = {}
+_trackers_lock = threading.Lock()
+
+
+def damage_tracker(display_name: str | None) -> DamageTracker | None:
+    """
+    The display's shared tracker, or None where its damage cannot be tracked. A
+    display that cannot be reached is tried again next time.
+    """
+    with _trackers_lock:
+        if display_name not in _trackers:
+            try:
+                _trackers[display_name] = DamageTracker.open(display_name)
+            except DamageUnavailable:
+                _trackers[display_name] = None
+            except X_ERRORS:
+                return None
+        return _trackers[display_name]
+
+
+def forget_damage_tracker(display_name: str | None):
+    """Drop the tracker of a display whose connection failed."""
+    with _trackers_lock:
+        tracker = _trackers.pop(display_name, None)
+    if tracker is not None:
+        with contextlib.suppress(*X_ERRORS):
+            tracker.close()
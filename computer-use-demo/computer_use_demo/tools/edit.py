@@ -32,10 +32,19 @@ class EditTool(BaseAnthropicTool):
         self._file_history = defaultdict(list)
         super().__init__()
 
+    async def reset(self):
+        """Forget the edits undo_edit would revert."""
+        self._file_history.clear()
+
     def to_params(self) -> BetaToolTextEditor20241022Param:
+        return self.params()
+
+    @classmethod
+    def params(cls) -> BetaToolTextEditor20241022Param:
+        """What to_params returns, without creating a tool."""
         return {
-            "name": self.name,
-            "type": self.api_type,
+            "name": cls.name,
+            "type": cls.api_type,
         }
 
     async def __call__(
@@ -115,7 +124,7 @@ class EditTool(BaseAnthropicTool):
                 )
 
             _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
+                ["find", str(path), "-maxdepth", "2", "-not", "-path", r"*/\.*"]
             )
             if not stderr:
                 stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
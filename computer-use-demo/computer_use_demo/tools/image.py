@@ -0,0 +1,112 @@
+"""Shared in-memory representation of screenshots."""
+
+import base64
+import hashlib
+import weakref
+from typing import Any
+
+
+class ImageData:
+    """
+    An immutable image payload shared by tool state, conversation messages and logs.
+
+    Screenshots are held once as raw bytes and interned by content digest, so every
+    reference to an identical capture points at the same object and the bytes are
+    freed when the last reference goes away. The base64 form the API needs is
+    produced the first time a request is serialized (see inline_images) and kept,
+    so a screenshot is encoded once however many requests resend it.
+    """
+
+    __slots__ = ("_data", "_base64", "_digest", "media_type", "__weakref__")
+
+    _interned: "weakref.WeakValueDictionary[str, ImageData]" = (
+        weakref.WeakValueDictionary()
+    )
+
+    def __init__(
+        self,
+        data: bytes | None = None,
+        *,
+        base64_data: str | None = None,
+        media_type: str = "image/png",
+    ):
+        if (data is None) == (base64_data is None):
+            raise ValueError("Exactly one of data or base64_data must be given")
+        self._data = data
+        self._base64 = base64_data
+        self._digest: str | None = None
+        self.media_type = media_type
+
+    @classmethod
+    def from_bytes(cls, data: bytes, media_type: str = "image/png") -> "ImageData":
+        """Return the interned image for data, creating it if needed."""
+        digest = hashlib.sha256(data).hexdigest()
+        if (image := cls._interned.get(digest)) is not None:
+            return image
+        image = cls(data, media_type=media_type)
+        image._digest = digest
+        cls._interned[digest] = image
+        return image
+
+    @classmethod
+    def from_base64(
+        cls, base64_data: str, media_type: str = "image/png"
+    ) -> "ImageData":
+        """Wrap an existing base64 string without decoding it."""
+        return cls(base64_data=base64_data, media_type=media_type)
+
+    @property
+    def data(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        assert self._base64 is not None
+        self._data = base64.b64decode(self._base64)
+        return self._data
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def size(self) -> int:
+        """Size of the raw image in bytes."""
+        if self._data is not None:
+            return len(self._data)
+        assert self._base64 is not None
+        return len(self._base64) * 3 // 4 - self._base64[-2:].count("=")
+
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode()
+        return self._base64
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f"ImageData({self.media_type}, {self.size} bytes)"
+
+
+def inline_images(value: Any) -> Any:
+    """
+    Return value with every ImageData replaced by its base64 string, copying only the
+    containers on the path to an image so the result is JSON serializable.
+    """
+    if isinstance(value, ImageData):
+        return value.base64()
+    if isinstance(value, list):
+        items = [inline_images(item) for item in value]
+        if all(new is old for new, old in zip(items, value, strict=True)):
+            return value
+        return items
+    if isinstance(value, dict):
+        items = {key: inline_images(item) for key, item in value.items()}
+        if all(items[key] is item for key, item in value.items()):
+            return value
+        return items
+    return value
@@ -1,6 +1,11 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import contextlib
+import os
+import shlex
+import signal
+from collections.abc import Mapping, Sequence
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
@@ -16,27 +21,69 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
 
 
 async def run(
-    cmd: str,
+    cmd: str | Sequence[str],
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
+    env: Mapping[str, str] | None = None,
 ):
-    """Run a shell command asynchronously with a timeout."""
-    process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    """
+    Run a command asynchronously with a timeout. A string is run by /bin/sh; an
+    argv sequence is executed directly, sparing a shell where none is needed. env
+    is set on top of the current environment. A command that times out or whose
+    caller is cancelled is killed together with everything it started.
+    """
+    code, stdout, stderr = await run_binary(cmd, timeout, env)
+    return (
+        code,
+        maybe_truncate(stdout.decode(), truncate_after=truncate_after),
+        maybe_truncate(stderr.decode(), truncate_after=truncate_after),
     )
 
+
+async def run_binary(
+    cmd: str | Sequence[str],
+    timeout: float | None = 120.0,  # seconds
+    env: Mapping[str, str] | None = None,
+) -> tuple[int, bytes, bytes]:
+    """As run, but returning the output as it was written, e.g. an image on stdout."""
+    options = {
+        "stdout": asyncio.subprocess.PIPE,
+        "stderr": asyncio.subprocess.PIPE,
+        "env": {**os.environ, **env} if env else None,
+        # a group of its own, so the command's children can be killed with it
+        "start_new_session": True,
+    }
+    if isinstance(cmd, str):
+        spawn = asyncio.ensure_future(asyncio.create_subprocess_shell(cmd, **options))
+    else:
+        spawn = asyncio.ensure_future(asyncio.create_subprocess_exec(*cmd, **options))
+        cmd = shlex.join(cmd)
+    try:
+        process = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        # a spawn cancelled midway never finishes, so let it and kill the command
+        with contextlib.suppress(OSError):
+            await _kill(await spawn)
+        raise
+    except OSError as e:
+        # a program that cannot be started fails as it would under a shell
+        return 127, b"", str(e).encode()
+
     try:
         stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
-        )
+        return process.returncode or 0, stdout, stderr
     except asyncio.TimeoutError as exc:
-        try:
-            process.kill()
-        except ProcessLookupError:
-            pass
+        await _kill(process)
         raise TimeoutError(
             f"Command '{cmd}' timed out after {timeout} seconds"
         ) from exc
+    except asyncio.CancelledError:
+        await _kill(process)
+        raise
+
+
+async def _kill(process: asyncio.subprocess.Process):
+    """Kill a command's process group and reap the command."""
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(process.pid, signal.SIGKILL)
+    await process.wait()
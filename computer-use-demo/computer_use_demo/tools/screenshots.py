@@ -0,0 +1,142 @@
+"""
+Recent screenshots, held in a bounded ring in memory and optionally kept on disk
+under a size and age retention policy.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from .image import ImageData
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RING_SIZE = 32
+DEFAULT_RETENTION_BYTES = 512 * 1024 * 1024
+DEFAULT_RETENTION_SECONDS = 24 * 60 * 60
+FILE_PATTERN = "screenshot_*.png"
+
+
+@dataclass(frozen=True, kw_only=True)
+class Capture:
+    image: ImageData
+    taken_at: float
+
+
+class ScreenshotStore:
+    """
+    The latest captures, the oldest falling out of the ring once it holds size.
+    Given a directory, each capture is also written there by a background thread,
+    which then deletes the oldest files until the directory is within max_bytes
+    and none is older than max_age seconds. The directory is listed once; after
+    that the files are tracked in memory, so keeping one costs no directory scan.
+    """
+
+    def __init__(
+        self,
+        *,
+        size: int = DEFAULT_RING_SIZE,
+        directory: str | Path | None = None,
+        max_bytes: int = DEFAULT_RETENTION_BYTES,
+        max_age: float = DEFAULT_RETENTION_SECONDS,
+    ):
+        self._ring: deque[Capture] = deque(maxlen=max(size, 1))
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._writer: ThreadPoolExecutor | None = None
+        # (modified, size, path) of the files on disk, oldest first, once listed
+        self._files: deque[tuple[float, int, Path]] | None = None
+        self._files_bytes = 0
+        self._files_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ScreenshotStore":
+        return cls(
+            size=int(os.getenv("SCREENSHOT_RING_SIZE") or DEFAULT_RING_SIZE),
+            directory=os.getenv("SCREENSHOT_DIR") or None,
+            max_bytes=int(
+                os.getenv("SCREENSHOT_RETENTION_BYTES") or DEFAULT_RETENTION_BYTES
+            ),
+            max_age=float(
+                os.getenv("SCREENSHOT_RETENTION_SECONDS") or DEFAULT_RETENTION_SECONDS
+            ),
+        )
+
+    def add(self, image: ImageData) -> Capture:
+        """Keep a capture, unless it is the same image as the latest one."""
+        if self._ring and self._ring[-1].image.digest == image.digest:
+            return self._ring[-1]
+        capture = Capture(image=image, taken_at=time.time())
+        self._ring.append(capture)
+        if self.directory is not None:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="screenshot-writer"
+                )
+            self._writer.submit(self._persist, capture)
+        return capture
+
+    def recent(self) -> list[Capture]:
+        """The captures in the ring, oldest first."""
+        return list(self._ring)
+
+    def __len__(self):
+        return len(self._ring)
+
+    def flush(self):
+        """Wait until every capture added so far is written and pruned."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    def prune(self, now: float | None = None) -> int:
+        """Delete the oldest files beyond the retention policy; return how many."""
+        now = time.time() if now is None else now
+        deleted = 0
+        with self._files_lock:
+            files = self._listed_files()
+            while files and (
+                self._files_bytes > self.max_bytes or now - files[0][0] > self.max_age
+            ):
+                _, size, path = files.popleft()
+                path.unlink(missing_ok=True)
+                self._files_bytes -= size
+                deleted += 1
+        return deleted
+
+    def _listed_files(self) -> deque[tuple[float, int, Path]]:
+        if self._files is None:
+            assert self.directory is not None
+            files = []
+            for path in self.directory.glob(FILE_PATTERN):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            self._files = deque(sorted(files))
+            self._files_bytes = sum(size for _, size, _ in files)
+        return self._files
+
+    def _persist(self, capture: Capture):
+        assert self.directory is not None
+        name = (
+            f"screenshot_{int(capture.taken_at * 1000)}_{capture.image.digest[:16]}.png"
+        )
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / name
+            with self._files_lock:
+                files = self._listed_files()
+                path.write_bytes(capture.image.data)
+                files.append((capture.taken_at, len(capture.image.data), path))
+                self._files_bytes += len(capture.image.data)
+            self.prune()
+        except OSError:
+            logger.warning("could not keep screenshot %s", name, exc_info=True)
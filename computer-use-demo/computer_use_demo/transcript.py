@@ -0,0 +1,186 @@
+"""
+Run-log transcripts that keep screenshots out of line in a content-addressed blob store.
+"""
+
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam
+
+from .tools import ImageData
+
+BLOB_DIR_NAME = "blobs"
+BLOB_SOURCE_TYPE = "blob"
+
+
+class BlobStore:
+    """
+    Stores binary payloads under their sha256 digest so identical screenshots are
+    written once, no matter how many turns, tasks or logs reference them.
+    """
+
+    def __init__(self, root: str | os.PathLike[str]):
+        self.root = Path(root)
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:]
+
+    def __contains__(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+    def put(self, data: bytes, digest: str | None = None) -> str:
+        """Store data if it is not already present and return its digest."""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return self.path_for(digest).read_bytes()
+
+
+def snapshot_content(content: Any) -> Any:
+    """
+    A copy of message content that the sampling loop's in-place edits (cache
+    breakpoints, image removal, compaction) cannot reach: the blocks and the blocks
+    inside tool results are copied, everything below them is shared.
+    """
+    if not isinstance(content, list):
+        return content
+    return [
+        {**block, "content": snapshot_content(block["content"])}
+        if isinstance(block, dict) and "content" in block
+        else dict(block)
+        if isinstance(block, dict)
+        else block
+        for block in content
+    ]
+
+
+def snapshot_messages(messages: list[BetaMessageParam]) -> list[dict[str, Any]]:
+    """snapshot_content of every message, for recording a conversation in flight."""
+    return [
+        {**message, "content": snapshot_content(message["content"])}
+        for message in messages
+    ]
+
+
+def externalize_images(value: Any, store: BlobStore) -> Any:
+    """
+    Return a copy of value in which every base64 image source is replaced by a
+    reference to its blob. The PNG payload is already deflate-compressed, so blobs are
+    stored as the decoded bytes rather than recompressed.
+    """
+    if isinstance(value, list):
+        return [externalize_images(item, store) for item in value]
+    if not isinstance(value, dict):
+        return value
+    source = value.get("source")
+    if (
+        value.get("type") == "image"
+        and isinstance(source, dict)
+        and source.get("type") == "base64"
+    ):
+        data = source["data"]
+        if isinstance(data, ImageData):
+            # shared screenshots are already hashed, so skip rehashing the payload
+            digest = store.put(data.data, data.digest)
+        else:
+            digest = store.put(base64.b64decode(data))
+        return {
+            **value,
+            "source": {
+                "type": BLOB_SOURCE_TYPE,
+                "media_type": source.get("media_type", "image/png"),
+                "digest": digest,
+            },
+        }
+    return {key: externalize_images(item, store) for key, item in value.items()}
+
+
+def rehydrate_images(value: Any, store: BlobStore) -> Any:
+    """Inverse of externalize_images: inline blob references as base64 sources."""
+    if isinstance(value, list):
+        return [rehydrate_images(item, store) for item in value]
+    if not isinstance(value, dict):
+        return value
+    source = value.get("source")
+    if (
+        value.get("type") == "image"
+        and isinstance(source, dict)
+        and source.get("type") == BLOB_SOURCE_TYPE
+    ):
+        return {
+            **value,
+            "source": {
+                "type": "base64",
+                "media_type": source["media_type"],
+                "data": base64.b64encode(store.get(source["digest"])).decode(),
+            },
+        }
+    return {key: rehydrate_images(item, store) for key, item in value.items()}
+
+
+def build_log(
+    identifier: str,
+    messages: list[BetaMessageParam],
+    timestamp: str | None = None,
+    metrics: dict[str, Any] | None = None,
+    stop_reason: str | None = None,
+) -> dict[str, Any]:
+    """
+    Build the run-log record for a task. Tool results are attributed to the
+    assistant, since they are produced on its behalf rather than typed by the user.
+    stop_reason records why a task was ended before the model finished it.
+    """
+    processed_messages = []
+    for message in messages:
+        role = message.get("role", "unknown")
+        content = message.get("content", "")
+        if role == "user" and isinstance(content, list):
+            if any(
+                isinstance(item, dict) and item.get("type") == "tool_result"
+                for item in content
+            ):
+                role = "assistant"
+        processed_messages.append({"role": role, "content": content})
+
+    log_data: dict[str, Any] = {
+        "timestamp": timestamp or datetime.now().strftime("%Y-%m-%d"),
+        "identifier": identifier,
+        "messages": processed_messages,
+    }
+    if metrics is not None:
+        log_data["metrics"] = metrics
+    if stop_reason is not None:
+        log_data["stop_reason"] = stop_reason
+    return log_data
+
+
+def dump_log(log_data: dict[str, Any], store: BlobStore) -> bytes:
+    """Serialize a run log with its images moved into the blob store."""
+    return json.dumps(
+        externalize_images(log_data, store), indent=4, ensure_ascii=False
+    ).encode("utf-8")
+
+
+def load_log(
+    path: str | os.PathLike[str], store: BlobStore | None = None
+) -> dict[str, Any]:
+    """
+    Load a run log. Image references are left in place unless a store is given, so
+    analysis tooling can read transcripts without touching the blobs.
+    """
+    log_data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if store is None:
+        return log_data
+    return rehydrate_images(log_data, store)
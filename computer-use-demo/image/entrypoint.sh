@@ -6,6 +6,11 @@ set -e
 
 python http_server.py > /tmp/server_logs.txt 2>&1 &
 
+# dataset runs live in the runner, so they outlast browser reloads; set an empty
+# RUNNER_URL to run them inside the Streamlit session instead
+python -m computer_use_demo.runner > /tmp/runner_logs.txt 2>&1 &
+export RUNNER_URL=${RUNNER_URL-http://127.0.0.1:8502}
+
 STREAMLIT_SERVER_PORT=8501 python -m streamlit run computer_use_demo/streamlit.py > /tmp/streamlit_stdout.log &
 
 echo "✨ Computer Use Demo is ready!"
@@ -0,0 +1,155 @@
+import json
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.batch import (
+    BatchTask,
+    first_turn_request,
+    load_tasks,
+    run_batch,
+    wait_for_batch,
+)
+from computer_use_demo.loop import (
+    APIProvider,
+    build_tool_collection,
+    sampling_loop,
+    tool_params,
+)
+from computer_use_demo.replay import ReplayScript, ReplayServer
+from computer_use_demo.transcript import load_log
+
+REFUSAL = [{"type": "text", "text": "I can't help with that."}]
+TOOL_CALL = [
+    {
+        "type": "tool_use",
+        "id": "toolu_1",
+        "name": "bash",
+        "input": {"command": "sudo passwd -l gildong"},
+    }
+]
+
+
+@pytest.fixture
+def replay_server(monkeypatch):
+    scripts = [
+        ReplayScript(task="Refuse me", turns=[REFUSAL]),
+        ReplayScript(task="Lock the account", turns=[TOOL_CALL]),
+    ]
+    with ReplayServer(scripts, batch_polls=2) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        yield server
+
+
+def test_run_batch_writes_first_turn_logs(replay_server, tmp_path):
+    tasks = [
+        BatchTask(identifier="t1", task="Refuse me"),
+        BatchTask(identifier="t2", task="Lock the account"),
+    ]
+    sleep = mock.Mock()
+    with mock.patch("computer_use_demo.batch.time.sleep", sleep):
+        outcome = run_batch(
+            tasks,
+            provider=APIProvider.REPLAY,
+            api_key="",
+            model="claude-3-5-sonnet-20241022",
+            log_dir=tmp_path,
+            prefix="dataset.json",
+            poll_interval=5,
+        )
+
+    assert sleep.call_count == 2
+    assert outcome.failures == {}
+    assert outcome.metrics.tasks == 2
+    logs = {path.name.split("_")[-1]: load_log(path) for path in outcome.log_paths}
+    assert logs["t2.json"]["messages"][-1] == {
+        "role": "assistant",
+        "content": TOOL_CALL,
+    }
+    assert logs["t2.json"]["messages"][0]["content"][0]["text"] == "Lock the account"
+    assert logs["t2.json"]["metrics"]["turns"] == 1
+    metrics_path = next(tmp_path.glob("dataset.json_*_metrics.json"))
+    assert json.loads(metrics_path.read_text())["tasks"] == 2
+
+
+async def test_first_turn_request_matches_sampling_loop(replay_server):
+    with mock.patch.object(
+        replay_server, "respond", wraps=replay_server.respond
+    ) as respond:
+        await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="Be brief.",
+            messages=[
+                {"role": "user", "content": [{"type": "text", "text": "Refuse me"}]}
+            ],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="",
+        )
+
+    expected = first_turn_request(
+        "Refuse me",
+        model="claude-3-5-sonnet-20241022",
+        system_prompt_suffix="Be brief.",
+    )
+    assert respond.call_args.args[0] == json.loads(json.dumps(expected))
+
+
+def test_wait_for_batch_times_out():
+    client = mock.Mock()
+    client.beta.messages.batches.retrieve.return_value.processing_status = "in_progress"
+    client.beta.messages.batches.retrieve.return_value.request_counts.model_dump.return_value = {
+        "processing": 1
+    }
+    with pytest.raises(TimeoutError):
+        wait_for_batch(client, "b", poll_interval=10, timeout=5, sleep=mock.Mock())
+
+
+def test_load_tasks_skips_malformed_items(tmp_path):
+    path = tmp_path / "tasks.json"
+    path.write_text(json.dumps([{"identifier": "a", "task": "x"}, {"task": "y"}]))
+    assert load_tasks(path) == [BatchTask(identifier="a", task="x")]
+
+
+def test_load_tasks_rejects_unknown_tools_to_reset(tmp_path):
+    path = tmp_path / "tasks.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"identifier": "a", "task": "x", "reset_tools": ["bash"]},
+                {"identifier": "b", "task": "y", "reset_tools": ["browser"]},
+            ]
+        )
+    )
+    with pytest.raises(ValueError, match="'b': \\['browser'\\]"):
+        load_tasks(path)
+
+
+@pytest.mark.parametrize("width, height", [("1024", "768"), ("1920", "1080")])
+def test_tool_params_match_the_tools(monkeypatch, width, height):
+    monkeypatch.setenv("WIDTH", width)
+    monkeypatch.setenv("HEIGHT", height)
+    assert tool_params() == build_tool_collection(bash_pool_size=0).to_params()
+
+
+def test_run_batch_rejects_unknown_tools_to_reset_before_submitting():
+    tasks = [
+        BatchTask(identifier="t1", task="x", reset_tools=["bash"]),
+        BatchTask(identifier="t2", task="y", reset_tools=["browser", "bash"]),
+        BatchTask(identifier="t3", task="z", reset_tools=True),
+    ]
+    with (
+        mock.patch("computer_use_demo.batch.make_client") as make_client,
+        pytest.raises(ValueError, match="'t2': \\['browser'\\]"),
+    ):
+        run_batch(
+            tasks,
+            provider=APIProvider.ANTHROPIC,
+            api_key="",
+            model="claude-3-5-sonnet-20241022",
+            log_dir="unused",
+            prefix="dataset.json",
+        )
+    make_client.assert_not_called()
@@ -0,0 +1,57 @@
+from unittest import mock
+
+from computer_use_demo.budget import TaskBudget
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.metrics import MetricsRollup
+from computer_use_demo.replay import ReplayScript, ReplayServer
+
+
+def test_exceeded_reports_the_first_limit_reached():
+    spent = MetricsRollup(
+        turns=3, input_tokens=100, cache_read_input_tokens=900, output_tokens=50
+    )
+    assert TaskBudget().exceeded(spent, elapsed=1e6) is None
+    assert "turn" in TaskBudget(max_turns=3).exceeded(spent, 0)  # type: ignore
+    assert TaskBudget(max_turns=4, max_input_tokens=1001).exceeded(spent, 0) is None
+    assert "input" in TaskBudget(max_input_tokens=1000).exceeded(spent, 0)  # type: ignore
+    assert "output" in TaskBudget(max_output_tokens=50).exceeded(spent, 0)  # type: ignore
+    assert "time" in TaskBudget(max_seconds=2).exceeded(spent, 2.5)  # type: ignore
+
+
+def test_from_env_leaves_unset_limits_off(monkeypatch):
+    monkeypatch.setenv("TASK_MAX_TURNS", "20")
+    monkeypatch.setenv("TASK_MAX_SECONDS", "90.5")
+    monkeypatch.setenv("TASK_MAX_INPUT_TOKENS", "0")
+    monkeypatch.delenv("TASK_MAX_OUTPUT_TOKENS", raising=False)
+    assert TaskBudget.from_env() == TaskBudget(max_turns=20, max_seconds=90.5)
+
+
+async def test_sampling_loop_stops_when_budget_is_exhausted(monkeypatch):
+    tool_turn = [
+        {
+            "type": "tool_use",
+            "id": "toolu_1",
+            "name": "bash",
+            "input": {"command": "echo scrolling"},
+        }
+    ]
+    script = ReplayScript(turns=[tool_turn] * 5)
+    stop_callback = mock.Mock()
+    with ReplayServer([script]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        messages = await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="",
+            budget=TaskBudget(max_turns=2),
+            stop_callback=stop_callback,
+        )
+
+    assert server.requests_served == 2
+    assert [message["role"] for message in messages].count("assistant") == 2
+    stop_callback.assert_called_once_with("turn budget of 2 turns exhausted")
@@ -0,0 +1,75 @@
+import io
+
+from PIL import Image
+
+from computer_use_demo.chat_history import (
+    ThumbnailCache,
+    group_turns,
+    history_page,
+    make_thumbnail,
+)
+from computer_use_demo.tools import ImageData
+
+
+def _prompt(text: str) -> dict:
+    return {"role": "user", "content": [{"type": "text", "text": text}]}
+
+
+def _reply(text: str) -> dict:
+    return {"role": "assistant", "content": [{"type": "text", "text": text}]}
+
+
+def _tool_results() -> dict:
+    return {
+        "role": "user",
+        "content": [{"type": "tool_result", "tool_use_id": "toolu_1", "content": []}],
+    }
+
+
+def _png(width: int, height: int, color: str = "red") -> ImageData:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, format="PNG")
+    return ImageData(output.getvalue())
+
+
+def test_tool_results_belong_to_the_turn_they_answer():
+    messages = [_prompt("go"), _reply("a"), _tool_results(), _reply("b")]
+    assert group_turns(messages) == [
+        [messages[0]],
+        [messages[1], messages[2]],
+        [messages[3]],
+    ]
+    assert group_turns([_tool_results()]) == [[_tool_results()]]
+
+
+def test_history_pages_count_back_from_the_newest_turn():
+    messages = [_prompt(str(index)) for index in range(5)]
+
+    newest = history_page(messages, turns_per_page=2)
+    assert [turn[0] for turn in newest.turns] == messages[3:]
+    assert (newest.first, newest.total, newest.page, newest.pages) == (3, 5, 0, 3)
+
+    oldest = history_page(messages, turns_per_page=2, page=7)
+    assert oldest.page == 2
+    assert [turn[0] for turn in oldest.turns] == messages[:1]
+
+    empty = history_page([], turns_per_page=2)
+    assert (empty.turns, empty.pages) == ([], 1)
+
+
+def test_thumbnails_are_scaled_memoized_and_evicted():
+    assert Image.open(io.BytesIO(make_thumbnail(_png(1024, 768), 256))).size == (
+        256,
+        192,
+    )
+
+    cache = ThumbnailCache(width=64, max_entries=2)
+    red, green, blue = (_png(128, 128, color) for color in ("red", "green", "blue"))
+    thumbnails = {image.digest: cache.get(image) for image in (red, green)}
+    assert cache.get(red) is thumbnails[red.digest]
+    cache.get(blue)
+
+    # green was the least recently used
+    assert len(cache) == 2
+    assert cache.get(red) is thumbnails[red.digest]
+    assert cache.get(green) is not thumbnails[green.digest]
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo.events import (
+    ApiResponseEvent,
+    DropPolicy,
+    EventBus,
+    MetricsEvent,
+    OutputEvent,
+    StopEvent,
+    ToolOutputEvent,
+    TurnEvent,
+    consume,
+)
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import ReplayScript, ReplayServer
+
+
+def _text(text: str) -> OutputEvent:
+    return OutputEvent(block={"type": "text", "text": text})
+
+
+async def _drain(subscription) -> list:
+    return [event async for event in subscription]
+
+
+async def test_subscriptions_get_the_types_they_asked_for_until_closed():
+    bus = EventBus()
+    everything = bus.subscribe()
+    stops = bus.subscribe(StopEvent)
+
+    await bus.publish(_text("hello"))
+    await bus.publish(StopEvent(reason="budget"))
+    await bus.close()
+
+    assert await _drain(everything) == [_text("hello"), StopEvent(reason="budget")]
+    assert await _drain(stops) == [StopEvent(reason="budget")]
+    with pytest.raises(RuntimeError):
+        await bus.publish(_text("late"))
+
+
+@pytest.mark.parametrize(
+    ("policy", "kept"),
+    [(DropPolicy.DROP_OLDEST, ["2", "3"]), (DropPolicy.DROP_NEWEST, ["0", "1"])],
+)
+async def test_full_dropping_subscription_never_blocks_the_publisher(policy, kept):
+    bus = EventBus()
+    subscription = bus.subscribe(max_size=2, policy=policy)
+    for index in range(4):
+        await asyncio.wait_for(bus.publish(_text(str(index))), timeout=1)
+
+    await bus.close()
+    assert subscription.dropped == 2
+    assert [event.block["text"] for event in await _drain(subscription)] == kept
+
+
+async def test_blocking_subscription_holds_the_publisher_until_consumed():
+    bus = EventBus()
+    subscription = bus.subscribe(max_size=1)
+    await bus.publish(_text("first"))
+    publish = asyncio.create_task(bus.publish(_text("second")))
+    await asyncio.sleep(0.05)
+    assert not publish.done()
+
+    assert await subscription.__anext__() == _text("first")
+    await asyncio.wait_for(publish, timeout=1)
+    assert subscription.dropped == 0
+
+
+async def test_failed_consumer_stops_holding_up_the_publisher():
+    bus = EventBus()
+    subscription = bus.subscribe(max_size=1)
+
+    def fail(event):
+        raise ValueError("cannot render")
+
+    consumer = asyncio.create_task(consume(subscription, fail))
+    await bus.publish(_text("first"))
+    with pytest.raises(ValueError):
+        await consumer
+
+    for index in range(3):
+        await asyncio.wait_for(bus.publish(_text(str(index))), timeout=1)
+    await bus.close()
+
+
+async def test_sampling_loop_publishes_what_it_would_call_back_with(monkeypatch):
+    tool_turn = [
+        {"type": "text", "text": "Checking"},
+        {
+            "type": "tool_use",
+            "id": "toolu_1",
+            "name": "bash",
+            "input": {"command": "echo hi"},
+        },
+    ]
+    script = ReplayScript(turns=[tool_turn, [{"type": "text", "text": "Done"}]])
+    bus = EventBus()
+    events = asyncio.create_task(_drain(bus.subscribe()))
+    with ReplayServer([script]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            api_key="",
+            event_bus=bus,
+        )
+    await bus.close()
+
+    kinds = [type(event) for event in await events]
+    assert kinds == [
+        ApiResponseEvent,
+        OutputEvent,
+        OutputEvent,
+        ToolOutputEvent,
+        MetricsEvent,
+        TurnEvent,
+        ApiResponseEvent,
+        OutputEvent,
+        MetricsEvent,
+        TurnEvent,
+    ]
+    tool_output = next(e for e in await events if isinstance(e, ToolOutputEvent))
+    assert tool_output.tool_use_id == "toolu_1"
+    assert tool_output.result.output == "hi"
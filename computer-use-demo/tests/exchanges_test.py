@@ -0,0 +1,74 @@
+import json
+
+import httpx
+
+from computer_use_demo.exchanges import ExchangeRecorder
+
+
+def _exchange(body: dict):
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages", json=body)
+    response = httpx.Response(
+        200,
+        json={"id": "msg", "usage": {"input_tokens": 3, "output_tokens": 1}},
+        request=request,
+    )
+    return request, response
+
+
+def test_recorder_keeps_summaries_and_spills_bodies(tmp_path):
+    recorder = ExchangeRecorder(spill_dir=tmp_path)
+    request, response = _exchange({"messages": ["a"]})
+    exchange = recorder.record(request, response)
+
+    assert exchange.status_code == 200
+    assert exchange.usage == {"input_tokens": 3, "output_tokens": 1}
+    assert exchange.request_size == len(request.content)
+    assert json.loads(recorder.request_body(exchange)) == {"messages": ["a"]}
+    assert json.loads(recorder.response_body(exchange))["id"] == "msg"
+
+
+def test_recorder_evicts_oldest_exchange_and_its_bodies(tmp_path):
+    recorder = ExchangeRecorder(max_entries=2, spill_dir=tmp_path)
+    first = recorder.record(*_exchange({"turn": 1}))
+    recorder.record(*_exchange({"turn": 2}))
+    recorder.record(*_exchange({"turn": 3}))
+
+    assert len(recorder) == 2
+    assert first not in list(recorder)
+    assert recorder.request_body(first) == ""
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_recorder_summarizes_non_http_responses(tmp_path):
+    recorder = ExchangeRecorder(spill_dir=tmp_path)
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    exchange = recorder.record(request, {"error": "boom"}, ValueError("boom"))
+    assert exchange.status_code is None
+    assert exchange.response_summary == "{'error': 'boom'}"
+    assert exchange.error == "ValueError: boom"
+
+
+def test_recorder_keeps_bodies_within_a_byte_budget(tmp_path):
+    request, response = _exchange({"turn": 1})
+    size = len(request.content) + len(response.content)
+    recorder = ExchangeRecorder(spill_dir=tmp_path, max_bytes=2 * size)
+    first = recorder.record(*_exchange({"turn": 1}))
+    second = recorder.record(*_exchange({"turn": 2}))
+
+    # reading a body marks the exchange as recently used
+    recorder.request_body(first)
+    recorder.record(*_exchange({"turn": 3}))
+
+    assert [exchange.id for exchange in recorder] == [first.id, "3"]
+    assert second.id not in {exchange.id for exchange in recorder}
+    assert recorder.total_bytes == 2 * size
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_recorder_removes_the_spill_dir_it_made():
+    recorder = ExchangeRecorder()
+    recorder.record(*_exchange({"turn": 1}))
+    spill_dir = recorder.spill_dir
+    assert spill_dir.exists()
+    recorder.close()
+    assert not spill_dir.exists()
@@ -0,0 +1,75 @@
+import base64
+import threading
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.log_sink import TurnLogSink, read_records
+from computer_use_demo.transcript import BlobStore, snapshot_content
+
+
+def _image_block(data: bytes):
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": "image/png",
+            "data": base64.b64encode(data).decode(),
+        },
+    }
+
+
+def test_sink_appends_records_and_externalizes_images(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    tool_results = [{"type": "tool_result", "content": [_image_block(b"png")]}]
+    with TurnLogSink(tmp_path / "run.jsonl", store=store) as sink:
+        sink.write({"turn": 1, "tool_results": snapshot_content(tool_results)})
+        # the loop's later in-place edits must not leak into the queued record
+        tool_results[0]["cache_control"] = {"type": "ephemeral"}
+        tool_results[0]["content"][0]["cache_control"] = {"type": "ephemeral"}
+        sink.write({"turn": 2, "tool_results": []})
+
+    records = read_records(tmp_path / "run.jsonl")
+    assert [record["turn"] for record in records] == [1, 2]
+    assert "cache_control" not in records[0]["tool_results"][0]
+    image = records[0]["tool_results"][0]["content"][0]
+    assert "cache_control" not in image
+    assert store.get(image["source"]["digest"]) == b"png"
+
+
+def test_write_never_waits_for_a_writer_that_falls_behind(tmp_path):
+    disk = threading.Event()
+    sink = TurnLogSink(tmp_path / "run.jsonl")
+    append = sink._append
+    with mock.patch.object(
+        sink, "_append", side_effect=lambda line: disk.wait() and append(line)
+    ):
+        for turn in range(1000):
+            sink.write({"turn": turn})
+        disk.set()
+        sink.close()
+    assert len(read_records(tmp_path / "run.jsonl")) == 1000
+
+
+def test_sink_rotates_segments_by_size(tmp_path):
+    sink = TurnLogSink(tmp_path / "run.jsonl", rotate_bytes=40)
+    for turn in range(4):
+        sink.write({"turn": turn, "padding": "x" * 10})
+    sink.close()
+
+    paths = sink.segment_paths
+    assert [path.name for path in paths] == [
+        "run.jsonl",
+        "run.1.jsonl",
+        "run.2.jsonl",
+        "run.3.jsonl",
+    ]
+    assert [read_records(path)[0]["turn"] for path in paths] == [0, 1, 2, 3]
+
+
+def test_sink_zstd_compression(tmp_path):
+    pytest.importorskip("zstandard")
+    with TurnLogSink(tmp_path / "run.jsonl", compression="zstd") as sink:
+        sink.write({"turn": 1})
+        sink.write({"turn": 2})
+    assert read_records(tmp_path / "run.jsonl.zst") == [{"turn": 1}, {"turn": 2}]
@@ -1,35 +1,61 @@
+import asyncio
+import threading
 from unittest import mock
 
 from anthropic.types import TextBlock, ToolUseBlock
-from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaTextBlockParam
+from anthropic.types.beta import (
+    BetaMessage,
+    BetaMessageParam,
+    BetaTextBlockParam,
+    BetaUsage,
+)
 
-from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.loop import (
+    COMPACT_MIN_CHARS,
+    APIProvider,
+    _compact_stale_tool_results,
+    sampling_loop,
+)
+from computer_use_demo.replay import ReplayScript, ReplayServer
+from computer_use_demo.tools import CancelToken, ToolCollection
+
+
+def _mock_message(content):
+    return mock.Mock(
+        spec=BetaMessage,
+        id="msg_test",
+        model="test-model",
+        stop_reason="end_turn",
+        usage=BetaUsage(input_tokens=10, output_tokens=5),
+        content=content,
+    )
 
 
 async def test_loop():
     client = mock.Mock()
     client.beta.messages.with_raw_response.create.return_value = mock.Mock()
     client.beta.messages.with_raw_response.create.return_value.parse.side_effect = [
-        mock.Mock(
-            spec=BetaMessage,
-            content=[
+        _mock_message(
+            [
                 TextBlock(type="text", text="Hello"),
                 ToolUseBlock(
                     type="tool_use", id="1", name="computer", input={"action": "test"}
                 ),
             ],
         ),
-        mock.Mock(spec=BetaMessage, content=[TextBlock(type="text", text="Done!")]),
+        _mock_message([TextBlock(type="text", text="Done!")]),
     ]
 
     tool_collection = mock.AsyncMock()
     tool_collection.run.return_value = mock.Mock(
-        output="Tool output", error=None, base64_image=None
+        output="Tool output", error=None, base64_image=None, image=None
     )
 
     output_callback = mock.Mock()
     tool_output_callback = mock.Mock()
     api_response_callback = mock.Mock()
+    turn_callback = mock.Mock()
+    metrics_callback = mock.Mock()
 
     with mock.patch(
         "computer_use_demo.loop.Anthropic", return_value=client
@@ -46,6 +72,8 @@ async def test_loop():
             tool_output_callback=tool_output_callback,
             api_response_callback=api_response_callback,
             api_key="test-key",
+            turn_callback=turn_callback,
+            metrics_callback=metrics_callback,
         )
 
         assert len(result) == 4
@@ -56,7 +84,7 @@ async def test_loop():
 
         assert client.beta.messages.with_raw_response.create.call_count == 2
         tool_collection.run.assert_called_once_with(
-            name="computer", tool_input={"action": "test"}
+            name="computer", tool_input={"action": "test"}, cancel_token=None
         )
         output_callback.assert_called_with(
             BetaTextBlockParam(text="Done!", type="text")
@@ -64,3 +92,137 @@ async def test_loop():
         assert output_callback.call_count == 3
         assert tool_output_callback.call_count == 1
         assert api_response_callback.call_count == 2
+        assert [call.args[0]["turn"] for call in turn_callback.call_args_list] == [
+            1,
+            2,
+        ]
+        # the record keeps the turn as emitted, without the later cache breakpoint
+        tool_result = dict(result[2]["content"][0])
+        assert tool_result.pop("cache_control") == {"type": "ephemeral"}
+        assert turn_callback.call_args_list[0].args[0]["tool_results"] == [tool_result]
+        first_turn_metrics = metrics_callback.call_args_list[0].args[0]
+        assert metrics_callback.call_count == 2
+        assert first_turn_metrics.input_tokens == 10
+        assert first_turn_metrics.output_tokens == 5
+        assert set(first_turn_metrics.tool_latency) == {"computer"}
+
+
+def _tool_turn(index: int, text: str) -> list[BetaMessageParam]:
+    return [
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "tool_use", "id": f"t{index}", "name": "bash", "input": {}}
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"t{index}",
+                    "content": [{"type": "text", "text": text}],
+                }
+            ],
+        },
+    ]
+
+
+def test_stale_tool_results_are_compacted_in_chunks():
+    big = "head" + "x" * 10_000 + "tail"
+    messages: list[BetaMessageParam] = [{"role": "user", "content": "Task"}]
+    for index in range(3):
+        messages.extend(_tool_turn(index, big))
+    messages.extend(_tool_turn(3, "small"))
+
+    # results 0 and 1 are at least two turns old, result 2 is one turn old
+    saved = _compact_stale_tool_results(messages, 2, min_compaction_chunk=2)
+
+    texts = [
+        message["content"][0]["content"][0]["text"]  # type: ignore
+        for message in messages[2::2]
+    ]
+    assert texts[0] == texts[1]
+    assert texts[0].startswith("head") and texts[0].endswith("tail")
+    assert "elided" in texts[0] and len(texts[0]) < COMPACT_MIN_CHARS
+    assert texts[2] == big
+    assert texts[3] == "small"
+    assert saved == 2 * (len(big) - len(texts[0])) // 4
+
+    # a lone newly stale result waits for a full chunk
+    messages.extend(_tool_turn(4, "small"))
+    assert _compact_stale_tool_results(messages, 2, min_compaction_chunk=2) == 0
+    assert messages[6]["content"][0]["content"][0]["text"] == big  # type: ignore
+
+
+def test_results_kept_for_many_turns_are_still_compacted_in_small_chunks():
+    big = "x" * 10_000
+    messages: list[BetaMessageParam] = [{"role": "user", "content": "Task"}]
+    for index in range(22):
+        messages.extend(_tool_turn(index, big))
+
+    # only results 0 and 1 are 20 turns old, which is already a whole chunk
+    assert _compact_stale_tool_results(messages, 20) > 0
+    texts = [
+        message["content"][0]["content"][0]["text"]  # type: ignore
+        for message in messages[2::2]
+    ]
+    assert [text == big for text in texts] == [False, False] + [True] * 20
+
+
+async def test_cancelled_loop_returns_a_history_it_can_continue_from(monkeypatch):
+    tool_turn = [
+        {
+            "type": "tool_use",
+            "id": f"toolu_{index}",
+            "name": "bash",
+            "input": {"command": "sleep 30"},
+        }
+        for index in range(2)
+    ]
+    token = CancelToken()
+    stop_callback = mock.Mock()
+    with ReplayServer([ReplayScript(turns=[tool_turn])]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        asyncio.get_running_loop().call_later(1, token.cancel, "stopped_by_user")
+        messages = await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            api_key="",
+            stop_callback=stop_callback,
+            cancel_token=token,
+        )
+
+    stop_callback.assert_called_once_with("stopped_by_user")
+    assert [message["role"] for message in messages] == ["user", "assistant", "user"]
+    results = messages[-1]["content"]
+    assert [result["tool_use_id"] for result in results] == ["toolu_0", "toolu_1"]  # type: ignore
+    assert all(result["is_error"] for result in results)  # type: ignore
+
+
+async def test_cancelling_aborts_the_api_call_in_flight():
+    client = mock.Mock()
+    released = threading.Event()
+    client.beta.messages.with_raw_response.create.side_effect = (
+        lambda **kwargs: released.wait(30)
+    )
+    client.close.side_effect = released.set
+    token = CancelToken()
+    with mock.patch("computer_use_demo.loop.Anthropic", return_value=client):
+        asyncio.get_running_loop().call_later(0.2, token.cancel)
+        messages = await asyncio.wait_for(
+            sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[{"role": "user", "content": "Test message"}],
+                api_key="test-key",
+                tool_collection=ToolCollection(),
+                cancel_token=token,
+            ),
+            timeout=5,
+        )
+    assert messages == [{"role": "user", "content": "Test message"}]
+    client.close.assert_called_once()
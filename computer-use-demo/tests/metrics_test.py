@@ -0,0 +1,56 @@
+from anthropic.types.beta import BetaUsage
+
+from computer_use_demo.metrics import MetricsRollup, TurnMetrics
+
+
+def _turn(turn: int, cache_read: int, tool_latency: float):
+    metrics = TurnMetrics(turn=turn, api_latency=1.5, screenshot_bytes=100)
+    metrics.record_usage(
+        BetaUsage(
+            input_tokens=10,
+            output_tokens=5,
+            cache_creation_input_tokens=None,
+            cache_read_input_tokens=cache_read,
+        )
+    )
+    metrics.record_tool("computer", tool_latency)
+    metrics.record_tool("computer", tool_latency)
+    return metrics
+
+
+def test_turn_metrics_records_usage_and_tool_latency():
+    metrics = _turn(1, cache_read=30, tool_latency=0.25)
+    assert metrics.cache_creation_input_tokens == 0
+    assert metrics.cache_read_input_tokens == 30
+    assert metrics.tool_latency == {"computer": 0.5}
+    assert metrics.to_dict()["turn"] == 1
+
+
+def test_rollups_aggregate_turns_and_tasks():
+    task = MetricsRollup()
+    task.add_turn(_turn(1, cache_read=0, tool_latency=1.0))
+    task.add_turn(_turn(2, cache_read=20, tool_latency=1.0))
+    assert task.turns == 2
+    assert task.cache_hit_rate == 20 / 40
+    assert task.tool_latency == {"computer": 4.0}
+
+    dataset = MetricsRollup()
+    dataset.add_task(task)
+    dataset.add_task(task)
+    summary = dataset.to_dict()
+    assert summary["tasks"] == 2
+    assert summary["turns"] == 4
+    assert summary["screenshot_bytes"] == 400
+    assert summary["cache_hit_rate"] == task.cache_hit_rate
+
+
+def test_prefix_cache_hit_rate_counts_first_turns():
+    dataset = MetricsRollup()
+    for first_turn_cache_read in (0, 50, 50, 50):
+        task = MetricsRollup()
+        task.add_turn(_turn(1, cache_read=first_turn_cache_read, tool_latency=0.0))
+        task.add_turn(_turn(2, cache_read=80, tool_latency=0.0))
+        dataset.add_task(task)
+
+    assert dataset.first_turns == 4
+    assert dataset.to_dict()["prefix_cache_hit_rate"] == 0.75
@@ -0,0 +1,105 @@
+from datetime import date
+from unittest import mock
+
+from anthropic.types.beta import BetaUsage
+
+from computer_use_demo.loop import (
+    APIProvider,
+    build_tool_collection,
+    make_client,
+    sampling_loop,
+)
+from computer_use_demo.metrics import MetricsRollup
+from computer_use_demo.prompt import build_prefix, system_prompt, warm_prompt_cache
+from computer_use_demo.replay import ReplayScript, ReplayServer
+
+TODAY = date(2024, 10, 22)
+
+
+def test_system_prompt_moves_on_to_the_next_day():
+    with mock.patch("computer_use_demo.prompt.date") as fake_date:
+        fake_date.today.return_value = TODAY
+        before = system_prompt()
+        fake_date.today.return_value = date(2024, 10, 23)
+        after = system_prompt()
+    assert "Tuesday, October 22, 2024" in before
+    assert "Wednesday, October 23, 2024" in after
+
+
+def test_fingerprint_is_stable_and_ignores_suffix():
+    first = build_prefix(build_tool_collection(), "", today=TODAY)
+    second = build_prefix(build_tool_collection(), "Be brief.", today=TODAY)
+    assert first.fingerprint == second.fingerprint
+    assert "Tuesday, October 22, 2024" in first.text
+    assert first.fingerprint != (
+        build_prefix(build_tool_collection(), today=date(2024, 10, 23)).fingerprint
+    )
+
+
+def test_cache_breakpoint_is_on_the_base_prompt_only():
+    prefix = build_prefix(build_tool_collection(), "Be brief.", today=TODAY)
+    base, suffix = prefix.system(cache=True)
+    assert base["cache_control"] == {"type": "ephemeral"}
+    assert suffix == {"type": "text", "text": "Be brief."}
+    assert all("cache_control" not in block for block in prefix.system(cache=False))
+
+
+def test_warmup_is_skipped_while_cache_is_live():
+    prefix = build_prefix(build_tool_collection(), today=TODAY)
+    client = mock.Mock()
+    client.beta.messages.create.return_value.usage = BetaUsage(
+        input_tokens=1, output_tokens=1, cache_creation_input_tokens=2000
+    )
+
+    usage = warm_prompt_cache(client, model="m", prefix=prefix, scope="test-skip")
+    assert usage is not None and usage.cache_creation_input_tokens == 2000
+    assert (
+        warm_prompt_cache(client, model="m", prefix=prefix, scope="test-skip") is None
+    )
+    assert client.beta.messages.create.call_count == 1
+    assert client.beta.messages.create.call_args.kwargs["max_tokens"] == 1
+
+    warm_prompt_cache(client, model="other", prefix=prefix, scope="test-skip")
+    assert client.beta.messages.create.call_count == 2
+
+
+def test_warmup_is_retried_after_a_failure():
+    prefix = build_prefix(build_tool_collection(), today=TODAY)
+    client = mock.Mock()
+    client.beta.messages.create.side_effect = [RuntimeError("down"), mock.Mock()]
+
+    try:
+        warm_prompt_cache(client, model="m", prefix=prefix, scope="test-retry")
+    except RuntimeError:
+        pass
+    assert warm_prompt_cache(client, model="m", prefix=prefix, scope="test-retry")
+    assert client.beta.messages.create.call_count == 2
+
+
+async def test_first_turn_reads_warmed_prefix(monkeypatch):
+    script = ReplayScript(turns=[[{"type": "text", "text": "Done!"}]])
+    with ReplayServer([script]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        usage = warm_prompt_cache(
+            make_client(APIProvider.REPLAY, ""),
+            model="claude-3-5-sonnet-20241022",
+            prefix=build_prefix(build_tool_collection(), "Be brief."),
+            scope="test-replay",
+        )
+        assert usage is not None and usage.cache_creation_input_tokens
+
+        rollup = MetricsRollup()
+        await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="Be brief.",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="",
+            metrics_callback=rollup.add_turn,
+        )
+
+    assert rollup.cache_read_input_tokens == usage.cache_creation_input_tokens
+    assert rollup.prefix_cache_hit_rate == 1.0
@@ -0,0 +1,152 @@
+import json
+import socket
+from unittest import mock
+
+import pytest
+from anthropic import APIConnectionError
+
+from computer_use_demo.loop import APIProvider, _prepare_request, sampling_loop
+from computer_use_demo.provider_pool import Backend, ProviderPool
+from computer_use_demo.replay import ReplayScript, ReplayServer
+
+
+def _unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_from_file_reads_keys_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("KEY_A", "sk-a")
+    path = tmp_path / "pool.json"
+    path.write_text(
+        json.dumps(
+            {
+                "cooldown": 5,
+                "backends": [
+                    {"name": "a", "provider": "anthropic", "api_key_env": "KEY_A"},
+                    {
+                        "name": "b",
+                        "provider": "bedrock",
+                        "weight": 2,
+                        "client_options": {"aws_region": "us-west-2"},
+                    },
+                ],
+            }
+        )
+    )
+    pool = ProviderPool.from_file(path)
+
+    a, b = pool.backends
+    assert a.api_key == "sk-a"
+    assert b.provider == APIProvider.BEDROCK
+    assert b.client_options == {"aws_region": "us-west-2"}
+    assert pool.cooldown == 5
+    assert pool.model_for(b, "claude-3-5-sonnet-20241022") == (
+        "anthropic.claude-3-5-sonnet-20241022-v2:0"
+    )
+    assert pool.model_for(b, "custom-model") == "custom-model"
+
+
+@pytest.mark.parametrize("weight", [0, -1, "nan"])
+def test_from_file_rejects_weights_that_are_not_positive(tmp_path, weight):
+    path = tmp_path / "pool.json"
+    path.write_text(
+        json.dumps(
+            {
+                "backends": [
+                    {"name": "a", "provider": "anthropic"},
+                    {"name": "b", "provider": "anthropic", "weight": weight},
+                ]
+            }
+        )
+    )
+    with pytest.raises(ValueError, match="Backend b needs a positive weight"):
+        ProviderPool.from_file(path)
+
+
+def test_acquire_balances_by_weight_and_soft_limit():
+    pool = ProviderPool(
+        [
+            Backend(name="a", provider=APIProvider.ANTHROPIC, weight=2),
+            Backend(name="b", provider=APIProvider.ANTHROPIC, max_in_flight=1),
+        ]
+    )
+    chosen = [pool.acquire().name for _ in range(4)]
+    assert chosen == ["a", "a", "b", "a"]
+    assert pool.stats()["a"]["in_flight"] == 3
+
+
+def test_failed_backend_cools_down_until_it_succeeds():
+    pool = ProviderPool(
+        [
+            Backend(name="a", provider=APIProvider.ANTHROPIC),
+            Backend(name="b", provider=APIProvider.ANTHROPIC),
+        ]
+    )
+    a = pool.acquire()
+    pool.release(a, failed=True)
+    assert not pool.stats()["a"]["healthy"]
+    assert [pool.acquire().name for _ in range(3)] == ["b", "b", "b"]
+    assert pool.acquire(exclude={"b"}).name == "a"
+
+    pool.release(a)
+    assert pool.stats()["a"]["healthy"]
+    with pytest.raises(ValueError):
+        pool.acquire(exclude={"a", "b"})
+
+
+def test_prompt_caching_is_stripped_for_providers_without_it():
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Task", "cache_control": {"type": "ephemeral"}}
+            ],
+        }
+    ]
+    betas = _prepare_request(APIProvider.BEDROCK, messages, None)
+    assert "cache_control" not in messages[0]["content"][0]
+    assert len(betas) == 1
+
+
+async def test_sampling_loop_fails_over_to_healthy_backend():
+    script = ReplayScript(turns=[[{"type": "text", "text": "Done!"}]])
+    with ReplayServer([script]) as server:
+        pool = ProviderPool(
+            [
+                Backend(
+                    name="down",
+                    provider=APIProvider.REPLAY,
+                    weight=10,
+                    client_options={"base_url": f"http://127.0.0.1:{_unused_port()}"},
+                ),
+                Backend(
+                    name="up",
+                    provider=APIProvider.REPLAY,
+                    client_options={"base_url": server.base_url},
+                ),
+            ]
+        )
+        api_response_callback = mock.Mock()
+        messages = await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=api_response_callback,
+            api_key="",
+            provider_pool=pool,
+        )
+
+    assert messages[-1]["content"] == [{"type": "text", "text": "Done!"}]
+    stats = pool.stats()
+    assert stats["down"]["failures"] == 1
+    assert not stats["down"]["healthy"]
+    assert stats["up"]["requests"] == 1
+    assert stats["up"]["in_flight"] == stats["down"]["in_flight"] == 0
+    errors = [call.args[2] for call in api_response_callback.call_args_list]
+    assert isinstance(errors[0], APIConnectionError)
+    assert errors[1] is None
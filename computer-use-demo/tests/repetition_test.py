@@ -0,0 +1,75 @@
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.metrics import MetricsRollup
+from computer_use_demo.repetition import LOOP_DETECTED, ActionLoopDetector
+from computer_use_demo.replay import ReplayScript, ReplayServer
+from computer_use_demo.tools import ImageData, ToolResult
+
+SCREEN = ToolResult(image=ImageData.from_bytes(b"same screen"))
+
+
+def test_single_action_repeated_is_a_cycle_of_one():
+    detector = ActionLoopDetector()
+    for _ in range(2):
+        detector.record("computer", {"action": "screenshot"}, SCREEN)
+        assert detector.cycle_length() is None
+    detector.record("computer", {"action": "screenshot"}, SCREEN)
+    assert detector.cycle_length() == 1
+
+
+def test_alternating_actions_are_a_cycle_of_two():
+    detector = ActionLoopDetector()
+    for _ in range(3):
+        detector.record("computer", {"action": "key", "text": "Page_Down"}, SCREEN)
+        detector.record("computer", {"action": "screenshot"}, SCREEN)
+    assert detector.cycle_length() == 2
+    assert detector.reason(2).startswith(LOOP_DETECTED)
+
+
+def test_changing_screen_is_not_a_loop():
+    detector = ActionLoopDetector()
+    for index in range(6):
+        screen = ToolResult(image=ImageData.from_bytes(f"page {index}".encode()))
+        detector.record("computer", {"action": "scroll"}, screen)
+    assert detector.cycle_length() is None
+
+
+def test_window_must_fit_the_longest_cycle():
+    with pytest.raises(ValueError):
+        ActionLoopDetector(window=6, max_cycle_length=4, min_repeats=2)
+
+
+async def test_sampling_loop_stops_a_repeating_task(monkeypatch):
+    tool_turn = [
+        {
+            "type": "tool_use",
+            "id": "toolu_1",
+            "name": "bash",
+            "input": {"command": "echo same"},
+        }
+    ]
+    script = ReplayScript(turns=[tool_turn] * 10)
+    stop_callback = mock.Mock()
+    rollup = MetricsRollup()
+    with ReplayServer([script]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        await sampling_loop(
+            model="claude-3-5-sonnet-20241022",
+            provider=APIProvider.REPLAY,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="",
+            metrics_callback=rollup.add_turn,
+            stop_callback=stop_callback,
+            loop_detector=ActionLoopDetector(),
+        )
+
+    assert server.requests_served == 3
+    assert rollup.action_loop_turns == 1
+    assert stop_callback.call_args.args[0].startswith(LOOP_DETECTED)
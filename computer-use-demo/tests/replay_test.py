@@ -0,0 +1,100 @@
+import json
+import random
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import (
+    EXHAUSTED_TEXT,
+    LatencyModel,
+    ReplayServer,
+    load_scripts,
+)
+
+SCRIPTED_TURNS = [
+    [
+        {"type": "text", "text": "Running a command"},
+        {
+            "type": "tool_use",
+            "id": "toolu_1",
+            "name": "bash",
+            "input": {"command": "echo replayed"},
+        },
+    ],
+    [{"type": "text", "text": "Done!"}],
+]
+
+
+@pytest.fixture
+def replay_server(monkeypatch, tmp_path):
+    script_path = tmp_path / "script.json"
+    script_path.write_text(json.dumps(SCRIPTED_TURNS))
+    with ReplayServer(load_scripts(script_path)) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        yield server
+
+
+async def test_sampling_loop_runs_against_replay_provider(replay_server):
+    tool_output_callback = mock.Mock()
+    messages = await sampling_loop(
+        model="claude-3-5-sonnet-20241022",
+        provider=APIProvider.REPLAY,
+        system_prompt_suffix="",
+        messages=[{"role": "user", "content": [{"type": "text", "text": "Go"}]}],
+        output_callback=mock.Mock(),
+        tool_output_callback=tool_output_callback,
+        api_response_callback=mock.Mock(),
+        api_key="",
+    )
+
+    assert [message["role"] for message in messages] == [
+        "user",
+        "assistant",
+        "user",
+        "assistant",
+    ]
+    assert tool_output_callback.call_args.args[0].output == "replayed"
+    assert messages[-1]["content"][0]["text"] == "Done!"
+    assert replay_server.requests_served == 2
+
+
+def test_replay_scripts_from_run_log_are_matched_by_task(tmp_path):
+    log_path = tmp_path / "run.json"
+    log_path.write_text(
+        json.dumps(
+            {
+                "identifier": "t1",
+                "messages": [
+                    {"role": "user", "content": [{"type": "text", "text": "Task A"}]},
+                    {"role": "assistant", "content": SCRIPTED_TURNS[0]},
+                    {
+                        "role": "assistant",
+                        "content": [{"type": "tool_result", "tool_use_id": "toolu_1"}],
+                    },
+                    {"role": "assistant", "content": SCRIPTED_TURNS[1]},
+                ],
+            }
+        )
+    )
+    server = ReplayServer(load_scripts(log_path))
+    try:
+        task_a = [{"role": "user", "content": [{"type": "text", "text": "Task A"}]}]
+        assert server.respond({"messages": task_a})["stop_reason"] == "tool_use"
+        history = [*task_a, {"role": "assistant", "content": SCRIPTED_TURNS[0]}]
+        assert server.respond({"messages": history})["content"] == SCRIPTED_TURNS[1]
+        history.append({"role": "assistant", "content": SCRIPTED_TURNS[1]})
+        exhausted = server.respond({"messages": history})
+        assert exhausted["content"][0]["text"] == EXHAUSTED_TEXT
+    finally:
+        server.stop()
+
+
+def test_latency_model_parsing_and_sampling():
+    rng = random.Random(0)
+    assert LatencyModel.parse("fixed:0.5").sample(rng) == 0.5
+    uniform = LatencyModel.parse("uniform:1.0:0.25")
+    assert all(0.75 <= uniform.sample(rng) <= 1.25 for _ in range(20))
+    assert LatencyModel.parse("lognormal:1.0:0.4").sample(rng) > 0
+    with pytest.raises(ValueError):
+        LatencyModel.parse("gamma:1")
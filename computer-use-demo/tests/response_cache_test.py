@@ -0,0 +1,94 @@
+import base64
+from unittest import mock
+
+from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaUsage
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import ReplayScript, ReplayServer
+from computer_use_demo.response_cache import ResponseCache
+from computer_use_demo.tools import ImageData
+
+
+def _message(text: str) -> BetaMessage:
+    return BetaMessage(
+        id="msg",
+        type="message",
+        role="assistant",
+        model="test-model",
+        content=[BetaTextBlock(type="text", text=text)],
+        stop_reason="end_turn",
+        stop_sequence=None,
+        usage=BetaUsage(input_tokens=1, output_tokens=1),
+    )
+
+
+def _key(cache: ResponseCache, messages, provider="anthropic", model="m"):
+    return cache.key(
+        provider=provider,
+        model=model,
+        max_tokens=10,
+        system=[{"type": "text"}],
+        tools=[],
+        messages=messages,
+    )
+
+
+def test_key_ignores_cache_control_and_hashes_images(tmp_path):
+    cache = ResponseCache(tmp_path)
+    image = ImageData.from_bytes(b"pixels")
+    inline = base64.b64encode(b"pixels").decode()
+
+    def messages(data, **extra):
+        block = {"type": "image", "source": {"type": "base64", "data": data}, **extra}
+        return [{"role": "user", "content": [block]}]
+
+    key = _key(cache, messages(image))
+    assert key == _key(cache, messages(inline))
+    assert key == _key(cache, messages(image, cache_control={"type": "ephemeral"}))
+    assert key != _key(cache, messages(ImageData.from_bytes(b"other")))
+    # a pooled backend's model answers only for that backend and model
+    assert key != _key(cache, messages(image), provider="bedrock")
+    assert key != _key(cache, messages(image), model="anthropic.m-v1:0")
+
+
+def test_get_put_and_lru_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_entries=2)
+    assert cache.get("a") is None
+    cache.put("a", _message("first"))
+    cache.put("b", _message("second"))
+    assert cache.get("a").content[0].text == "first"
+    cache.put("c", _message("third"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats() == {"hits": 2, "misses": 2, "hit_rate": 0.5}
+
+    # a new instance picks up the order from disk
+    reopened = ResponseCache(tmp_path, max_entries=2)
+    reopened.put("d", _message("fourth"))
+    assert sorted(path.stem for path in tmp_path.glob("*.json")) == ["a", "d"]
+
+
+async def test_rerun_is_served_from_cache(monkeypatch, tmp_path):
+    cache = ResponseCache(tmp_path)
+    script = ReplayScript(turns=[[{"type": "text", "text": "Done!"}]])
+    with ReplayServer([script]) as server:
+        monkeypatch.setenv("REPLAY_BASE_URL", server.base_url)
+        results = []
+        for _ in range(2):
+            results.append(
+                await sampling_loop(
+                    model="claude-3-5-sonnet-20241022",
+                    provider=APIProvider.REPLAY,
+                    system_prompt_suffix="",
+                    messages=[{"role": "user", "content": "Task"}],
+                    output_callback=mock.Mock(),
+                    tool_output_callback=mock.Mock(),
+                    api_response_callback=mock.Mock(),
+                    api_key="",
+                    response_cache=cache,
+                )
+            )
+        assert server.requests_served == 1
+    assert results[0] == results[1]
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,170 @@
+import json
+import time
+
+import pytest
+
+from computer_use_demo.replay import ReplayScript, ReplayServer
+from computer_use_demo.runner import (
+    STOPPED_BY_USER,
+    RunConfig,
+    RunnerClient,
+    RunnerError,
+    RunnerService,
+    TaskRunner,
+)
+from computer_use_demo.tools import BashTool, ToolCollection
+
+DATASET = "tasks.json"
+
+
+def _bash_turn(command: str) -> list[dict]:
+    return [
+        {
+            "type": "tool_use",
+            "id": "toolu_1",
+            "name": "bash",
+            "input": {"command": command},
+        }
+    ]
+
+
+DONE = [{"type": "text", "text": "Done"}]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / DATASET).write_text(
+        json.dumps(
+            [
+                {"identifier": "first", "task": "Say hi"},
+                {"identifier": "second", "task": "Wait"},
+            ]
+        )
+    )
+    return data_dir
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, data_dir):
+    scripts = [
+        ReplayScript(task="Say hi", turns=[_bash_turn("echo hi"), DONE]),
+        ReplayScript(task="Wait", turns=[_bash_turn("sleep 30"), DONE]),
+    ]
+    runner = TaskRunner(
+        data_dir=data_dir,
+        log_dir=tmp_path / "log",
+        tool_collection_factory=lambda: ToolCollection(BashTool(pool_size=0)),
+    )
+    with ReplayServer(scripts) as replay, RunnerService(runner, port=0) as service:
+        monkeypatch.setenv("REPLAY_BASE_URL", replay.base_url)
+        client = RunnerClient(service.base_url)
+        yield client
+        client.close()
+
+
+def _config(**options) -> RunConfig:
+    return RunConfig(dataset=DATASET, provider="replay", settle_timeout=0, **options)
+
+
+def _wait_for(condition, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while not (result := condition()):
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.05)
+    return result
+
+
+def _ended(client: RunnerClient, run_id: str) -> dict:
+    return _wait_for(
+        lambda: (status := client.status(run_id))["state"]
+        not in ("running", "stopping")
+        and status
+    )
+
+
+def test_run_works_through_a_dataset_and_logs_it(client, data_dir, tmp_path):
+    (data_dir / f"{DATASET}_last_task.json").write_text(
+        json.dumps({"last_identifier": "second"})
+    )
+    run = client.start(_config())
+    _wait_for(lambda: client.status(run["id"])["identifier"] == "second")
+    client.stop(run["id"])
+    assert _ended(client, run["id"])["completed"] == 1
+
+    # the resume point is kept unless the run restarts the dataset
+    run = client.start(_config(restart=True))
+    _wait_for(lambda: client.status(run["id"])["identifier"] == "second")
+    client.stop(run["id"])
+    status = _ended(client, run["id"])
+
+    assert status["state"] == "stopped"
+    assert status["completed"] == 2
+    assert status["metrics"]["tasks"] == 2
+    logs = {
+        path.name.rsplit("_", 1)[1]: path for path in (tmp_path / "log").glob("*.json")
+    }
+    assert (
+        json.loads(logs["first.json"].read_text())["messages"][-1]["content"][0]["text"]
+        == "Done"
+    )
+    assert json.loads(logs["second.json"].read_text())["stop_reason"] == STOPPED_BY_USER
+    assert "metrics.json" in logs
+    # the stopped task is run again on resume
+    assert json.loads((data_dir / f"{DATASET}_last_task.json").read_text()) == {
+        "last_identifier": "second"
+    }
+
+    events = client.events(run["id"])
+    assert [event["seq"] for event in events] == sorted(
+        event["seq"] for event in events
+    )
+    tool_results = [event for event in events if event["type"] == "tool_result"]
+    assert tool_results[0] | {"identifier": "first", "output": "hi"} == tool_results[0]
+    assert client.events(run["id"], after=events[-1]["seq"]) == []
+    assert len(client.events(run["id"], limit=2)) == 2
+
+
+def test_stop_interrupts_the_running_tool_call(client):
+    run = client.start(_config(restart=True))
+    _wait_for(
+        lambda: any(
+            event["type"] == "tool_use" and event["identifier"] == "second"
+            for event in client.events(run["id"])
+        )
+    )
+    stop_requested = time.monotonic()
+    assert client.stop(run["id"])["state"] == "stopping"
+    assert _ended(client, run["id"])["state"] == "stopped"
+    assert time.monotonic() - stop_requested < 5
+
+
+def test_finished_dataset_has_nothing_left_to_run(client, data_dir):
+    (data_dir / f"{DATASET}_last_task.json").write_text(
+        json.dumps({"last_identifier": "second", "finished": True})
+    )
+    status = _ended(client, client.start(_config())["id"])
+    assert status["state"] == "finished"
+    assert status["completed"] == 0
+
+
+def test_api_rejects_bad_requests(client):
+    with pytest.raises(RunnerError) as missing:
+        client.start(RunConfig(dataset="missing.json"))
+    assert missing.value.status_code == 404
+    with pytest.raises(RunnerError) as unknown_run:
+        client.status("nope")
+    assert unknown_run.value.status_code == 404
+    with pytest.raises(RunnerError) as bad_option:
+        client._request("POST", "/runs", json={"dataset": DATASET, "speed": 2})
+    assert bad_option.value.status_code == 400
+    with pytest.raises(ValueError):
+        RunConfig(dataset="../tasks.json")
+
+    run = client.start(_config(restart=True))
+    with pytest.raises(RunnerError) as conflict:
+        client.start(_config())
+    assert conflict.value.status_code == 409
+    client.stop(run["id"])
+    _ended(client, run["id"])
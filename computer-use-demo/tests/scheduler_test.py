@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import httpx
+from anthropic import APIConnectionError, InternalServerError, RateLimitError
+from anthropic.types import TextBlock
+from anthropic.types.beta import BetaMessage, BetaUsage
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.scheduler import RateLimitScheduler, bucket_key
+
+
+def _reset_in(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+async def test_requests_are_admitted_in_arrival_order():
+    scheduler = RateLimitScheduler()
+    scheduler.record_response(
+        "k",
+        {
+            "anthropic-ratelimit-requests-remaining": "0",
+            "anthropic-ratelimit-requests-reset": _reset_in(0.2),
+        },
+    )
+    admitted = []
+
+    async def request(index: int):
+        await scheduler.acquire("k")
+        admitted.append(index)
+
+    tasks = []
+    for index in range(5):
+        tasks.append(asyncio.create_task(request(index)))
+        await asyncio.sleep(0)
+    assert scheduler.stats()["k"]["queue_depth"] == 5
+    await asyncio.gather(*tasks)
+
+    assert admitted == list(range(5))
+    stats = scheduler.stats()["k"]
+    assert stats["queue_depth"] == 0
+    assert stats["requests"] == 5
+    assert stats["max_wait"] >= 0.15
+
+
+async def test_rate_limited_response_blocks_for_retry_after():
+    scheduler = RateLimitScheduler()
+    scheduler.record_response("k", {"retry-after": "0.2"}, status_code=429)
+    assert await scheduler.acquire("k") >= 0.15
+    assert await scheduler.acquire("other") < 0.1
+    assert scheduler.stats()["k"]["rate_limited"] == 1
+
+
+async def test_input_token_budget_delays_large_requests():
+    scheduler = RateLimitScheduler()
+    scheduler.record_response(
+        "k",
+        {
+            "anthropic-ratelimit-input-tokens-remaining": "1000",
+            "anthropic-ratelimit-input-tokens-reset": _reset_in(0.2),
+        },
+    )
+    assert await scheduler.acquire("k", input_tokens=800) < 0.1
+    assert await scheduler.acquire("k", input_tokens=800) >= 0.15
+
+
+def test_waiters_on_other_threads_are_woken():
+    scheduler = RateLimitScheduler()
+    scheduler.record_response("k", {"retry-after": "0.1"}, status_code=429)
+    waits = []
+
+    def worker():
+        waits.append(asyncio.run(scheduler.acquire("k")))
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(waits) == 3
+    assert scheduler.stats()["k"]["queue_depth"] == 0
+
+
+def test_bucket_key_does_not_contain_api_key():
+    key = bucket_key(APIProvider.ANTHROPIC, "sk-ant-secret")
+    assert "secret" not in key
+    assert key.startswith("anthropic:")
+    assert bucket_key(APIProvider.BEDROCK) == "bedrock"
+
+
+async def test_sampling_loop_retries_rate_limited_requests():
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    rate_limited = RateLimitError(
+        "rate limited",
+        response=httpx.Response(429, headers={"retry-after": "0.1"}, request=request),
+        body=None,
+    )
+    raw_response = mock.Mock()
+    raw_response.http_response.headers = {}
+    raw_response.parse.return_value = mock.Mock(
+        spec=BetaMessage,
+        id="msg_test",
+        model="test-model",
+        stop_reason="end_turn",
+        usage=BetaUsage(input_tokens=10, output_tokens=5),
+        content=[TextBlock(type="text", text="Done!")],
+    )
+    client = mock.Mock()
+    client.with_options.return_value = client
+    client.beta.messages.with_raw_response.create.side_effect = [
+        rate_limited,
+        raw_response,
+    ]
+    scheduler = RateLimitScheduler()
+    metrics_callback = mock.Mock()
+
+    start = time.monotonic()
+    with mock.patch("computer_use_demo.loop.Anthropic", return_value=client):
+        messages = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "Test message"}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            metrics_callback=metrics_callback,
+            scheduler=scheduler,
+        )
+
+    assert time.monotonic() - start >= 0.1
+    assert messages[-1]["content"] == [{"type": "text", "text": "Done!"}]
+    client.with_options.assert_called_with(max_retries=0)
+    assert client.beta.messages.with_raw_response.create.call_count == 2
+    assert metrics_callback.call_args.args[0].scheduler_wait >= 0.05
+    stats = scheduler.stats()[bucket_key(APIProvider.ANTHROPIC, "test-key")]
+    assert stats["rate_limited"] == 1
+    assert stats["requests"] == 2
+
+
+async def test_sampling_loop_retries_transient_failures_with_backoff():
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    raw_response = mock.Mock()
+    raw_response.http_response.headers = {}
+    raw_response.parse.return_value = mock.Mock(
+        spec=BetaMessage,
+        id="msg_test",
+        model="test-model",
+        stop_reason="end_turn",
+        usage=BetaUsage(input_tokens=10, output_tokens=5),
+        content=[TextBlock(type="text", text="Done!")],
+    )
+    client = mock.Mock()
+    client.with_options.return_value = client
+    client.beta.messages.with_raw_response.create.side_effect = [
+        InternalServerError(
+            "bad gateway",
+            response=httpx.Response(502, headers={"retry-after": "0"}, request=request),
+            body=None,
+        ),
+        APIConnectionError(request=request),
+        raw_response,
+    ]
+    scheduler = RateLimitScheduler()
+
+    with (
+        mock.patch("computer_use_demo.scheduler.BACKOFF_BASE_SECONDS", 0.01),
+        mock.patch("computer_use_demo.loop.Anthropic", return_value=client),
+    ):
+        messages = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "Test message"}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            scheduler=scheduler,
+        )
+
+    assert messages[-1]["content"] == [{"type": "text", "text": "Done!"}]
+    assert client.beta.messages.with_raw_response.create.call_count == 3
+    # only rate limits hold back the other loops sharing the bucket
+    stats = scheduler.stats()[bucket_key(APIProvider.ANTHROPIC, "test-key")]
+    assert stats["rate_limited"] == 0
+    assert stats["blocked_for"] == 0
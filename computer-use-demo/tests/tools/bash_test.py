@@ -1,11 +1,17 @@
+import asyncio
+import gc
+import time
+
 import pytest
 
-from computer_use_demo.tools.bash import BashTool, ToolError
+from computer_use_demo.tools.bash import BashTool, ToolError, _BashSession
 
 
 @pytest.fixture
-def bash_tool():
-    return BashTool()
+async def bash_tool():
+    tool = BashTool()
+    yield tool
+    await tool.close()
 
 
 @pytest.mark.asyncio
@@ -62,10 +68,180 @@ async def test_bash_tool_non_zero_exit(bash_tool):
 
 @pytest.mark.asyncio
 async def test_bash_tool_timeout(bash_tool):
-    await bash_tool(command="echo 'Hello, World!'")
+    await bash_tool(command="cd /tmp && export TASK_STATE=kept")
+    background_pid = int((await bash_tool(command="sleep 100 & echo $!")).output)
     bash_tool._session._timeout = 0.1  # Set a very short timeout for testing
     with pytest.raises(
         ToolError,
-        match="timed out: bash has not returned in 0.1 seconds and must be restarted",
+        match=r"timed out: the command did not finish in 0.1 seconds and was "
+        r"interrupted \(exit status 143\); the shell is still usable",
     ):
-        await bash_tool(command="sleep 1")
+        await bash_tool(command="echo partial; sleep 30")
+
+    # only the timed-out command is gone; the shell and its other jobs are not
+    bash_tool._session._timeout = 120.0
+    result = await bash_tool(command="echo $PWD $TASK_STATE")
+    assert result.output == "/tmp kept"
+    assert _running(background_pid)
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_timeout_in_the_shell_itself_needs_a_restart(bash_tool):
+    await bash_tool(command="true")
+    bash_tool._session._timeout = 0.1
+    bash_tool._session._kill_timeout = 0.3
+    with pytest.raises(ToolError, match="must be restarted"):
+        await bash_tool(command="while true; do :; done")
+    with pytest.raises(ToolError, match="must be restarted"):
+        await bash_tool(command="echo hi")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_records_exit_status_and_duration(bash_tool):
+    result = await bash_tool(command="sleep 0.3; (exit 3)")
+    assert result.exit_code == 3
+    assert result.duration >= 0.3
+    assert (await bash_tool(command="echo ok # trailing comment")).exit_code == 0
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_reset_starts_a_fresh_session(bash_tool):
+    await bash_tool(command="export TASK_STATE=dirty")
+    assert (await bash_tool(command="echo $TASK_STATE")).output == "dirty"
+
+    await bash_tool.reset()
+    assert bash_tool._session is None
+    assert (await bash_tool(command="echo $TASK_STATE")).output == ""
+
+
+# the first shell's transport is collected after its event loop has closed
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+def test_bash_tool_session_survives_only_its_event_loop():
+    bash_tool = BashTool(pool_size=0)
+
+    async def shell_pid():
+        return (await bash_tool(command="echo $$")).output
+
+    first = asyncio.run(shell_pid())
+    second = asyncio.run(shell_pid())
+    assert first and second and first != second
+    gc.collect()
+
+
+def _running(pid: int) -> bool:
+    # the killed job may linger as a zombie until init reaps it
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+async def _settle(bash_tool: BashTool):
+    assert bash_tool._pool
+    while bash_tool._pool._tasks:
+        await asyncio.gather(*bash_tool._pool._tasks)
+
+
+# the abandoned shells' transports are collected after their event loop has closed
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+def test_bash_tool_kills_the_pre_started_shells_of_a_closed_event_loop():
+    bash_tool = BashTool(pool_size=2)
+
+    async def run_and_settle():
+        await bash_tool(command="true")
+        await _settle(bash_tool)
+        return [session._process.pid for session in bash_tool._pool._idle]
+
+    def assert_killed(pids):
+        for pid in pids:
+            for _ in range(100):
+                if not _running(pid):
+                    break
+                time.sleep(0.05)
+            assert not _running(pid)
+
+    idle = asyncio.run(run_and_settle())
+    assert len(idle) == 2
+    idle_after_rerun = asyncio.run(run_and_settle())
+    assert_killed(idle)
+    asyncio.run(bash_tool.close())
+    assert_killed(idle_after_rerun)
+    gc.collect()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_restart_uses_a_pre_started_shell(bash_tool):
+    old_pid = int((await bash_tool(command="sleep 100 & echo $!")).output)
+    old_process = bash_tool._session._process
+    await _settle(bash_tool)
+    assert len(bash_tool._pool._idle) == 2
+    ready = bash_tool._pool._idle[0]
+
+    await bash_tool(restart=True)
+    assert bash_tool._session is ready
+    await _settle(bash_tool)
+
+    # the old shell and the job it left running are gone, and the pool is full
+    assert old_process.returncode is not None
+    assert not _running(old_pid)
+    assert len(bash_tool._pool._idle) == 2
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_replaces_dead_pooled_shells(bash_tool):
+    await bash_tool(command="true")
+    await _settle(bash_tool)
+    for session in bash_tool._pool._idle:
+        session.kill()
+        await session._process.wait()
+
+    result = await bash_tool(restart=True)
+    assert result.system == "tool has been restarted."
+    assert (await bash_tool(command="echo alive")).output == "alive"
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_logs_a_failed_refill_and_refills_later(
+    bash_tool, monkeypatch, caplog
+):
+    start = _BashSession.start
+    starts = 0
+
+    async def start_but_fail_the_second(session):
+        nonlocal starts
+        starts += 1
+        if starts == 2:
+            raise OSError("fork failed")
+        await start(session)
+
+    monkeypatch.setattr(_BashSession, "start", start_but_fail_the_second)
+    await bash_tool(command="true")
+    while bash_tool._pool._tasks:
+        await asyncio.wait(bash_tool._pool._tasks)
+    assert bash_tool._pool.failures == 1
+    assert not bash_tool._pool._idle
+    assert "fork failed" in caplog.text
+
+    await bash_tool(restart=True)
+    await _settle(bash_tool)
+    assert len(bash_tool._pool._idle) == 2
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_silent_command_has_an_empty_result(bash_tool):
+    result = await bash_tool(command="true")
+    assert result.exit_code == 0
+    assert not result
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_call_cancelled_while_the_shell_starts(bash_tool):
+    for yields in range(4):
+        call = asyncio.ensure_future(bash_tool(command="echo hi"))
+        for _ in range(yields):
+            await asyncio.sleep(0)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(asyncio.shield(call), timeout=10)
+        await bash_tool.reset()
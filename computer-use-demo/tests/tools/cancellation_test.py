@@ -0,0 +1,85 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from computer_use_demo.tools import (
+    INTERRUPTED_TOOL_ERROR,
+    BashTool,
+    Cancelled,
+    CancelToken,
+    ToolCollection,
+)
+from computer_use_demo.tools.run import run
+
+
+@pytest.mark.asyncio
+async def test_cancelling_from_another_thread_ends_the_race_at_once():
+    token = CancelToken()
+    assert await token.race(asyncio.sleep(0, result="done")) == "done"
+
+    threading.Timer(0.05, token.cancel, args=("stopped",)).start()
+    started = time.monotonic()
+    with pytest.raises(Cancelled) as cancelled:
+        await token.race(asyncio.sleep(30))
+    assert cancelled.value.reason == "stopped"
+    assert time.monotonic() - started < 1
+
+    # a cancelled token keeps its first reason and starts nothing new
+    token.cancel("again")
+    with pytest.raises(Cancelled, match="stopped"):
+        await token.race(asyncio.sleep(30))
+
+
+@pytest.mark.asyncio
+async def test_cancelled_command_is_killed_with_its_children(tmp_path):
+    pid_file = tmp_path / "pid"
+    command = asyncio.create_task(run(f"sleep 30 & echo $! > {pid_file}; wait"))
+    for _ in range(500):
+        if pid_file.exists() and pid_file.read_text():
+            break
+        await asyncio.sleep(0.01)
+    command.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await command
+
+    child = int(pid_file.read_text())
+    # the child was killed; whoever reaps it, it is gone or a zombie
+    for _ in range(100):
+        try:
+            with open(f"/proc/{child}/stat") as stat:
+                if stat.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    break
+        except FileNotFoundError:
+            break
+        await asyncio.sleep(0.01)
+    else:
+        os.kill(child, 9)
+        pytest.fail("the command's child outlived it")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_bash_call_is_interrupted_and_the_shell_kept():
+    collection = ToolCollection(BashTool(pool_size=0))
+    token = CancelToken()
+    asyncio.get_running_loop().call_later(0.5, token.cancel)
+    started = time.monotonic()
+    result = await collection.run(
+        name="bash",
+        tool_input={"command": "echo partial; sleep 30"},
+        cancel_token=token,
+    )
+    assert result.error == INTERRUPTED_TOOL_ERROR
+    assert time.monotonic() - started < 2
+
+    # calls after the stop do not start
+    result = await collection.run(
+        name="bash", tool_input={"command": "echo late"}, cancel_token=token
+    )
+    assert result.error == INTERRUPTED_TOOL_ERROR
+
+    result = await collection.run(name="bash", tool_input={"command": "echo next"})
+    assert (result.output, result.error) == ("next", "")
+    await collection.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo.tools import BashTool, EditTool, ToolCollection, ToolResult
+from computer_use_demo.tools.base import BaseAnthropicTool
+
+
+@pytest.mark.asyncio
+async def test_reset_only_touches_named_tools(tmp_path):
+    bash, edit = BashTool(), EditTool()
+    collection = ToolCollection(bash, edit)
+    path = tmp_path / "notes.txt"
+    await collection.run(
+        name="str_replace_editor",
+        tool_input={"command": "create", "path": str(path), "file_text": "a"},
+    )
+    await collection.run(name="bash", tool_input={"command": "true"})
+
+    await collection.reset(["str_replace_editor"])
+    assert not edit._file_history
+    assert bash._session is not None
+
+    await collection.reset()
+    assert bash._session is None
+
+    with pytest.raises(ValueError, match="computer"):
+        await collection.reset(["computer"])
+    await collection.close()
+
+
+class _SlowTool(BaseAnthropicTool):
+    def __init__(self, ready_after: float):
+        self.ready_after = ready_after
+        self.calls = 0
+
+    def to_params(self):
+        return {"name": "slow", "type": "custom"}
+
+    async def __call__(self, **kwargs):
+        self.calls += 1
+        return ToolResult(output="ran")
+
+    async def ready(self):
+        await asyncio.sleep(self.ready_after)
+
+
+@pytest.mark.asyncio
+async def test_tool_calls_wait_for_the_held_setup():
+    tool = _SlowTool(ready_after=0)
+    collection = ToolCollection(tool)
+    setup_done = asyncio.Event()
+    setup = collection.hold(setup_done.wait())
+
+    call = asyncio.create_task(collection.run(name="slow", tool_input={}))
+    await asyncio.sleep(0.05)
+    assert tool.calls == 0
+    setup_done.set()
+    assert (await call).output == "ran"
+    assert setup.done()
+
+    # a cancelled setup, e.g. of a stopped task, holds nothing up
+    collection.hold(asyncio.Event().wait()).cancel()
+    await asyncio.sleep(0)
+    assert (await collection.run(name="slow", tool_input={})).output == "ran"
+
+
+@pytest.mark.asyncio
+async def test_a_failed_setup_fails_only_the_calls_that_waited_for_it():
+    tool = _SlowTool(ready_after=0)
+    collection = ToolCollection(tool)
+    setup_done = asyncio.Event()
+
+    async def fail():
+        await setup_done.wait()
+        raise RuntimeError("restart failed")
+
+    setup = collection.hold(fail())
+    call = asyncio.create_task(collection.run(name="slow", tool_input={}))
+    await asyncio.sleep(0.01)
+    setup_done.set()
+    result = await call
+    assert result.error == "Tool setup failed: RuntimeError('restart failed')"
+    assert tool.calls == 0
+    assert isinstance(setup.exception(), RuntimeError)
+
+    assert (await collection.run(name="slow", tool_input={})).output == "ran"
+    assert tool.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_ready_gives_up_after_the_timeout():
+    collection = ToolCollection(_SlowTool(ready_after=0.01))
+    await asyncio.wait_for(collection.wait_ready(1), timeout=0.5)
+    slow = ToolCollection(_SlowTool(ready_after=30))
+    await asyncio.wait_for(slow.wait_ready(0.1), timeout=1)
@@ -8,6 +8,7 @@ from computer_use_demo.tools.computer import (
     ToolError,
     ToolResult,
 )
+from computer_use_demo.tools.image import ImageData
 
 
 @pytest.fixture
@@ -21,7 +22,7 @@ async def test_computer_tool_mouse_move(computer_tool):
         mock_shell.return_value = ToolResult(output="Mouse moved")
         result = await computer_tool(action="mouse_move", coordinate=[100, 200])
         mock_shell.assert_called_once_with(
-            f"{computer_tool.xdotool} mousemove --sync 100 200"
+            [computer_tool.xdotool, "mousemove", "--sync", "100", "200"]
         )
         assert result.output == "Mouse moved"
 
@@ -38,9 +39,16 @@ async def test_computer_tool_type(computer_tool):
         mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
         result = await computer_tool(action="type", text="Hello, World!")
         assert mock_shell.call_count == 1
-        assert "type --delay 12 -- 'Hello, World!'" in mock_shell.call_args[0][0]
+        assert mock_shell.call_args[0][0][1:] == [
+            "type",
+            "--delay",
+            "12",
+            "--",
+            "Hello, World!",
+        ]
         assert result.output == "Text typed"
-        assert result.base64_image == "base64_screenshot"
+        assert result.image is mock_screenshot.return_value.image
+        assert result.image.base64() == "base64_screenshot"
 
 
 @pytest.mark.asyncio
@@ -137,3 +145,67 @@ async def test_computer_tool_missing_coordinate(computer_tool):
 async def test_computer_tool_missing_text(computer_tool):
     with pytest.raises(ToolError, match="text is required for type"):
         await computer_tool(action="type")
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_is_ready_once_the_screen_stops_changing(computer_tool):
+    frames = [b"moving", b"settling", b"settled", b"settled"]
+    with (
+        patch("computer_use_demo.tools.computer.SETTLE_POLL_SECONDS", 0),
+        patch.object(
+            computer_tool,
+            "_take_screenshot",
+            new_callable=AsyncMock,
+            side_effect=[ToolError("no display")]
+            + [ImageData(frame) for frame in frames],
+        ) as mock_screenshot,
+    ):
+        await computer_tool.ready()
+        assert mock_screenshot.call_count == 5
+    # settle polls are never shown to the model, so none is kept
+    assert len(computer_tool.screenshots) == 0
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_commands_reach_the_display_by_environment(computer_tool):
+    computer_tool._screenshot_delay = 0
+    with (
+        patch(
+            "computer_use_demo.tools.computer.run",
+            new_callable=AsyncMock,
+            return_value=(0, "", ""),
+        ) as mock_run,
+        patch.object(computer_tool, "screenshot", new_callable=AsyncMock),
+    ):
+        await computer_tool(action="key", text="ctrl+a Return")
+        mock_run.assert_any_call(
+            ["xdotool", "key", "--", "ctrl+a", "Return"], env={"DISPLAY": ":1"}
+        )
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_is_captured_to_memory(computer_tool):
+    with (
+        patch("computer_use_demo.tools.computer.damage_tracker", return_value=None),
+        patch("computer_use_demo.tools.computer.cursor_overlay", return_value=None),
+        patch(
+            "computer_use_demo.tools.computer.run_binary",
+            new_callable=AsyncMock,
+            return_value=(0, b"png", b""),
+        ) as mock_run,
+    ):
+        result = await computer_tool.screenshot()
+        x, y = computer_tool.scale_coordinates(
+            ScalingSource.COMPUTER, computer_tool.width, computer_tool.height
+        )
+        mock_run.assert_called_once_with(
+            ["import", "-window", "root", "-resize", f"{x}x{y}!", "png:-"],
+            env={"DISPLAY": ":1"},
+        )
+        assert result.image.data == b"png"
+        assert computer_tool.screenshots.recent()[-1].image is result.image
+
+        mock_run.return_value = (1, b"", b"unable to open X server\n")
+        with pytest.raises(ToolError, match="unable to open X server$"):
+            await computer_tool.screenshot()
+        assert len(computer_tool.screenshots) == 1
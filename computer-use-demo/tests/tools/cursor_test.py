@@ -0,0 +1,53 @@
+import io
+from types import SimpleNamespace
+
+from PIL import Image
+
+from computer_use_demo.tools.cursor import CursorOverlay, read_cursor
+
+RED = 0xFFFF0000
+HALF_GREEN = 0x80008000  # premultiplied: half-transparent pure green
+
+
+class FakeCursorDisplay:
+    """A 4x2 display with a 2x1 pointer whose hotspot sits at x, y."""
+
+    def __init__(self, x=1, y=0, pixels=(RED, HALF_GREEN)):
+        self.reply = SimpleNamespace(
+            x=x,
+            y=y,
+            width=len(pixels),
+            height=1,
+            xhot=0,
+            yhot=0,
+            cursor_serial=7,
+            cursor_image=list(pixels),
+        )
+
+    def xfixes_get_cursor_image(self, window):
+        return self.reply
+
+    def screen(self):
+        return SimpleNamespace(width_in_pixels=4, height_in_pixels=2)
+
+
+def test_cursor_is_read_unpremultiplied_and_placed_by_its_hotspot():
+    display = FakeCursorDisplay(x=3, y=1)
+    display.reply.xhot = 1
+    cursor = read_cursor(display)
+    assert (cursor.x, cursor.y, cursor.serial) == (2, 1, 7)
+    assert cursor.image.getpixel((0, 0)) == (255, 0, 0, 255)
+    assert cursor.image.getpixel((1, 0)) == (0, 255, 0, 128)
+
+
+def test_cursor_is_drawn_onto_a_scaled_screenshot():
+    output = io.BytesIO()
+    Image.new("RGB", (8, 4), "white").save(output, format="PNG")
+    overlay = CursorOverlay(FakeCursorDisplay(pixels=(RED,)))
+
+    with Image.open(io.BytesIO(overlay.draw(output.getvalue()))) as drawn:
+        # the screen is 4x2 and the screenshot 8x4, so the pointer is 2x2 at 2, 0
+        assert drawn.getpixel((2, 0)) == (255, 0, 0)
+        assert drawn.getpixel((3, 1)) == (255, 0, 0)
+        assert drawn.getpixel((1, 0)) == (255, 255, 255)
+        assert drawn.getpixel((4, 0)) == (255, 255, 255)
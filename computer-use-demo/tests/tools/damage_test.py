@@ -0,0 +1,164 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from Xlib import X
+
+from computer_use_demo.tools.damage import DamageTracker, DamageUnavailable, Region
+
+NOTIFY = 91
+
+
+class FakeDisplay:
+    """A 4x2 display whose pixels are set by draw(), reporting its damage."""
+
+    def __init__(self, depth: int = 24, cursor: SimpleNamespace | None = None):
+        self.cursor = cursor
+        self.pixels = Image.new("RGB", (4, 2), "white")
+        self.events = []
+        self.grabs = []
+        self.extension_event = SimpleNamespace(DamageNotify=NOTIFY)
+        self._root = SimpleNamespace(
+            change_attributes=lambda event_mask: None,
+            get_geometry=lambda: SimpleNamespace(
+                width=self.pixels.width, height=self.pixels.height
+            ),
+            damage_create=lambda level: 1,
+            get_image=self._get_image,
+        )
+        self._screen = SimpleNamespace(root=self._root, root_depth=depth)
+
+    def draw(self, x, y, width, height, color):
+        self.pixels.paste(color, (x, y, x + width, y + height))
+        area = SimpleNamespace(x=x, y=y, width=width, height=height)
+        self.events.append(SimpleNamespace(type=NOTIFY, area=area))
+
+    def resize(self, width, height):
+        self.pixels = Image.new("RGB", (width, height), "black")
+        self.events.append(
+            SimpleNamespace(type=X.ConfigureNotify, width=width, height=height)
+        )
+        area = SimpleNamespace(x=0, y=0, width=width, height=height)
+        self.events.append(SimpleNamespace(type=NOTIFY, area=area))
+
+    def has_extension(self, name):
+        return name == "DAMAGE" or (name == "XFIXES" and self.cursor is not None)
+
+    def xfixes_query_version(self):
+        pass
+
+    def xfixes_get_cursor_image(self, window):
+        return self.cursor
+
+    def screen(self):
+        return self._screen
+
+    def damage_query_version(self):
+        pass
+
+    def damage_subtract(self, damage):
+        pass
+
+    def sync(self):
+        pass
+
+    def pending_events(self):
+        return len(self.events)
+
+    def next_event(self):
+        return self.events.pop(0)
+
+    def _get_image(self, x, y, width, height, image_format, plane_mask):
+        self.grabs.append((x, y, width, height))
+        crop = self.pixels.crop((x, y, x + width, y + height)).convert("RGBA")
+        return SimpleNamespace(data=crop.tobytes("raw", "BGRA"))
+
+
+def _pixels(image) -> list:
+    with Image.open(io.BytesIO(image.data)) as decoded:
+        rgb = decoded.convert("RGB")
+        return [
+            rgb.getpixel((x, y)) for y in range(rgb.height) for x in range(rgb.width)
+        ]
+
+
+def test_unchanged_screen_is_not_captured_again():
+    display = FakeDisplay()
+    tracker = DamageTracker(display)
+    first = tracker.capture()
+    assert tracker.capture() is first
+    assert display.grabs == [(0, 0, 4, 2)]
+    assert _pixels(first) == [(255, 255, 255)] * 8
+
+
+def test_only_the_damaged_region_is_captured():
+    display = FakeDisplay()
+    tracker = DamageTracker(display)
+    tracker.capture()
+    display.draw(1, 0, 1, 1, (255, 0, 0))
+    display.draw(2, 1, 1, 1, (0, 0, 255))
+
+    image = tracker.capture()
+    assert display.grabs[1:] == [(1, 0, 2, 2)]
+    assert _pixels(image) == [
+        (255, 255, 255),
+        (255, 0, 0),
+        (255, 255, 255),
+        (255, 255, 255),
+        (255, 255, 255),
+        (255, 255, 255),
+        (0, 0, 255),
+        (255, 255, 255),
+    ]
+    assert Image.open(io.BytesIO(tracker.capture((2, 1)).data)).size == (2, 1)
+
+
+def test_pointer_moves_are_drawn_without_capturing_again():
+    red_pointer = SimpleNamespace(
+        x=0,
+        y=0,
+        width=1,
+        height=1,
+        xhot=0,
+        yhot=0,
+        cursor_serial=1,
+        cursor_image=[0xFFFF0000],
+    )
+    display = FakeDisplay(cursor=red_pointer)
+    tracker = DamageTracker(display)
+    assert _pixels(tracker.capture())[:2] == [(255, 0, 0), (255, 255, 255)]
+    red_pointer.x = 1
+
+    assert _pixels(tracker.capture())[:2] == [(255, 255, 255), (255, 0, 0)]
+    assert display.grabs == [(0, 0, 4, 2)]
+
+
+def test_a_resized_screen_is_captured_in_full_at_its_new_size():
+    display = FakeDisplay()
+    tracker = DamageTracker(display)
+    tracker.capture()
+    display.resize(6, 3)
+
+    image = tracker.capture()
+    assert display.grabs == [(0, 0, 4, 2), (0, 0, 6, 3)]
+    assert Image.open(io.BytesIO(image.data)).size == (6, 3)
+    assert _pixels(image) == [(0, 0, 0)] * 18
+
+    display.draw(5, 2, 1, 1, (255, 0, 0))
+    assert _pixels(tracker.capture())[-1] == (255, 0, 0)
+    assert display.grabs[-1] == (5, 2, 1, 1)
+
+
+def test_tracker_needs_a_true_color_screen():
+    with pytest.raises(DamageUnavailable):
+        DamageTracker(FakeDisplay(depth=16))
+
+
+def test_regions_are_merged_and_kept_on_screen():
+    merged = Region(x=5, y=5, width=2, height=2).union(
+        Region(x=0, y=6, width=1, height=4)
+    )
+    assert merged == Region(x=0, y=5, width=7, height=5)
+    assert merged.clip(4, 8) == Region(x=0, y=5, width=4, height=3)
+    assert Region(x=9, y=0, width=1, height=1).clip(4, 8) is None
@@ -0,0 +1,57 @@
+import base64
+import copy
+
+from computer_use_demo.tools import ImageData, ToolResult, inline_images
+
+
+def test_from_bytes_interns_identical_payloads():
+    first = ImageData.from_bytes(b"same-pixels")
+    second = ImageData.from_bytes(b"same-pixels")
+    assert first is second
+    assert ImageData.from_bytes(b"other-pixels") is not first
+    assert copy.deepcopy(first) is first
+
+
+def test_base64_is_produced_lazily_from_raw_bytes():
+    image = ImageData.from_bytes(b"raw-png")
+    assert image.data == b"raw-png"
+    assert image.size == len(b"raw-png")
+    assert image.base64() == base64.b64encode(b"raw-png").decode()
+    # encoded once, however many requests resend the image
+    assert image.base64() is image.base64()
+
+
+def test_from_base64_keeps_the_original_string():
+    encoded = base64.b64encode(b"legacy").decode()
+    image = ImageData.from_base64(encoded)
+    assert image.base64() is encoded
+    assert image.data == b"legacy"
+    assert image.size == len(b"legacy")
+
+
+def test_tool_result_accepts_legacy_base64_image():
+    encoded = base64.b64encode(b"legacy").decode()
+    result = ToolResult(base64_image=encoded)
+    assert result.image is not None
+    assert result.image.base64() is encoded
+
+    replaced = result.replace(base64_image=base64.b64encode(b"newer").decode())
+    assert replaced.image.data == b"newer"
+    image = ImageData.from_bytes(b"newest")
+    assert result.replace(image=image).base64_image is None
+
+
+def test_inline_images_copies_only_paths_to_images():
+    image = ImageData.from_bytes(b"inline-me")
+    text_block = {"type": "text", "text": "hi"}
+    image_block = {"type": "image", "source": {"type": "base64", "data": image}}
+    messages = [
+        {"role": "user", "content": [text_block]},
+        {"role": "user", "content": [image_block]},
+    ]
+
+    inlined = inline_images(messages)
+
+    assert inlined[0] is messages[0]
+    assert inlined[1]["content"][0]["source"]["data"] == image.base64()
+    assert image_block["source"]["data"] is image
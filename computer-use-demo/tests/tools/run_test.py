@@ -0,0 +1,27 @@
+import pytest
+
+from computer_use_demo.tools.run import TRUNCATED_MESSAGE, run
+
+
+@pytest.mark.asyncio
+async def test_argv_is_executed_without_a_shell():
+    code, stdout, stderr = await run(
+        ["printf", "%s|", "$HOME", "a b", "*"], env={"EXTRA": "1"}
+    )
+    assert (code, stdout, stderr) == (0, "$HOME|a b|*|", "")
+
+    _, stdout, _ = await run(["sh", "-c", 'echo "$EXTRA"'], env={"EXTRA": "set"})
+    assert stdout == "set\n"
+
+
+@pytest.mark.asyncio
+async def test_argv_keeps_the_shell_semantics_of_run():
+    code, _, stderr = await run(["no-such-program-here"])
+    assert code == 127
+    assert "no-such-program-here" in stderr
+
+    _, stdout, _ = await run(["seq", "1000"], truncate_after=10)
+    assert stdout == "1\n2\n3\n4\n5\n" + TRUNCATED_MESSAGE
+
+    with pytest.raises(TimeoutError, match="'sleep 5' timed out"):
+        await run(["sleep", "5"], timeout=0.1)
@@ -0,0 +1,52 @@
+import os
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from computer_use_demo.tools.image import ImageData
+from computer_use_demo.tools.screenshots import ScreenshotStore
+
+
+def test_ring_keeps_only_the_latest_captures():
+    store = ScreenshotStore(size=2)
+    images = [ImageData(f"frame {index}".encode()) for index in range(3)]
+    for image in images:
+        store.add(image)
+    assert [capture.image for capture in store.recent()] == images[1:]
+
+
+def test_captures_are_written_in_the_background_when_a_directory_is_set(tmp_path):
+    store = ScreenshotStore(directory=tmp_path / "shots")
+    store.add(ImageData(b"first"))
+    store.add(ImageData(b"second"))
+    store.flush()
+    assert sorted(path.read_bytes() for path in (tmp_path / "shots").iterdir()) == [
+        b"first",
+        b"second",
+    ]
+
+
+def test_kept_captures_are_pruned_without_listing_the_directory(tmp_path):
+    store = ScreenshotStore(directory=tmp_path, max_bytes=10)
+    store.add(ImageData(b"x" * 6))
+    store.flush()
+    with patch.object(Path, "glob", side_effect=AssertionError("listed again")):
+        store.add(ImageData(b"y" * 6))
+        store.flush()
+    assert [path.read_bytes() for path in tmp_path.iterdir()] == [b"y" * 6]
+
+
+def test_prune_deletes_the_oldest_files_beyond_size_or_age(tmp_path):
+    now = time.time()
+    for index, age in enumerate([300, 200, 100, 0]):
+        path = tmp_path / f"screenshot_{index}.png"
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (now - age, now - age))
+    (tmp_path / "notes.txt").write_bytes(b"x" * 100)
+
+    assert ScreenshotStore(directory=tmp_path, max_age=250).prune(now) == 1
+    assert ScreenshotStore(directory=tmp_path, max_bytes=15).prune(now) == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "notes.txt",
+        "screenshot_3.png",
+    ]
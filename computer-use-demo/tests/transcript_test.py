@@ -0,0 +1,106 @@
+import base64
+import json
+
+from computer_use_demo.tools import ImageData
+from computer_use_demo.transcript import (
+    BlobStore,
+    build_log,
+    dump_log,
+    load_log,
+    snapshot_content,
+    snapshot_messages,
+)
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\nfake-image-payload"
+
+
+def _tool_result(tool_use_id: str):
+    return {
+        "type": "tool_result",
+        "tool_use_id": tool_use_id,
+        "is_error": False,
+        "content": [
+            {"type": "text", "text": "clicked"},
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": "image/png",
+                    "data": base64.b64encode(PNG_BYTES).decode(),
+                },
+            },
+        ],
+    }
+
+
+def test_build_log_attributes_tool_results_to_assistant():
+    messages = [
+        {"role": "user", "content": [{"type": "text", "text": "task"}]},
+        {"role": "user", "content": [_tool_result("1")]},
+    ]
+    log_data = build_log("id-1", messages, timestamp="2024-01-01")
+    assert log_data["timestamp"] == "2024-01-01"
+    assert log_data["identifier"] == "id-1"
+    assert [m["role"] for m in log_data["messages"]] == ["user", "assistant"]
+
+
+def test_dump_log_dedupes_images_and_round_trips(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    messages = [
+        {"role": "user", "content": [_tool_result("1")]},
+        {"role": "user", "content": [_tool_result("2")]},
+    ]
+    log_data = build_log("id-1", messages)
+
+    log_path = tmp_path / "log.json"
+    log_path.write_bytes(dump_log(log_data, store))
+
+    assert len([p for p in store.root.rglob("*") if p.is_file()]) == 1
+    compact = json.loads(log_path.read_text())
+    source = compact["messages"][0]["content"][0]["content"][1]["source"]
+    assert source["type"] == "blob"
+    assert store.get(source["digest"]) == PNG_BYTES
+
+    assert load_log(log_path) == compact
+    assert load_log(log_path, store) == log_data
+
+
+def test_dump_log_stores_shared_image_data(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    image = ImageData.from_bytes(PNG_BYTES)
+    block = {
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/png", "data": image},
+    }
+    log_data = build_log("id-1", [{"role": "user", "content": [block]}])
+
+    compact = json.loads(dump_log(log_data, store))
+
+    assert compact["messages"][0]["content"][0]["source"]["digest"] == image.digest
+    assert store.get(image.digest) == PNG_BYTES
+
+
+def test_snapshot_content_copies_what_the_loop_edits_and_shares_the_rest():
+    tool_use = {"type": "tool_use", "id": "t1", "name": "bash", "input": {"x": 1}}
+    text = {"type": "text", "text": "output"}
+    tool_result = {"type": "tool_result", "tool_use_id": "t1", "content": [text]}
+    messages = [
+        {"role": "assistant", "content": [tool_use]},
+        {"role": "user", "content": [tool_result]},
+    ]
+
+    snapshot = snapshot_messages(messages)
+    tool_result["cache_control"] = {"type": "ephemeral"}
+    text["text"] = "elided"
+    messages.append({"role": "user", "content": "next"})
+
+    assert len(snapshot) == 2
+    assert snapshot[1]["content"] == [
+        {
+            "type": "tool_result",
+            "tool_use_id": "t1",
+            "content": [{"type": "text", "text": "output"}],
+        }
+    ]
+    assert snapshot[0]["content"][0]["input"] is tool_use["input"]
+    assert snapshot_content("plain") == "plain"